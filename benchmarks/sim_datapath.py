@@ -0,0 +1,104 @@
+"""Measure the cost of simulating a clock cycle of typical datapaths.
+
+Every datapath built here is driven by a linear feedback shift register, so that no testbench
+process runs while it is simulated. Two times are reported: the time it takes the simulator to
+simulate a clock cycle, and the part of it spent running the code generated for the design, which
+is measured by running every process of the design once per cycle outside of the scheduler.
+"""
+
+import time
+
+from nmigen.hdl import *
+from nmigen.sim import *
+from nmigen.sim._pyrtl import PyRTLProcess
+
+
+def lfsr(m, width):
+    state = Signal(width, reset=1)
+    taps  = Const(0xb400b400b400b400b400b400b400b400 & ((1 << width) - 1), width)
+    m.d.sync += state.eq(Mux(state[0], (state >> 1) ^ taps, state >> 1))
+    return state
+
+
+def crc16(m):
+    data = lfsr(m, 8)
+    crc  = Signal(16, reset=0xffff)
+    value = crc
+    for bit in range(8):
+        feedback = value[15] ^ data[7 - bit]
+        next_value = Signal(16)
+        m.d.comb += next_value.eq(Cat(feedback, value[:15]) ^ Mux(feedback, 0x1020, 0))
+        value = next_value
+    m.d.sync += crc.eq(value)
+
+
+def alu(m):
+    stimulus = lfsr(m, 35)
+    op = stimulus[32:35]
+    a  = stimulus[:16]
+    b  = stimulus[16:32]
+    result = Signal(16)
+    carry  = Signal()
+    with m.Switch(op):
+        with m.Case(0):
+            m.d.comb += Cat(result, carry).eq(a + b)
+        with m.Case(1):
+            m.d.comb += Cat(result, carry).eq(a - b)
+        with m.Case(2):
+            m.d.comb += result.eq(a & b)
+        with m.Case(3):
+            m.d.comb += result.eq(a | b)
+        with m.Case(4):
+            m.d.comb += result.eq(a ^ b)
+        with m.Case(5):
+            m.d.comb += result.eq(a << b[:4])
+        with m.Case(6):
+            m.d.comb += result.eq(a >> b[:4])
+        with m.Case(7):
+            m.d.comb += result.eq(a.as_signed() < b.as_signed())
+    acc = Signal(16)
+    flags = Signal(2)
+    m.d.sync += [
+        acc.eq(acc + result),
+        flags.eq(Cat(carry, result == 0)),
+    ]
+
+
+def mac(m):
+    stimulus = lfsr(m, 32)
+    a = Signal(signed(16))
+    b = Signal(signed(16))
+    m.d.comb += [
+        a.eq(stimulus[:16]),
+        b.eq(stimulus[16:]),
+    ]
+    acc = Signal(signed(40))
+    product = Signal(signed(32))
+    m.d.comb += product.eq(a * b)
+    m.d.sync += acc.eq(acc + product)
+
+
+def bench(build, cycles=20000):
+    m = Module()
+    build(m)
+    sim = Simulator(m)
+    sim.add_clock(1e-6)
+    start = time.perf_counter()
+    sim.run_until(cycles * 1e-6, run_passive=True)
+    sim_time = (time.perf_counter() - start) / cycles
+
+    processes = [process for process in sim._engine._processes
+                 if isinstance(process, PyRTLProcess)]
+    start = time.perf_counter()
+    for _ in range(cycles):
+        for process in processes:
+            process.run()
+    code_time = (time.perf_counter() - start) / cycles
+    return sim_time, code_time
+
+
+if __name__ == "__main__":
+    print("{:>8} {:>10} {:>10}".format("design", "us/cycle", "code"))
+    for build in (crc16, alu, mac):
+        sim_time, code_time = bench(build)
+        print("{:>8} {:>10.2f} {:>10.2f}".format(build.__name__, sim_time * 1e6, code_time * 1e6))
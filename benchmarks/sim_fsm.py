@@ -0,0 +1,52 @@
+"""Measure the cost of simulating a clock cycle of a large FSM as the number of states grows.
+
+The FSM built here walks through all of its ``count`` states in order, updating a counter and
+a combinatorial output in every state. The ``Switch`` statements generated by ``Module.FSM``
+only have fully specified patterns, and so are compiled to a jump table; for comparison, they are
+also compiled to an ``if``/``elif`` chain, whose cost grows linearly with the number of states.
+"""
+
+import time
+
+from nmigen.hdl import *
+from nmigen.sim import *
+from nmigen.sim import _pyrtl
+
+
+def bench_fsm(count, cycles=2000):
+    m = Module()
+    counter = Signal(16)
+    output  = Signal(range(count))
+    with m.FSM():
+        for index in range(count):
+            with m.State("S{}".format(index)):
+                m.d.sync += counter.eq(counter + index)
+                m.d.comb += output.eq(index)
+                m.next = "S{}".format((index + 1) % count)
+
+    sim = Simulator(m)
+    sim.add_clock(1e-6)
+    def process():
+        for _ in range(cycles):
+            yield
+    sim.add_sync_process(process)
+
+    start = time.perf_counter()
+    sim.run()
+    return (time.perf_counter() - start) / cycles
+
+
+def bench_fsm_chain(count):
+    min_cases = _pyrtl._SWITCH_TABLE_MIN_CASES
+    try:
+        _pyrtl._SWITCH_TABLE_MIN_CASES = count + 2
+        return bench_fsm(count)
+    finally:
+        _pyrtl._SWITCH_TABLE_MIN_CASES = min_cases
+
+
+if __name__ == "__main__":
+    print("{:>8} {:>18} {:>18}".format("states", "table (us/cycle)", "chain (us/cycle)"))
+    for count in (8, 32, 128, 512):
+        print("{:>8} {:>18.2f} {:>18.2f}".format(count,
+            bench_fsm(count) * 1e6, bench_fsm_chain(count) * 1e6))
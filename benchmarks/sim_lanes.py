@@ -0,0 +1,65 @@
+"""Measure the cost of simulating a small datapath over many independent sets of stimulus.
+
+The datapath is a CRC-16 unit fed with one byte per clock cycle. It is simulated ``count`` times
+with the default engine, once for every set of stimulus, and then once with the NumPy engine,
+which evaluates all sets of stimulus at once with one lane for every one of them.
+"""
+
+import random
+import time
+
+from nmigen.hdl import *
+from nmigen.sim import *
+from nmigen.sim.npsim import Drive
+
+
+def crc16(data):
+    m = Module()
+    crc = Signal(16, reset=0xffff)
+    value = crc
+    for bit in range(8):
+        feedback = value[15] ^ data[7 - bit]
+        next_value = Signal(16)
+        m.d.comb += next_value.eq(Cat(feedback, value[:15]) ^ Mux(feedback, 0x1020, 0))
+        value = next_value
+    m.d.sync += crc.eq(value)
+    return m, crc
+
+
+def bench_pysim(stimulus):
+    start = time.perf_counter()
+    for data_bytes in stimulus:
+        data = Signal(8)
+        m, crc = crc16(data)
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        def process():
+            for data_byte in data_bytes:
+                yield data.eq(data_byte)
+                yield
+        sim.add_sync_process(process)
+        sim.run()
+    return time.perf_counter() - start
+
+
+def bench_npsim(stimulus):
+    start = time.perf_counter()
+    data = Signal(8)
+    m, crc = crc16(data)
+    sim = Simulator(m, engine="numpy", lanes=len(stimulus))
+    sim.add_clock(1e-6)
+    def process():
+        for data_bytes in zip(*stimulus):
+            yield Drive(data, data_bytes)
+            yield
+    sim.add_sync_process(process)
+    sim.run()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print("{:>8} {:>14} {:>14}".format("count", "pysim (s)", "numpy (s)"))
+    for count in (1, 10, 100, 1000):
+        stimulus = [[random.randrange(256) for _ in range(100)] for _ in range(count)]
+        print("{:>8} {:>14.3f} {:>14.3f}".format(count,
+            bench_pysim(stimulus), bench_npsim(stimulus)))
@@ -0,0 +1,44 @@
+"""Measure the cost of driving a port from a precomputed sequence of values.
+
+A byte-wide port of a checksum is driven for every clock cycle, either by a synchronous testbench
+process that assigns the next value and waits for the clock edge, or by a stimulus process added
+with `Simulator.add_stimulus`. The time per clock cycle is reported for both.
+"""
+
+import time
+import random
+
+from nmigen.hdl import *
+from nmigen.sim import *
+
+
+def design():
+    data = Signal(8)
+    checksum = Signal(16)
+    m = Module()
+    m.d.sync += checksum.eq(checksum + data)
+    return m, data
+
+
+def bench(kind, values):
+    m, data = design()
+    sim = Simulator(m)
+    sim.add_clock(1e-6)
+    if kind == "process":
+        def process():
+            for value in values:
+                yield data.eq(value)
+                yield
+        sim.add_sync_process(process)
+    elif kind == "stimulus":
+        sim.add_stimulus(data, values)
+    start = time.perf_counter()
+    sim.run()
+    return (time.perf_counter() - start) / len(values)
+
+
+if __name__ == "__main__":
+    values = [random.randrange(256) for _ in range(20000)]
+    print("{:>10} {:>10}".format("driver", "us/cycle"))
+    for kind in ("process", "stimulus"):
+        print("{:>10} {:>10.2f}".format(kind, bench(kind, values) * 1e6))
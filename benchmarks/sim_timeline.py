@@ -0,0 +1,67 @@
+"""Measure the cost of advancing simulation time as the number of timed processes grows.
+
+The first part exercises the timeline on its own: ``count`` clock-like processes with distinct
+periods are rescheduled every time they wake up. The second part runs the full simulator with
+``count`` clock domains and ``count`` testbench processes waiting on ``Delay``.
+
+With a priority queue, the cost of a single advance grows logarithmically with the number of
+pending deadlines instead of linearly.
+"""
+
+import time
+
+from nmigen.hdl import *
+from nmigen.sim import *
+from nmigen.sim.pysim import _Timeline
+
+
+class _Process:
+    def __init__(self, period):
+        self.period   = period
+        self.runnable = False
+
+
+def bench_timeline(count, advances=20000):
+    woken     = []
+    timeline  = _Timeline(woken)
+    processes = [_Process(1e-6 * (1 + index / count)) for index in range(count)]
+    for process in processes:
+        timeline.delay(process.period, process)
+
+    start = time.perf_counter()
+    for _ in range(advances):
+        timeline.advance()
+        for process in woken:
+            process.runnable = False
+            timeline.delay(process.period, process)
+        woken.clear()
+    return (time.perf_counter() - start) / advances
+
+
+def bench_simulator(count, duration=20e-6):
+    m = Module()
+    for index in range(count):
+        m.domains += ClockDomain("cd{}".format(index))
+
+    sim = Simulator(m)
+    for index in range(count):
+        sim.add_clock(1e-6 * (1 + index / count), domain="cd{}".format(index))
+    for index in range(count):
+        def process(index=index):
+            while True:
+                yield Delay(1e-6 * (1 + (index + 0.5) / count))
+        sim.add_process(process)
+
+    advances = 0
+    start = time.perf_counter()
+    while sim._engine.now < duration:
+        sim.advance()
+        advances += 1
+    return (time.perf_counter() - start) / advances
+
+
+if __name__ == "__main__":
+    print("{:>8} {:>18} {:>18}".format("count", "timeline (us/adv)", "simulator (us/adv)"))
+    for count in (10, 100, 200, 500, 1000):
+        print("{:>8} {:>18.2f} {:>18.2f}".format(count,
+            bench_timeline(count) * 1e6, bench_simulator(count) * 1e6))
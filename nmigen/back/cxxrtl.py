@@ -5,7 +5,7 @@ from . import rtlil
 __all__ = ["YosysError", "convert", "convert_fragment"]
 
 
-def _convert_rtlil_text(rtlil_text, black_boxes, *, src_loc_at=0):
+def _convert_rtlil_text(rtlil_text, black_boxes, *, opt_level=None, src_loc_at=0):
     if black_boxes is not None:
         if not isinstance(black_boxes, dict):
             raise TypeError("CXXRTL black boxes must be a dictionary, not {!r}"
@@ -17,6 +17,9 @@ def _convert_rtlil_text(rtlil_text, black_boxes, *, src_loc_at=0):
             if not isinstance(box_source, str):
                 raise TypeError("CXXRTL black box source code must be a string, not {!r}"
                                 .format(box_source))
+    if opt_level is not None and opt_level not in range(7):
+        raise ValueError("CXXRTL optimization level must be an integer from 0 to 6, not {!r}"
+                         .format(opt_level))
 
     yosys = find_yosys(lambda ver: ver >= (0, 9, 3468))
 
@@ -26,16 +29,20 @@ def _convert_rtlil_text(rtlil_text, black_boxes, *, src_loc_at=0):
             script.append("read_ilang <<rtlil\n{}\nrtlil".format(box_source))
     script.append("read_ilang <<rtlil\n{}\nrtlil".format(rtlil_text))
     script.append("delete w:$verilog_initial_trigger")
-    script.append("write_cxxrtl")
+    if opt_level is None:
+        script.append("write_cxxrtl")
+    else:
+        script.append("write_cxxrtl -O{}".format(opt_level))
 
     return yosys.run(["-q", "-"], "\n".join(script), src_loc_at=1 + src_loc_at)
 
 
-def convert_fragment(*args, black_boxes=None, **kwargs):
+def convert_fragment(*args, black_boxes=None, opt_level=None, **kwargs):
     rtlil_text, name_map = rtlil.convert_fragment(*args, **kwargs)
-    return _convert_rtlil_text(rtlil_text, black_boxes, src_loc_at=1), name_map
+    return _convert_rtlil_text(rtlil_text, black_boxes, opt_level=opt_level,
+                               src_loc_at=1), name_map
 
 
-def convert(*args, black_boxes=None, **kwargs):
+def convert(*args, black_boxes=None, opt_level=None, **kwargs):
     rtlil_text = rtlil.convert(*args, **kwargs)
-    return _convert_rtlil_text(rtlil_text, black_boxes, src_loc_at=1)
+    return _convert_rtlil_text(rtlil_text, black_boxes, opt_level=opt_level, src_loc_at=1)
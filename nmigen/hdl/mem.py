@@ -3,6 +3,7 @@ from collections import OrderedDict
 
 from .. import tracer
 from .ast import *
+from .ast import SignalDict
 from .ir import Elaboratable, Instance
 
 
@@ -50,12 +51,12 @@ class Memory:
         self.depth = depth
         self.attrs = OrderedDict(() if attrs is None else attrs)
 
-        # Array of signals for simulation.
-        self._array = Array()
-        if simulate:
-            for addr in range(self.depth):
-                self._array.append(Signal(self.width, name="{}({})"
-                                          .format(name or "memory", addr)))
+        # Signals for simulation, created on demand. Simulators store the contents of a memory
+        # on their own, and only keep these signals in sync with it if they are requested.
+        self._simulate  = simulate
+        self._word_name = name or "memory"
+        self._words     = OrderedDict()
+        self._addrs     = SignalDict()
 
         self.init = init
 
@@ -71,15 +72,28 @@ class Memory:
                              .format(len(self.init), self.depth))
 
         try:
-            for addr in range(len(self._array)):
-                if addr < len(self._init):
-                    self._array[addr].reset = operator.index(self._init[addr])
-                else:
-                    self._array[addr].reset = 0
+            for addr in range(len(self._init)):
+                self._init[addr] = operator.index(self._init[addr])
         except TypeError as e:
             raise TypeError("Memory initialization value at address {:x}: {}"
                             .format(addr, e)) from None
 
+        for addr, word in self._words.items():
+            word.reset = self._init_at(addr)
+
+    def _init_at(self, addr):
+        if addr < len(self._init):
+            return self._init[addr]
+        return 0
+
+    def _word(self, addr):
+        if addr not in self._words:
+            word = Signal(self.width, name="{}({})".format(self._word_name, addr),
+                          reset=self._init_at(addr))
+            self._words[addr] = word
+            self._addrs[word] = addr
+        return self._words[addr]
+
     def read_port(self, *, src_loc_at=0, **kwargs):
         """Get a read port.
 
@@ -114,7 +128,15 @@ class Memory:
 
     def __getitem__(self, index):
         """Simulation only."""
-        return self._array[index]
+        if not self._simulate:
+            raise IndexError("Memory {!r} is not simulated".format(self.name))
+        if isinstance(index, int):
+            if index < 0:
+                index += self.depth
+            if index not in range(self.depth):
+                raise IndexError("Memory address {} is out of range".format(index))
+            return self._word(index)
+        return Array(self._word(addr) for addr in range(self.depth))[index]
 
 
 class ReadPort(Elaboratable):
@@ -181,17 +203,13 @@ class ReadPort(Elaboratable):
             i_ADDR=self.addr,
             o_DATA=self.data,
         )
+        # The contents of the memory are modelled by the simulator, which implements the ports
+        # according to the parameters and the ports of the instance, and the drivers below.
         if self.domain == "comb":
             # Asynchronous port
-            f.add_statements(self.data.eq(self.memory._array[self.addr]))
             f.add_driver(self.data)
         elif not self.transparent:
             # Synchronous, read-before-write port
-            f.add_statements(
-                Switch(self.en, {
-                    1: self.data.eq(self.memory._array[self.addr])
-                })
-            )
             f.add_driver(self.data, self.domain)
         else:
             # Synchronous, write-through port
@@ -199,19 +217,14 @@ class ReadPort(Elaboratable):
             # that are latched when the clock is high. This isn't exactly correct, but it is very
             # close to the correct behavior of a transparent port, and the difference should only
             # be observable in pathological cases of clock gating. A register is injected to
-            # the address input to achieve the correct address-to-data latency. Also, the reset
-            # value of the data output is forcibly set to the 0th initial value, if any--note that
-            # many FPGAs do not guarantee this behavior!
+            # the address input to achieve the correct address-to-data latency; it is the only
+            # signal driven from the domain of the port. Also, the reset value of the data output
+            # is forcibly set to the 0th initial value, if any--note that many FPGAs do not
+            # guarantee this behavior!
             if len(self.memory.init) > 0:
-                self.data.reset = operator.index(self.memory.init[0])
+                self.data.reset = self.memory.init[0]
             latch_addr = Signal.like(self.addr)
-            f.add_statements(
-                latch_addr.eq(self.addr),
-                Switch(ClockSignal(self.domain), {
-                    0: self.data.eq(self.data),
-                    1: self.data.eq(self.memory._array[latch_addr]),
-                }),
-            )
+            f.add_statements(latch_addr.eq(self.addr))
             f.add_driver(latch_addr, self.domain)
             f.add_driver(self.data)
         return f
@@ -285,17 +298,6 @@ class WritePort(Elaboratable):
             i_ADDR=self.addr,
             i_DATA=self.data,
         )
-        if len(self.en) > 1:
-            for index, en_bit in enumerate(self.en):
-                offset = index * self.granularity
-                bits   = slice(offset, offset + self.granularity)
-                write_data = self.memory._array[self.addr][bits].eq(self.data[bits])
-                f.add_statements(Switch(en_bit, { 1: write_data }))
-        else:
-            write_data = self.memory._array[self.addr].eq(self.data)
-            f.add_statements(Switch(self.en, { 1: write_data }))
-        for signal in self.memory._array:
-            f.add_driver(signal, self.domain)
         return f
 
 
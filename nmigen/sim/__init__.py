@@ -1,4 +1,10 @@
 from .core import *
+from .parallel import *
+from .cosim import *
+from ._fst import fst_to_vcd
+from ._coverage import Coverage
 
 
-__all__ = ["Settle", "Delay", "Tick", "Passive", "Active", "Simulator"]
+__all__ = ["Settle", "Delay", "Tick", "Passive", "Active", "Eval", "Simulator",
+           "SimulationResult", "run_parallel", "CosimEndpoint", "CosimClient", "fst_to_vcd",
+           "Coverage"]
@@ -34,7 +34,12 @@ class BaseSimulation:
     def get_signal(self, signal):
         raise NotImplementedError
 
-    slots = NotImplemented
+    # Current and next values of every signal, indexed by the slot returned by `get_signal`.
+    curr = NotImplemented
+    next = NotImplemented
+
+    def set(self, slot, value):
+        raise NotImplementedError
 
     def add_trigger(self, process, signal, *, trigger=None):
         raise NotImplementedError
@@ -45,6 +50,9 @@ class BaseSimulation:
     def wait_interval(self, process, interval):
         raise NotImplementedError
 
+    def wait_future(self, process, future):
+        raise NotImplementedError
+
 
 class BaseEngine:
     def add_coroutine_process(self, process, *, default_cmd):
@@ -53,15 +61,44 @@ class BaseEngine:
     def add_clock_process(self, clock, *, phase, period):
         raise NotImplementedError
 
+    def add_stimulus_process(self, signal, values, *, domain, passive):
+        raise NotImplementedError
+
+    def add_recorder(self, *, vcd_file, gtkw_file, size, duration, clock, cycles,
+                     traces, include, depth):
+        raise NotImplementedError
+
     def reset(self):
         raise NotImplementedError
 
+    def snapshot(self):
+        raise NotImplementedError
+
+    def restore(self, snapshot):
+        raise NotImplementedError
+
     @property
     def now(self):
         raise NotImplementedError
 
-    def advance(self):
+    def advance(self, *, deadline=None):
+        raise NotImplementedError
+
+    # Asyncio futures awaited by processes; time does not advance until they are done.
+    @property
+    def pending_futures(self):
+        raise NotImplementedError
+
+    def coverage(self):
+        raise NotImplementedError
+
+    def profile(self):
+        raise NotImplementedError
+
+    def write_vcd(self, *, vcd_file, gtkw_file, traces,
+                  include=None, depth=None, start=None, stop=None):
         raise NotImplementedError
 
-    def write_vcd(self, *, vcd_file, gtkw_file, traces):
+    def write_fst(self, *, fst_file, gtkw_file, traces,
+                  include=None, depth=None, start=None, stop=None):
         raise NotImplementedError
@@ -0,0 +1,178 @@
+import os
+import sys
+import hashlib
+import marshal
+import tempfile
+
+from .. import __version__
+from ..hdl import *
+from ..hdl.ast import (SignalSet, Operator, Slice, Part, Cat, Repl, ArrayProxy, UserValue, Assign,
+                       Switch)
+
+
+__all__ = []
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+class _StructureHasher:
+    """Describe the structure of statements and values, for use as the key of generated code.
+
+    Every signal is described by its slot index (which is assigned to it if it does not have
+    one yet) and its shape and reset value, and every memory by its index and dimensions; names
+    are not described, since generated code never refers to them. Source locations of statements
+    are described, since they are recorded together with the generated code.
+    """
+    def __init__(self, state):
+        self.state = state
+        self.tokens = []
+
+    def on_value(self, value):
+        tokens = self.tokens
+        value_type = type(value)
+        if value_type is Const:
+            tokens.append(("c", value.value, value.width, value.signed))
+        elif isinstance(value, Signal):
+            tokens.append(("s", self.state.get_signal(value), value.width, value.signed,
+                           value.reset))
+        elif value_type is Operator:
+            tokens.append(("o", value.operator, len(value.operands)))
+            for operand in value.operands:
+                self.on_value(operand)
+        elif value_type is Slice:
+            tokens.append(("sl", value.start, value.stop))
+            self.on_value(value.value)
+        elif value_type is Part:
+            tokens.append(("p", value.width, value.stride))
+            self.on_value(value.value)
+            self.on_value(value.offset)
+        elif value_type is Cat:
+            tokens.append(("cat", len(value.parts)))
+            for part in value.parts:
+                self.on_value(part)
+        elif value_type is Repl:
+            tokens.append(("r", value.count))
+            self.on_value(value.value)
+        elif value_type is ArrayProxy:
+            elems = list(value._iter_as_values())
+            tokens.append(("a", len(elems)))
+            self.on_value(value.index)
+            for elem in elems:
+                self.on_value(elem)
+        elif isinstance(value, UserValue):
+            self.on_value(value._lazy_lower())
+        else:
+            raise _Uncacheable
+
+    def on_statement(self, stmt):
+        tokens = self.tokens
+        if type(stmt) is Assign:
+            tokens.append(("=", stmt.src_loc))
+            self.on_value(stmt.lhs)
+            self.on_value(stmt.rhs)
+        elif isinstance(stmt, Switch):
+            tokens.append(("switch", stmt.src_loc, len(stmt.cases)))
+            self.on_value(stmt.test)
+            for patterns, stmts in stmt.cases.items():
+                tokens.append((patterns, stmt.case_src_locs.get(patterns)))
+                self.on_statement(stmts)
+        elif isinstance(stmt, (list, tuple)):
+            tokens.append(("stmts", len(stmt)))
+            for sub_stmt in stmt:
+                self.on_statement(sub_stmt)
+        else:
+            raise _Uncacheable
+
+    def __call__(self, obj):
+        if isinstance(obj, Value):
+            self.on_value(obj)
+        elif isinstance(obj, SignalSet):
+            self.tokens.append(("set", len(obj)))
+            for signal in obj:
+                self.on_value(signal)
+        elif isinstance(obj, Memory):
+            self.tokens.append(("m", self.state.get_memory(obj), obj.width, obj.depth))
+        elif isinstance(obj, tuple):
+            self.tokens.append(("t", len(obj)))
+            for elem in obj:
+                self(elem)
+        elif obj is None or isinstance(obj, (bool, int, str)):
+            self.tokens.append(obj)
+        else:
+            self.on_statement(obj)
+
+    def digest(self):
+        return hashlib.sha256(repr(self.tokens).encode("utf-8")).hexdigest()
+
+
+def _codegen_digest():
+    # Released versions are distinguished by their version number, but a source checkout may not
+    # have one (or have the same one while the code generator changes), so the source of
+    # the code generator is described too.
+    digest = hashlib.sha256()
+    digest.update(__version__.encode("utf-8"))
+    digest.update(sys.implementation.cache_tag.encode("utf-8"))
+    for module_name in ("_pyrtl", "_nprtl", "_codecache"):
+        module_file = os.path.join(os.path.dirname(__file__), module_name + ".py")
+        try:
+            with open(module_file, "rb") as f:
+                digest.update(f.read())
+        except OSError: # :nocov:
+            pass
+    return digest.hexdigest()
+
+
+class _CodeCache:
+    """On-disk cache of code generated for simulation processes.
+
+    The cache is used if the ``NMIGEN_pysim_cache`` environment variable is set to the path of
+    a directory, which is created if it does not exist. Entries are stored in ``directory`` in
+    marshal form, one file per entry, and so can be shared by every process and run that uses
+    the same directory; they are written atomically, so that concurrent processes never observe
+    a partially written entry. Entries are keyed by the nMigen version and the Python version,
+    and never expire; the directory may be deleted at any time.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.prefix = _codegen_digest()
+
+    @classmethod
+    def from_env(cls):
+        directory = os.getenv("NMIGEN_pysim_cache")
+        if not directory:
+            return None
+        return cls(directory)
+
+    def key(self, state, structure):
+        hasher = _StructureHasher(state)
+        hasher(structure)
+        return hashlib.sha256((self.prefix + hasher.digest()).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + ".marshal")
+
+    def load(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, key, entry):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    marshal.dump(entry, f)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError:
+            # The cache is an optimization only; a read-only or full cache directory must not
+            # prevent simulation.
+            pass
@@ -0,0 +1,83 @@
+__all__ = ["Coverage"]
+
+
+class Coverage:
+    """Branch and toggle coverage of a simulation.
+
+    Coverage is collected by simulators created with ``coverage=True``, and returned by
+    :meth:`Simulator.coverage`. It can be pickled, e.g. to return it from worker processes,
+    and the coverage of many simulations of the same design can be combined with :meth:`merge`.
+
+    Attributes
+    ----------
+    branches : dict of (str, int, tuple of str) to int
+        Number of times every branch of a ``Switch`` statement, including the ones created by
+        ``If``, ``Elif``, ``Else``, ``Case`` and ``Default``, was taken. Branches are identified
+        by the filename and line number of their source, and by their patterns; branches that were
+        never taken are counted as 0.
+    toggles : dict of str to (int, int, int)
+        Width of every signal, and the masks of its bits that rose and that fell, by hierarchical
+        name of the signal.
+    """
+    def __init__(self, *, branches=None, toggles=None):
+        self.branches = {} if branches is None else dict(branches)
+        self.toggles  = {} if toggles  is None else dict(toggles)
+
+    @staticmethod
+    def merge(coverages):
+        """Combine the coverage of many simulations.
+
+        Branch counts are added, and toggle masks are combined, so that a bit is considered toggled
+        if it rose in any simulation and fell in any simulation.
+        """
+        merged = Coverage()
+        for coverage in coverages:
+            for key, count in coverage.branches.items():
+                merged.branches[key] = merged.branches.get(key, 0) + count
+            for name, (width, rose, fell) in coverage.toggles.items():
+                if name in merged.toggles:
+                    merged_width, merged_rose, merged_fell = merged.toggles[name]
+                    if merged_width != width:
+                        raise ValueError("Signal {} has width {} in one coverage and {} in "
+                                         "another; was the coverage collected from different "
+                                         "designs?"
+                                         .format(name, merged_width, width))
+                    rose |= merged_rose
+                    fell |= merged_fell
+                merged.toggles[name] = (width, rose, fell)
+        return merged
+
+    def branch_coverage(self):
+        """Count branches that were taken.
+
+        Returns a tuple ``(taken, total)``.
+        """
+        return (sum(1 for count in self.branches.values() if count),
+                len(self.branches))
+
+    def toggle_coverage(self):
+        """Count signal bits that both rose and fell.
+
+        Returns a tuple ``(toggled, total)``.
+        """
+        return (sum(bin(rose & fell).count("1") for width, rose, fell in self.toggles.values()),
+                sum(width for width, rose, fell in self.toggles.values()))
+
+    def report(self):
+        """Format the coverage as human-readable text, listing what was not covered."""
+        lines = []
+        taken, total = self.branch_coverage()
+        lines.append("Branches: {} of {} taken".format(taken, total))
+        for (filename, lineno, patterns), count in sorted(self.branches.items()):
+            if not count:
+                lines.append("  {}:{}: {} never taken".format(filename, lineno,
+                    "case {}".format(" | ".join(patterns)) if patterns else "default case"))
+
+        toggled, total = self.toggle_coverage()
+        lines.append("Toggles: {} of {} bits toggled".format(toggled, total))
+        for name, (width, rose, fell) in sorted(self.toggles.items()):
+            missing = [bit for bit in range(width) if not (rose & fell) >> bit & 1]
+            if missing:
+                lines.append("  {}: bits {} never toggled".format(name,
+                    ", ".join(str(bit) for bit in missing)))
+        return "\n".join(lines)
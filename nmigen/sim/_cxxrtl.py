@@ -0,0 +1,150 @@
+import ctypes
+import enum
+
+
+__all__ = ["cxxrtl_type", "cxxrtl_object", "cxxrtl_library", "cxxrtl_get_parts",
+           "cxxrtl_vcd_read"]
+
+
+class _cxxrtl_toplevel(ctypes.Structure):
+    pass
+
+
+class _cxxrtl_handle(ctypes.Structure):
+    pass
+
+
+class _cxxrtl_vcd(ctypes.Structure):
+    pass
+
+
+cxxrtl_toplevel = ctypes.POINTER(_cxxrtl_toplevel)
+cxxrtl_handle   = ctypes.POINTER(_cxxrtl_handle)
+cxxrtl_vcd      = ctypes.POINTER(_cxxrtl_vcd)
+
+
+class cxxrtl_type(enum.IntEnum):
+    VALUE  = 0
+    WIRE   = 1
+    MEMORY = 2
+    ALIAS  = 3
+
+
+class cxxrtl_object(ctypes.Structure):
+    _fields_ = [
+        ("_type",   ctypes.c_uint32),
+        ("width",   ctypes.c_size_t),
+        ("lsb_at",  ctypes.c_size_t),
+        ("depth",   ctypes.c_size_t),
+        ("zero_at", ctypes.c_size_t),
+        ("_curr",   ctypes.POINTER(ctypes.c_uint32)),
+        ("_next",   ctypes.POINTER(ctypes.c_uint32)),
+    ]
+
+    @property
+    def type(self):
+        return cxxrtl_type(self._type)
+
+    @property
+    def chunks(self):
+        return ((self.width + 31) // 32) * self.depth
+
+    def _get(self, ptr):
+        value = 0
+        for chunk in range(self.chunks):
+            value |= ptr[chunk] << (chunk * 32)
+        return value
+
+    def _set(self, ptr, value):
+        for chunk in range(self.chunks):
+            ptr[chunk] = (value >> (chunk * 32)) & 0xffffffff
+
+    @property
+    def curr(self):
+        return self._get(self._curr)
+
+    @property
+    def next(self):
+        if self._next:
+            return self._get(self._next)
+        return self._get(self._curr)
+
+    @next.setter
+    def next(self, value):
+        if not self._next:
+            raise ValueError("Cannot assign to a CXXRTL object that is not a wire")
+        self._set(self._next, value)
+
+
+def cxxrtl_library(filename):
+    """Load a shared object built from ``write_cxxrtl`` output with the C API included.
+
+    The shared object must be compiled with the ``CXXRTL_INCLUDE_CAPI_IMPL`` and
+    ``CXXRTL_INCLUDE_VCD_CAPI_IMPL`` macros defined.
+    """
+    library = ctypes.cdll.LoadLibrary(filename)
+
+    library.cxxrtl_design_create.argtypes = []
+    library.cxxrtl_design_create.restype  = cxxrtl_toplevel
+
+    library.cxxrtl_create.argtypes = [cxxrtl_toplevel]
+    library.cxxrtl_create.restype  = cxxrtl_handle
+
+    library.cxxrtl_destroy.argtypes = [cxxrtl_handle]
+    library.cxxrtl_destroy.restype  = None
+
+    library.cxxrtl_eval.argtypes = [cxxrtl_handle]
+    library.cxxrtl_eval.restype  = ctypes.c_int
+
+    library.cxxrtl_commit.argtypes = [cxxrtl_handle]
+    library.cxxrtl_commit.restype  = ctypes.c_int
+
+    library.cxxrtl_step.argtypes = [cxxrtl_handle]
+    library.cxxrtl_step.restype  = ctypes.c_size_t
+
+    library.cxxrtl_get_parts.argtypes = [cxxrtl_handle, ctypes.c_char_p,
+                                         ctypes.POINTER(ctypes.c_size_t)]
+    library.cxxrtl_get_parts.restype  = ctypes.POINTER(cxxrtl_object)
+
+    library.cxxrtl_vcd_create.argtypes = []
+    library.cxxrtl_vcd_create.restype  = cxxrtl_vcd
+
+    library.cxxrtl_vcd_destroy.argtypes = [cxxrtl_vcd]
+    library.cxxrtl_vcd_destroy.restype  = None
+
+    library.cxxrtl_vcd_timescale.argtypes = [cxxrtl_vcd, ctypes.c_int, ctypes.c_char_p]
+    library.cxxrtl_vcd_timescale.restype  = None
+
+    library.cxxrtl_vcd_add_from_without_memories.argtypes = [cxxrtl_vcd, cxxrtl_handle]
+    library.cxxrtl_vcd_add_from_without_memories.restype  = None
+
+    library.cxxrtl_vcd_sample.argtypes = [cxxrtl_vcd, ctypes.c_uint64]
+    library.cxxrtl_vcd_sample.restype  = None
+
+    library.cxxrtl_vcd_read.argtypes = [cxxrtl_vcd, ctypes.POINTER(ctypes.c_void_p),
+                                        ctypes.POINTER(ctypes.c_size_t)]
+    library.cxxrtl_vcd_read.restype  = None
+
+    return library
+
+
+def cxxrtl_get_parts(library, handle, name):
+    """Return the list of :class:`cxxrtl_object` parts for the debug item ``name``."""
+    count = ctypes.c_size_t()
+    parts = library.cxxrtl_get_parts(handle, name.encode("utf-8"), ctypes.byref(count))
+    if not parts:
+        return []
+    return [parts[index] for index in range(count.value)]
+
+
+def cxxrtl_vcd_read(library, vcd):
+    """Return (and discard) the VCD text accumulated by ``vcd`` since the previous read."""
+    data = ctypes.c_void_p()
+    size = ctypes.c_size_t()
+    chunks = []
+    while True:
+        library.cxxrtl_vcd_read(vcd, ctypes.byref(data), ctypes.byref(size))
+        if size.value == 0:
+            break
+        chunks.append(ctypes.string_at(data.value, size.value))
+    return b"".join(chunks)
@@ -0,0 +1,684 @@
+import gzip
+import struct
+import time
+import zlib
+from vcd import VCDWriter
+
+
+__all__ = ["FSTWriter", "FSTReader", "fst_to_vcd"]
+
+
+# The FST ("Fast Signal Trace") format is the native format of GTKWave. A file is a sequence of
+# blocks, each starting with a type byte and a big-endian 64-bit length that includes the length
+# itself. Value changes are stored in blocks covering consecutive time ranges; within a block,
+# the changes of every variable form a separately compressed chain, which is found through
+# an index at the end of the block, so that a viewer only decompresses the variables it displays.
+
+_BL_HDR                 = 0
+_BL_VCDATA              = 1
+_BL_GEOM                = 3
+_BL_HIER                = 4
+_BL_VCDATA_DYN_ALIAS    = 5
+_BL_VCDATA_DYN_ALIAS2   = 8
+
+_ST_VCD_MODULE          = 0
+_ST_VCD_SCOPE           = 254
+_ST_VCD_UPSCOPE         = 255
+
+_VT_VCD_WIRE            = 16
+_VT_GEN_STRING          = 21
+
+_VD_IMPLICIT            = 0
+
+_HDR_LENGTH             = 330
+_HDR_VERSION_SIZE       = 128
+_HDR_DATE_SIZE          = 119
+_HDR_ENDIAN_TEST        = 2.7182818284590452354
+
+# Geometry of variable-length (i.e. string) variables.
+_GEOM_VARLEN            = 0xffffffff
+
+# Values of 1-bit variables other than 0 and 1.
+_RCV_STR                = "xzhuwl-?"
+
+
+def _varint(value):
+    data = bytearray()
+    while value >> 7:
+        data.append((value & 0x7f) | 0x80)
+        value >>= 7
+    data.append(value)
+    return data
+
+
+def _read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+def _read_svarint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            if byte & 0x40:
+                value -= 1 << shift
+            return value, offset
+
+
+def _pack(data, level):
+    # Compressed sections are stored uncompressed if compression does not make them smaller;
+    # readers tell the cases apart by comparing the compressed and uncompressed lengths.
+    packed = zlib.compress(bytes(data), level)
+    if len(packed) < len(data):
+        return packed
+    return bytes(data)
+
+
+def _unpack(data, length):
+    if len(data) == length:
+        return bytes(data)
+    return zlib.decompress(data)
+
+
+class _FSTVar:
+    __slots__ = ("var_type", "size", "handle", "value", "frame", "changes")
+
+    def __init__(self, var_type, size, init):
+        self.var_type = var_type
+        self.size     = size
+        self.handle   = None
+        self.value    = self.frame = init
+        self.changes  = []
+
+
+class FSTWriter:
+    """Writer of FST files.
+
+    The interface is the subset of :class:`vcd.VCDWriter` that is used by the simulator: every
+    variable is registered before the first value change, and value changes are made in order of
+    time. Value changes are buffered per variable, and written out in a compressed block once
+    there are ``block_size`` of them. The file must be seekable, since the header, which
+    includes the time range and the number of variables, is only written when closing it.
+
+    Parameters
+    ----------
+    file : binary file-like object
+        Output file.
+    timescale : int
+        Unit of timestamps, as a power of 10 seconds; e.g. ``-10`` for 100 ps.
+    init_timestamp : int
+        Timestamp of the initial values.
+    block_size : int
+        Number of value changes per block.
+    """
+    def __init__(self, file, *, timescale=-9, init_timestamp=0, block_size=1 << 16):
+        self.file           = file
+        self.timescale      = timescale
+        self.init_timestamp = round(init_timestamp)
+        self.block_size     = block_size
+
+        self._header_pos = file.tell()
+        file.write(bytes(_HDR_LENGTH))
+
+        # Variables are registered in any order, but are assigned handles in the order they appear
+        # in the hierarchy, which is only known once every variable has been registered.
+        self._scopes     = dict()
+        self._names      = 0
+        self._vars       = None
+        self._hierarchy  = None
+
+        self._times      = []
+        self._pending    = 0
+        self._start_time = None
+        self._end_time   = None
+        self._blocks     = 0
+
+    def _scope_entries(self, scope):
+        if isinstance(scope, str):
+            scope = tuple(scope.split("."))
+        if self._vars is not None:
+            raise ValueError("Cannot register variables after value changes")
+        return self._scopes.setdefault(tuple(scope), [])
+
+    def register_var(self, scope, name, var_type, size=None, init=None):
+        if var_type == "wire":
+            size = 1 if size is None else size
+            init = 0 if init is None else init & ((1 << size) - 1)
+        elif var_type == "string":
+            size = 0
+            init = "" if init is None else init
+        else:
+            raise ValueError("Variable type {!r} is not supported in FST files"
+                             .format(var_type))
+        var = _FSTVar(var_type, size, init)
+        self._scope_entries(scope).append((name, var))
+        return var
+
+    def register_alias(self, scope, name, var):
+        self._scope_entries(scope).append((name, var))
+
+    def _freeze(self):
+        # Builds the hierarchy, assigning handles to variables at their first appearance, and emits
+        # the initial values. Scopes are emitted as a tree, since a scope that is opened more than
+        # once would be shown more than once.
+        tree = dict()
+        for scope, entries in self._scopes.items():
+            node = tree
+            for scope_name in scope:
+                node = node.setdefault(scope_name, {})
+            node.setdefault(None, []).extend(entries)
+
+        self._vars = []
+        hierarchy = bytearray()
+        scope_count = 0
+        def emit(node):
+            nonlocal scope_count
+            for name, var in node.get(None, ()):
+                if var.handle is None:
+                    self._vars.append(var)
+                    var.handle = len(self._vars)
+                    alias = 0
+                else:
+                    alias = var.handle
+                if var.var_type == "string":
+                    hierarchy.append(_VT_GEN_STRING)
+                else:
+                    hierarchy.append(_VT_VCD_WIRE)
+                hierarchy.append(_VD_IMPLICIT)
+                hierarchy.extend(name.encode("utf-8") + b"\0")
+                hierarchy.extend(_varint(var.size))
+                hierarchy.extend(_varint(alias))
+                self._names += 1
+            for scope_name, subnode in node.items():
+                if scope_name is None:
+                    continue
+                hierarchy.append(_ST_VCD_SCOPE)
+                hierarchy.append(_ST_VCD_MODULE)
+                hierarchy.extend(scope_name.encode("utf-8") + b"\0" + b"\0")
+                scope_count += 1
+                emit(subnode)
+                hierarchy.append(_ST_VCD_UPSCOPE)
+        emit(tree)
+        self._hierarchy   = hierarchy
+        self._scope_count = scope_count
+
+        # Readers do not use the frame of the first block if it starts at the same time as its
+        # first value change, so the initial values are also emitted as changes.
+        self._start_time = self._end_time = self.init_timestamp
+        self._times.append(self.init_timestamp)
+        for var in self._vars:
+            if var.size or var.var_type == "string":
+                var.changes.append((0, var.value))
+                self._pending += 1
+
+    def change(self, var, timestamp, value):
+        timestamp = round(timestamp)
+        if self._vars is None:
+            self._freeze()
+        if timestamp != self._end_time:
+            if timestamp < self._end_time:
+                raise ValueError("Cannot change value at {} after a change at {}"
+                                 .format(timestamp, self._end_time))
+            if self._pending >= self.block_size:
+                self._write_block()
+            self._times.append(timestamp)
+            self._end_time = timestamp
+        elif not self._times:
+            self._times.append(timestamp)
+
+        if var.var_type == "wire":
+            if not var.size:
+                return
+            value &= (1 << var.size) - 1
+        if var.value == value:
+            return
+        var.value = value
+        time_index = len(self._times) - 1
+        if var.changes and var.changes[-1][0] == time_index:
+            var.changes[-1] = (time_index, value)
+        else:
+            var.changes.append((time_index, value))
+            self._pending += 1
+
+    def _encode_changes(self, var):
+        data = bytearray()
+        prev_index = 0
+        if var.var_type == "string":
+            for time_index, value in var.changes:
+                value = value.encode("utf-8")
+                data += _varint((time_index - prev_index) << 1)
+                data += _varint(len(value))
+                data += value
+                prev_index = time_index
+        elif var.size == 1:
+            for time_index, value in var.changes:
+                data += _varint(((time_index - prev_index) << 2) | (value << 1))
+                prev_index = time_index
+        else:
+            # Bits are packed MSB first, starting from the first byte.
+            length  = (var.size + 7) // 8
+            padding = length * 8 - var.size
+            for time_index, value in var.changes:
+                data += _varint((time_index - prev_index) << 1)
+                data += (value << padding).to_bytes(length, "big")
+                prev_index = time_index
+        return data
+
+    def _write_block(self):
+        frame = bytearray()
+        for var in self._vars:
+            if var.var_type == "wire" and var.size:
+                frame += format(var.frame, "0{}b".format(var.size)).encode("ascii")
+        packed_frame = _pack(frame, 4)
+
+        # Chains are located by their offset from the packing type, which precedes them.
+        chains = bytearray(b"Z")
+        offsets = []
+        memory_required = 0
+        for var in self._vars:
+            if not var.changes:
+                offsets.append(0)
+                continue
+            offsets.append(len(chains))
+            data = self._encode_changes(var)
+            memory_required += len(data)
+            packed = _pack(data, 4) if len(data) > 32 else data
+            if packed is data or len(packed) == len(data):
+                chains += _varint(0) + data
+            else:
+                chains += _varint(len(data)) + packed
+            var.frame = var.value
+            var.changes.clear()
+
+        # The index is a sequence of offset deltas for variables that have a chain, and of run
+        # lengths of variables that do not.
+        index = bytearray()
+        prev_offset = 0
+        no_chain = 0
+        for offset in offsets:
+            if offset == 0:
+                no_chain += 1
+                continue
+            if no_chain:
+                index += _varint(no_chain << 1)
+                no_chain = 0
+            index += _varint(((offset - prev_offset) << 1) | 1)
+            prev_offset = offset
+        if no_chain:
+            index += _varint(no_chain << 1)
+
+        times = bytearray()
+        prev_time = 0
+        for timestamp in self._times:
+            times += _varint(timestamp - prev_time)
+            prev_time = timestamp
+        packed_times = _pack(times, 9)
+
+        body = bytearray()
+        body += struct.pack(">QQQ", self._times[0], self._times[-1], memory_required)
+        body += _varint(len(frame)) + _varint(len(packed_frame)) + _varint(len(self._vars))
+        body += packed_frame
+        body += _varint(len(self._vars))
+        body += chains
+        body += index
+        body += struct.pack(">Q", len(index))
+        body += packed_times
+        body += struct.pack(">QQQ", len(times), len(packed_times), len(self._times))
+        self.file.write(struct.pack(">BQ", _BL_VCDATA, 8 + len(body)) + body)
+
+        self._times.clear()
+        self._pending = 0
+        self._blocks += 1
+
+    def flush(self):
+        """Write out every buffered value change."""
+        if self._times and self._vars:
+            self._write_block()
+
+    def close(self, timestamp):
+        timestamp = round(timestamp)
+        if self._vars is None:
+            self._freeze()
+        if timestamp > self._end_time:
+            self._times.append(timestamp)
+            self._end_time = timestamp
+        self.flush()
+
+        geometry = bytearray()
+        for var in self._vars:
+            geometry += _varint(var.size or _GEOM_VARLEN)
+        packed_geometry = _pack(geometry, 9)
+        self.file.write(struct.pack(">BQQQ", _BL_GEOM, 24 + len(packed_geometry),
+                                    len(geometry), len(self._vars)))
+        self.file.write(packed_geometry)
+
+        packed_hierarchy = gzip.compress(bytes(self._hierarchy), 4)
+        self.file.write(struct.pack(">BQQ", _BL_HIER, 16 + len(packed_hierarchy),
+                                    len(self._hierarchy)))
+        self.file.write(packed_hierarchy)
+
+        end_pos = self.file.tell()
+        self.file.seek(self._header_pos)
+        self.file.write(struct.pack(">BQQQ", _BL_HDR, _HDR_LENGTH - 1,
+                                    self._start_time, self._end_time))
+        self.file.write(struct.pack("<d", _HDR_ENDIAN_TEST))
+        self.file.write(struct.pack(">QQQQQb", self.block_size, self._scope_count, self._names,
+                                    len(self._vars), self._blocks, self.timescale))
+        self.file.write(b"nMigen".ljust(_HDR_VERSION_SIZE, b"\0"))
+        self.file.write(time.asctime().encode("ascii").ljust(_HDR_DATE_SIZE, b"\0"))
+        self.file.write(struct.pack(">Bq", 0, 0)) # Verilog file type, time zero
+        self.file.seek(end_pos)
+        self.file.flush()
+
+
+class FSTReader:
+    """Reader of FST files.
+
+    Reads files written by :class:`FSTWriter`, as well as files written by other tools that use
+    zlib compression and do not contain real-valued variables.
+
+    Parameters
+    ----------
+    file : binary file-like object
+        Input file.
+
+    Attributes
+    ----------
+    timescale : int
+        Unit of timestamps, as a power of 10 seconds.
+    start_time, end_time : int
+        Time range of the value changes.
+    hierarchy : list of tuple
+        Scopes and variables, in order: ``("scope", name)``, ``("upscope",)``, or
+        ``("var", var_type, name, size, handle, is_alias)``, where ``var_type`` is ``"wire"``
+        or ``"string"``.
+    """
+    def __init__(self, file):
+        self._data = data = file.read()
+        self._blocks = []
+        self._sizes  = None
+        self.hierarchy = []
+
+        offset = 0
+        while offset < len(data):
+            block_type = data[offset]
+            length, = struct.unpack_from(">Q", data, offset + 1)
+            if length == 0:
+                raise ValueError("FST file is incomplete")
+            body = offset + 1
+            if block_type == _BL_HDR:
+                self.start_time, self.end_time = struct.unpack_from(">QQ", data, body + 8)
+                self.timescale, = struct.unpack_from(">b", data, body + 72)
+            elif block_type in (_BL_VCDATA, _BL_VCDATA_DYN_ALIAS, _BL_VCDATA_DYN_ALIAS2):
+                self._blocks.append((block_type, body, length))
+            elif block_type == _BL_GEOM:
+                uncompressed_length, var_count = struct.unpack_from(">QQ", data, body + 8)
+                geometry = _unpack(data[body + 24:body + length], uncompressed_length)
+                self._sizes = []
+                geometry_offset = 0
+                for _ in range(var_count):
+                    size, geometry_offset = _read_varint(geometry, geometry_offset)
+                    if size == 0:
+                        raise ValueError("Real-valued variables are not supported")
+                    self._sizes.append(0 if size == _GEOM_VARLEN else size)
+            elif block_type == _BL_HIER:
+                self._read_hierarchy(gzip.decompress(data[body + 16:body + length]))
+            else:
+                raise ValueError("FST block type {} is not supported".format(block_type))
+            offset = body + length
+
+        if self._sizes is None:
+            raise ValueError("FST file does not have a geometry block")
+
+    def _read_hierarchy(self, data):
+        offset = 0
+        handles = 0
+        while offset < len(data):
+            tag = data[offset]
+            offset += 1
+            if tag == _ST_VCD_SCOPE:
+                name_end = data.index(b"\0", offset + 1)
+                name = data[offset + 1:name_end].decode("utf-8")
+                offset = data.index(b"\0", name_end + 1) + 1
+                self.hierarchy.append(("scope", name))
+            elif tag == _ST_VCD_UPSCOPE:
+                self.hierarchy.append(("upscope",))
+            elif tag < _ST_VCD_SCOPE - 2:
+                name_end = data.index(b"\0", offset + 1)
+                name = data[offset + 1:name_end].decode("utf-8")
+                size,  offset = _read_varint(data, name_end + 1)
+                alias, offset = _read_varint(data, offset)
+                if alias == 0:
+                    handles += 1
+                    handle = handles
+                else:
+                    handle = alias
+                var_type = "string" if tag == _VT_GEN_STRING else "wire"
+                self.hierarchy.append(("var", var_type, name, size, handle, alias != 0))
+            else:
+                raise ValueError("FST hierarchy entry type {} is not supported".format(tag))
+
+    def _read_chain(self, handle, data, changes):
+        size = self._sizes[handle - 1]
+        offset = 0
+        time_index = 0
+        while offset < len(data):
+            code, offset = _read_varint(data, offset)
+            if size == 0:
+                length, offset = _read_varint(data, offset)
+                value = data[offset:offset + length].decode("utf-8")
+                offset += length
+                time_index += code >> 1
+            elif size == 1:
+                if code & 1:
+                    value = _RCV_STR[(code >> 1) & 7]
+                    time_index += code >> 4
+                else:
+                    value = "01"[(code >> 1) & 1]
+                    time_index += code >> 2
+            else:
+                time_index += code >> 1
+                if code & 1:
+                    value = data[offset:offset + size].decode("ascii")
+                    offset += size
+                else:
+                    length = (size + 7) // 8
+                    bits = int.from_bytes(data[offset:offset + length], "big")
+                    value = format(bits >> (length * 8 - size), "0{}b".format(size))
+                    offset += length
+            changes.append((time_index, handle, value))
+
+    def _read_block(self, block_type, body, length):
+        data = self._data
+        end = body + length
+
+        uncompressed_length, compressed_length, item_count = \
+            struct.unpack_from(">QQQ", data, end - 24)
+        times_data = _unpack(data[end - 24 - compressed_length:end - 24], uncompressed_length)
+        times = []
+        timestamp = 0
+        times_offset = 0
+        for _ in range(item_count):
+            delta, times_offset = _read_varint(times_data, times_offset)
+            timestamp += delta
+            times.append(timestamp)
+
+        offset = body + 32
+        frame_length, offset = _read_varint(data, offset)
+        frame_packed_length, offset = _read_varint(data, offset)
+        _, offset = _read_varint(data, offset)
+        frame_data = _unpack(data[offset:offset + frame_packed_length], frame_length)
+        frame = {}
+        frame_offset = 0
+        for handle, size in enumerate(self._sizes, 1):
+            if size:
+                frame[handle] = frame_data[frame_offset:frame_offset + size].decode("ascii")
+                frame_offset += size
+        offset += frame_packed_length
+        _, offset = _read_varint(data, offset)
+        chains_pos = offset
+        if data[chains_pos] != ord("Z"):
+            raise ValueError("FST compression type {!r} is not supported"
+                             .format(chr(data[chains_pos])))
+
+        index_end = end - 24 - compressed_length - 8
+        index_length, = struct.unpack_from(">Q", data, index_end)
+        index_pos = index_end - index_length
+
+        # Decodes the index into the offset of the chain of every variable that has one,
+        # or the handle of another variable that has an identical chain.
+        offsets = []
+        aliases = {}
+        index_offset = index_pos
+        prev_offset = 0
+        prev_alias = 0
+        while index_offset < index_end:
+            if block_type == _BL_VCDATA_DYN_ALIAS2 and data[index_offset] & 1:
+                code, index_offset = _read_svarint(data, index_offset)
+                code >>= 1
+                if code > 0:
+                    prev_offset += code
+                    offsets.append(prev_offset)
+                else:
+                    if code < 0:
+                        prev_alias = -code
+                    aliases[len(offsets) + 1] = prev_alias
+                    offsets.append(None)
+                continue
+            code, index_offset = _read_varint(data, index_offset)
+            if block_type != _BL_VCDATA_DYN_ALIAS2 and code == 0:
+                alias, index_offset = _read_varint(data, index_offset)
+                aliases[len(offsets) + 1] = alias
+                offsets.append(None)
+            elif block_type != _BL_VCDATA_DYN_ALIAS2 and code & 1:
+                prev_offset += code >> 1
+                offsets.append(prev_offset)
+            else:
+                offsets.extend([0] * (code >> 1))
+
+        chain_ends = {}
+        next_end = index_pos - chains_pos
+        for chain_offset in sorted((offset for offset in offsets if offset), reverse=True):
+            chain_ends[chain_offset] = next_end
+            next_end = chain_offset
+
+        chains = {}
+        for handle, chain_offset in enumerate(offsets, 1):
+            if not chain_offset:
+                continue
+            chain_length, start = _read_varint(data, chains_pos + chain_offset)
+            chain_data = data[start:chains_pos + chain_ends[chain_offset]]
+            if chain_length:
+                chain_data = zlib.decompressobj().decompress(chain_data)
+            chains[handle] = chain_data
+
+        changes = []
+        for handle, chain_data in chains.items():
+            self._read_chain(handle, chain_data, changes)
+        for handle, alias in aliases.items():
+            if alias in chains:
+                self._read_chain(handle, chains[alias], changes)
+        changes.sort(key=lambda change: change[0])
+        begin_time, = struct.unpack_from(">Q", data, body + 8)
+        return begin_time, times, frame, [(times[time_index], handle, value)
+                                          for time_index, handle, value in changes]
+
+    def __iter__(self):
+        """Iterate over value changes.
+
+        Yields ``(timestamp, handle, value)`` tuples in order of time, starting with the value of
+        every variable at ``start_time``. Values of wires are strings of ``0``, ``1``, ``x``, etc.,
+        and values of string variables are strings.
+        """
+        for block_index, block in enumerate(self._blocks):
+            begin_time, times, frame, changes = self._read_block(*block)
+            # Like other readers, only use the frame of the first block if its value changes
+            # do not start at the same time.
+            if block_index == 0 and begin_time != times[0]:
+                for handle, value in frame.items():
+                    yield begin_time, handle, value
+            yield from changes
+
+
+def fst_to_vcd(fst_file, vcd_file):
+    """Convert an FST file to a Value Change Dump file.
+
+    Arguments
+    ---------
+    fst_file : str or binary file-like object
+        FST file or filename, e.g. written by :meth:`Simulator.write_fst`.
+    vcd_file : str or file-like object
+        Verilog Value Change Dump file or filename.
+    """
+    if isinstance(fst_file, str):
+        with open(fst_file, "rb") as fst_file:
+            reader = FSTReader(fst_file)
+    else:
+        reader = FSTReader(fst_file)
+    if isinstance(vcd_file, str):
+        with open(vcd_file, "wt") as vcd_file:
+            _write_vcd(reader, vcd_file)
+    else:
+        _write_vcd(reader, vcd_file)
+
+
+def _write_vcd(reader, vcd_file):
+    def vcd_value(var_type, value):
+        if var_type == "wire" and value and value.strip("01") == "":
+            return int(value, 2)
+        return value
+
+    changes = iter(reader)
+    initial = {}
+    pending = None
+    for change in changes:
+        timestamp, handle, value = change
+        if timestamp != reader.start_time:
+            pending = change
+            break
+        initial[handle] = value
+
+    unit, scale = divmod(reader.timescale, 3)
+    vcd_writer = VCDWriter(vcd_file,
+        timescale="{} {}".format(10 ** scale, ["s", "ms", "us", "ns", "ps", "fs"][-unit]),
+        comment="Converted from FST by nMigen")
+    vcd_vars = {}
+    var_types = {}
+    scope = []
+    for entry in reader.hierarchy:
+        if entry[0] == "scope":
+            scope.append(entry[1])
+        elif entry[0] == "upscope":
+            scope.pop()
+        else:
+            _, var_type, name, size, handle, is_alias = entry
+            if is_alias:
+                vcd_writer.register_alias(scope=scope, name=name, var=vcd_vars[handle])
+                continue
+            if var_type == "string":
+                size, init = None, ""
+            else:
+                init = "x" * size if size else 0
+            var_types[handle] = var_type
+            vcd_vars[handle] = vcd_writer.register_var(
+                scope=scope, name=name, var_type=var_type, size=size,
+                init=vcd_value(var_type, initial.get(handle, init)))
+
+    if pending is not None:
+        timestamp, handle, value = pending
+        vcd_writer.change(vcd_vars[handle], timestamp, vcd_value(var_types[handle], value))
+        for timestamp, handle, value in changes:
+            vcd_writer.change(vcd_vars[handle], timestamp, vcd_value(var_types[handle], value))
+    vcd_writer.close(reader.end_time)
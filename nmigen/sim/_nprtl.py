@@ -0,0 +1,442 @@
+import numpy as np
+
+from ..hdl import *
+from ..hdl.ast import SignalSet
+from ._pyrtl import (PyRTLProcess, _RHSValueCompiler, _LHSValueCompiler, _StatementCompiler,
+                     _FragmentCompiler)
+
+
+__all__ = []
+
+
+# Signals up to this width are stored in lanes of `np.int64`, and wider ones in lanes of Python
+# integers (arrays of `object`). The width of every intermediate value is known, and operations
+# producing values wider than this are computed on Python integers, so that they cannot overflow.
+_LANE_WIDTH = 63
+
+
+def _lane_dtype(width):
+    if width <= _LANE_WIDTH:
+        return np.int64
+    return object
+
+
+def _lanes(value):
+    # NumPy converts integers that do not fit in `np.int64` to `np.uint64` (and mixes of those with
+    # `np.int64` to floats); such values are converted to arrays of Python integers instead.
+    value = np.asarray(value)
+    if value.dtype.kind != "i":
+        value = value.astype(object)
+    return value
+
+
+def _wide(value):
+    # Unlike `np.asarray(value, dtype=object)`, converts `np.int64` scalars to Python integers.
+    return np.asarray(value).astype(object, copy=False)
+
+
+def _where(cond, lhs, rhs):
+    lhs, rhs = _lanes(lhs), _lanes(rhs)
+    value = np.where(cond, lhs, rhs)
+    if object in (lhs.dtype, rhs.dtype):
+        # `np.where` may convert 0-dimensional arrays of Python integers back to `np.int64`.
+        value = value.astype(object)
+    return value
+
+
+def _sign(value, sign):
+    # Values of signals wider than a lane are sign extended as Python integers, even if they are
+    # stored in lanes of `np.int64`, since their sign bit does not fit in `np.int64`.
+    value = _lanes(value)
+    if sign < -(1 << (_LANE_WIDTH - 1)):
+        value = value.astype(object)
+    return _where(value & sign, value | sign, value)
+
+
+def _zdiv(lhs, rhs):
+    rhs = _lanes(rhs)
+    is_zero = rhs == 0
+    return _where(is_zero, 0, _lanes(lhs) // _where(is_zero, 1, rhs))
+
+
+def _zmod(lhs, rhs):
+    rhs = _lanes(rhs)
+    is_zero = rhs == 0
+    return _where(is_zero, 0, _lanes(lhs) % _where(is_zero, 1, rhs))
+
+
+def _parity(value, width):
+    shift = 1
+    while shift < width:
+        shift <<= 1
+    while shift > 1:
+        shift >>= 1
+        value = value ^ (value >> shift)
+    return value & 1
+
+
+def _table(values):
+    if all(-(1 << _LANE_WIDTH) <= value < (1 << _LANE_WIDTH) for value in values):
+        return np.array(values, dtype=np.int64)
+    return np.array(values, dtype=object)
+
+
+def _index(value, count):
+    # Out of bounds indexes select the last element.
+    return np.minimum(np.asarray(value, dtype=np.int64), count - 1)
+
+
+def _select(index, elems, lane_index):
+    return np.stack(np.broadcast_arrays(lane_index, *elems)[1:])[index, lane_index]
+
+
+# Lanes are 64-bit integers, so sign extension must not add to values that may overflow.
+def _gen_sign(gen, width):
+    return f"sign({(1 << width) - 1} & {gen}, {-1 << (width - 1)})"
+
+
+class _NumPyRHSValueCompiler(_RHSValueCompiler):
+    helpers = {
+        "sign":   _sign,
+        "zdiv":   _zdiv,
+        "zmod":   _zmod,
+        "bit":    lambda value: np.asarray(value, dtype=np.int64),
+        "wide":   _wide,
+        "parity": _parity,
+        "table":  _table,
+        "index":  _index,
+        "select": _select,
+        "where":  _where,
+        "land":   np.logical_and,
+        "lnot":   np.logical_not,
+        "any_":   np.any,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Whether the value being compiled is wider than `_LANE_WIDTH`, in which case its
+        # operands are converted to Python integers.
+        self._wide = False
+
+    def _gen_sign(self, gen, width):
+        if self._wide:
+            # The sign extended value of a narrow operand of a wide value is in `np.int64` again.
+            return f"wide({_gen_sign(gen, width)})"
+        return _gen_sign(gen, width)
+
+    def on_value(self, value):
+        parent_wide = self._wide
+        self._wide = wide = len(value) > _LANE_WIDTH
+        try:
+            gen_value = super().on_value(value)
+        finally:
+            self._wide = parent_wide
+        if parent_wide and not wide:
+            return f"wide({gen_value})"
+        if wide and not isinstance(value, (Const, Signal)):
+            # NumPy converts the results of some operations on arrays of Python integers that have
+            # no dimensions, e.g. of constants, back to `np.int64` if they fit.
+            return f"wide({gen_value})"
+        return gen_value
+
+    def on_Const(self, value):
+        if self.consts is not None:
+            if len(value) > _LANE_WIDTH:
+                return f"wide({self._gen_const_param(value)})"
+            return self._gen_const_param(value)
+        if -(1 << _LANE_WIDTH) <= value.value < (1 << _LANE_WIDTH):
+            return f"{value.value}"
+        return f"wide({value.value})"
+
+    def on_Operator(self, value):
+        def mask(value):
+            value_mask = (1 << len(value)) - 1
+            return f"({value_mask} & {self(value)})"
+
+        if len(value.operands) == 1:
+            arg, = value.operands
+            if value.operator == "b":
+                return f"bit(0 != {mask(arg)})"
+            if value.operator == "r|":
+                return f"bit(0 != {mask(arg)})"
+            if value.operator == "r&":
+                return f"bit({(1 << len(arg)) - 1} == {mask(arg)})"
+            if value.operator == "r^":
+                return f"parity({mask(arg)}, {len(arg)})"
+        elif len(value.operands) == 2:
+            if value.operator in ("==", "!=", "<", "<=", ">", ">="):
+                # Comparisons produce lanes of booleans, which do not support arithmetic.
+                return f"bit{super().on_Operator(value)}"
+        elif len(value.operands) == 3:
+            if value.operator == "m":
+                sel, val1, val0 = value.operands
+                return f"where(1 & {self(sel)}, {self(val1)}, {self(val0)})"
+        return super().on_Operator(value)
+
+    def on_ArrayProxy(self, value):
+        elems = list(value._iter_as_values())
+        if not elems:
+            return f"0"
+        index_mask = (1 << len(value.index)) - 1
+        gen_index = self.emitter.def_var("rhs_index",
+            f"index({index_mask} & {self(value.index)}, {len(elems)})")
+        if all(type(elem) is Const for elem in elems):
+            gen_table = self.emitter.def_global("table",
+                f"table(({', '.join(f'{elem.value}' for elem in elems)},))")
+            return f"{gen_table}[{gen_index}]"
+        gen_elems = ", ".join(self(elem) for elem in elems)
+        return f"select({gen_index}, ({gen_elems},), lane_index)"
+
+
+class _NumPyLHSValueCompiler(_LHSValueCompiler):
+    def __init__(self, state, emitter, *, rhs, outputs=None, slot_backed=None):
+        super().__init__(state, emitter, rhs=rhs, outputs=outputs, slot_backed=slot_backed)
+        self.lrhs = _NumPyRHSValueCompiler(state, emitter, mode="next", inputs=None,
+                                           slot_backed=slot_backed)
+        # If not None, the name of a variable holding the lanes in which the assignment takes
+        # place; the other lanes keep their next value.
+        self.cond = None
+
+    _gen_sign = staticmethod(_gen_sign)
+
+    def on_Signal(self, value):
+        if self.outputs is not None:
+            self.outputs.add(value)
+
+        def gen(arg):
+            if len(value) > _LANE_WIDTH:
+                arg = f"wide({arg})"
+            value_sign = self._sign(value, arg)
+            signal_index = self.state.get_signal(value)
+            if value in self.slot_backed:
+                if self.cond is not None:
+                    value_sign = f"where({self.cond}, {value_sign}, next[{signal_index}])"
+                self.emitter.append(f"set({signal_index}, {value_sign})")
+            else:
+                if self.cond is not None:
+                    value_sign = f"where({self.cond}, {value_sign}, next_{signal_index})"
+                self.emitter.append(f"next_{signal_index} = {value_sign}")
+        return gen
+
+    def on_Slice(self, value):
+        gen = super().on_Slice(value)
+        if len(value.value) > _LANE_WIDTH:
+            return lambda arg: gen(f"wide({arg})")
+        return gen
+
+    def on_Part(self, value):
+        def gen(arg):
+            width_mask = (1 << value.width) - 1
+            offset_mask = (1 << len(value.offset)) - 1
+            offset = f"({value.stride} * ({offset_mask} & {self.rrhs(value.offset)}))"
+            if len(value.value) > _LANE_WIDTH:
+                arg = f"wide({arg})"
+                offset = f"wide({offset})"
+            self(value.value)(f"({self.lrhs(value.value)} & " \
+                f"~({width_mask} << {offset}) | " \
+                f"(({width_mask} & {arg}) << {offset}))")
+        return gen
+
+    def on_Cat(self, value):
+        gen = super().on_Cat(value)
+        if len(value) > _LANE_WIDTH:
+            return lambda arg: gen(f"wide({arg})")
+        return gen
+
+    def on_ArrayProxy(self, value):
+        def gen(arg):
+            index_mask = (1 << len(value.index)) - 1
+            gen_index = self.emitter.def_var("index", f"{self.rrhs(value.index)} & {index_mask}")
+            if not value.elems:
+                self.emitter.append(f"pass")
+                return
+            gen_arg = self.emitter.def_var("arg", arg)
+            cond = self.cond
+            for index, elem in enumerate(value.elems):
+                if index < len(value.elems) - 1:
+                    gen_check = f"({index} == {gen_index})"
+                else:
+                    gen_check = f"({index} <= {gen_index})"
+                if cond is not None:
+                    gen_check = f"land({cond}, {gen_check})"
+                self.cond = self.emitter.def_var("sel", gen_check)
+                self.emitter.append(f"if any_({self.cond}):")
+                with self.emitter.indent():
+                    self(elem)(gen_arg)
+            self.cond = cond
+        return gen
+
+
+class _NumPyStatementCompiler(_StatementCompiler):
+    def __init__(self, state, emitter, *, inputs=None, outputs=None, slot_backed=None,
+                 coverage=None):
+        super().__init__(state, emitter, inputs=inputs, outputs=outputs, slot_backed=slot_backed,
+                         coverage=coverage)
+        self.rhs = _NumPyRHSValueCompiler(state, emitter, mode="curr", inputs=inputs)
+        self.lhs = _NumPyLHSValueCompiler(state, emitter, rhs=self.rhs, outputs=outputs,
+                                          slot_backed=slot_backed)
+
+    # Control flow is replaced with predication, so the next value of a signal never needs to be
+    # selected at run time.
+    @staticmethod
+    def _slot_backed_signals(stmts):
+        return SignalSet()
+
+    def on_Switch(self, stmt):
+        # Every case is evaluated in the lanes where its patterns are the first ones to match,
+        # and skipped if there are no such lanes.
+        gen_test = self.emitter.def_var("test",
+            f"{(1 << len(stmt.test)) - 1} & {self.rhs(stmt.test)}")
+        cond = gen_rest = self.lhs.cond
+        for index, (patterns, stmts) in enumerate(stmt.cases.items()):
+            if not patterns:
+                gen_case = gen_rest
+            else:
+                gen_checks = []
+                for pattern in patterns:
+                    if "-" in pattern:
+                        mask  = int("".join("0" if b == "-" else "1" for b in pattern), 2)
+                        value = int("".join("0" if b == "-" else  b  for b in pattern), 2)
+                        gen_checks.append(f"({value} == ({mask} & {gen_test}))")
+                    else:
+                        value = int(pattern, 2)
+                        gen_checks.append(f"({value} == {gen_test})")
+                gen_match = self.emitter.def_var("match", " | ".join(gen_checks))
+                if gen_rest is None:
+                    gen_case = gen_match
+                else:
+                    gen_case = self.emitter.def_var("case", f"land({gen_rest}, {gen_match})")
+                if index < len(stmt.cases) - 1:
+                    if gen_rest is None:
+                        gen_rest = self.emitter.def_var("rest", f"lnot({gen_match})")
+                    else:
+                        gen_rest = self.emitter.def_var("rest",
+                            f"land({gen_rest}, lnot({gen_match}))")
+
+            if gen_case is None:
+                self(stmts)
+            else:
+                self.emitter.append(f"if any_({gen_case}):")
+                with self.emitter.indent():
+                    self.lhs.cond = gen_case
+                    self(stmts)
+                    self.lhs.cond = cond
+            if not patterns:
+                break
+
+
+class _NumPyFragmentCompiler(_FragmentCompiler):
+    _statement_compiler = _NumPyStatementCompiler
+
+    def _compile_process(self, process, signals, emit, exec_locals={}, *,
+                         slot_backed=SignalSet()):
+        if process.is_comb:
+            emit_lanes = emit
+        else:
+            # A synchronous process is woken up by an edge of its clock in any of the lanes, and
+            # only updates the lanes in which there was one.
+            def emit_lanes(emitter):
+                emitter.append(f"edge = edges.pop(process)")
+                emit(emitter)
+                if signals:
+                    emitter.append(f"if not edge.all():")
+                    with emitter.indent():
+                        for signal in signals:
+                            signal_index = self.state.get_signal(signal)
+                            emitter.append(f"next_{signal_index} = where(edge, "
+                                           f"next_{signal_index}, next[{signal_index}])")
+
+        super()._compile_process(process, signals, emit_lanes, exec_locals,
+                                 slot_backed=slot_backed)
+
+    def _emit_set(self, emitter, signal_index):
+        emitter.append(f"set({signal_index}, next_{signal_index})")
+
+    def _exec_locals(self, process):
+        return {
+            **super()._exec_locals(process),
+            **_NumPyRHSValueCompiler.helpers,
+            "lane_index": self.state.lane_index,
+            "edges": self.state.edges,
+            "process": process,
+        }
+
+    def _memory_addr(self, compiler, memory, addr):
+        return f"index({(1 << len(addr)) - 1} & {compiler(addr)}, {memory.depth})"
+
+    def _memory_read(self, compiler, memory, addr):
+        if memory.depth == 0:
+            return f"0"
+        return f"memory_data[{self._memory_addr(compiler, memory, addr)}, lane_index]"
+
+    def _compile_memory_write(self, fragment):
+        memory = fragment.parameters["MEMID"]
+        clk,  _ = fragment.named_ports["CLK"]
+        en,   _ = fragment.named_ports["EN"]
+        addr, _ = fragment.named_ports["ADDR"]
+        data, _ = fragment.named_ports["DATA"]
+
+        process = PyRTLProcess(is_comb=False, kind="memory", src_loc=memory.src_loc)
+        domain = self._memory_domain(fragment, clk)
+        clk_trigger = 0 if domain is not None and domain.clk_edge == "neg" else 1
+        self._add_trigger(process, clk, trigger=clk_trigger)
+
+        def emit(emitter):
+            if memory.depth == 0:
+                emitter.append(f"pass")
+                return
+            compiler = _NumPyRHSValueCompiler(self.state, emitter, mode="curr")
+            width_mask = (1 << memory.width) - 1
+            if len(en) == 1:
+                gen_en = emitter.def_var("en",
+                    f"where(land(edge, 1 & {compiler(en)}), {width_mask}, 0)")
+            else:
+                gen_en = emitter.def_var("en",
+                    f"where(edge, {width_mask} & {compiler(en)}, 0)")
+            emitter.append(f"if any_({gen_en}):")
+            with emitter.indent():
+                emitter.append(f"memory.write({self._memory_addr(compiler, memory, addr)}, "
+                               f"{width_mask} & {compiler(data)}, {gen_en})")
+        self._compile_process(process, (), emit, self._memory_exec_locals(memory))
+        return process
+
+    def _compile_memory_read(self, fragment):
+        memory = fragment.parameters["MEMID"]
+        clk,  _ = fragment.named_ports["CLK"]
+        en,   _ = fragment.named_ports["EN"]
+        addr, _ = fragment.named_ports["ADDR"]
+        data, _ = fragment.named_ports["DATA"]
+
+        if not fragment.parameters["CLK_ENABLE"]:
+            # Asynchronous port.
+            def emit(emitter, inputs):
+                compiler = _NumPyRHSValueCompiler(self.state, emitter, mode="curr",
+                                                  inputs=inputs)
+                lhs_compiler = _NumPyLHSValueCompiler(self.state, emitter, rhs=compiler)
+                lhs_compiler(data)(self._memory_read(compiler, memory, addr))
+
+        elif fragment.parameters["TRANSPARENT"]:
+            # Synchronous, write-through port; see `ReadPort.elaborate` for details of the model.
+            domain = self._memory_domain(fragment, clk)
+            latch_addr, = fragment.drivers[next(name for name in fragment.drivers if name)]
+            clk_level = 0 if domain is not None and domain.clk_edge == "neg" else 1
+            def emit(emitter, inputs):
+                compiler = _NumPyRHSValueCompiler(self.state, emitter, mode="curr",
+                                                  inputs=inputs)
+                lhs_compiler = _NumPyLHSValueCompiler(self.state, emitter, rhs=compiler)
+                # The port is not sensitive to its own output.
+                hold_compiler = _NumPyRHSValueCompiler(self.state, emitter, mode="curr")
+                lhs_compiler(data)(f"where({clk_level} == {compiler(clk)}, "
+                                   f"{self._memory_read(compiler, memory, latch_addr)}, "
+                                   f"{hold_compiler(data)})")
+
+        else:
+            # Synchronous, read-before-write port.
+            def emit(emitter, inputs):
+                compiler = _NumPyRHSValueCompiler(self.state, emitter, mode="curr")
+                lhs_compiler = _NumPyLHSValueCompiler(self.state, emitter, rhs=compiler)
+                lhs_compiler.cond = emitter.def_var("en",
+                    f"0 != ({(1 << len(en)) - 1} & {compiler(en)})")
+                lhs_compiler(data)(self._memory_read(compiler, memory, addr))
+
+        return data._lhs_signals(), emit
@@ -0,0 +1,126 @@
+from collections import Counter
+
+
+__all__ = ["ProcessProfile", "SimulationProfile"]
+
+
+class ProcessProfile:
+    """Profile of a simulation process.
+
+    Attributes
+    ----------
+    name : str
+        For a process compiled from HDL, the hierarchical name of its fragment, e.g. ``"top.cpu"``.
+        For a clock or stimulus process, the name of the driven signal. For a testbench process,
+        the qualified name of its function.
+    kind : str or None
+        ``"comb"`` for combinatorial logic, the name of the clock domain for synchronous logic,
+        ``"memory"`` for a memory write port, ``"clock"`` for a clock process, ``"stimulus"`` for
+        a stimulus process, and ``"testbench"`` for a testbench process.
+    src_loc : tuple of (str, int) or None
+        Location of the first statement of the logic, of the memory, or of the testbench function.
+    calls : int
+        Number of times the process ran.
+    time : float
+        Wall time spent running the process, in seconds.
+    updates : int
+        Number of signal updates the process scheduled.
+    """
+    def __init__(self, *, name, kind, src_loc):
+        self.name    = name
+        self.kind    = kind
+        self.src_loc = src_loc
+        self.calls   = 0
+        self.time    = 0.0
+        self.updates = 0
+
+    def __repr__(self):
+        return "<ProcessProfile {} {} calls={} time={:.6f} updates={}>".format(
+            self.name, self.kind, self.calls, self.time, self.updates)
+
+
+class SimulationProfile:
+    """Profile of a simulation, collected by :meth:`Simulator.profile`.
+
+    Attributes
+    ----------
+    processes : list of ProcessProfile
+        Every process that existed while the profile was collected.
+    delta_cycles : Counter
+        Number of timestamps, by the number of delta cycles it took to settle the design at
+        that timestamp.
+    toggles : dict of str to int
+        Number of timestamps at which a signal changed, by the hierarchical name of the signal.
+    start, stop : float
+        Simulation time at which collecting the profile started and stopped.
+    time : float
+        Wall time spent collecting the profile, in seconds.
+    """
+    def __init__(self):
+        self.processes    = []
+        self.delta_cycles = Counter()
+        self.toggles      = {}
+        self.start        = None
+        self.stop         = None
+        self.time         = 0.0
+
+    @property
+    def timestamps(self):
+        """Number of timestamps at which the design was simulated."""
+        return sum(self.delta_cycles.values())
+
+    def fragments(self):
+        """Merge the profiles of processes compiled from the same fragment.
+
+        Returns a list of :class:`ProcessProfile`, with ``kind`` and ``src_loc`` set to ``None``,
+        sorted by decreasing wall time.
+        """
+        fragments = {}
+        for process in self.processes:
+            if process.kind in ("clock", "stimulus", "testbench"):
+                continue
+            if process.name not in fragments:
+                fragments[process.name] = ProcessProfile(name=process.name, kind=None,
+                                                         src_loc=None)
+            fragment = fragments[process.name]
+            fragment.calls   += process.calls
+            fragment.time    += process.time
+            fragment.updates += process.updates
+        return sorted(fragments.values(), key=lambda fragment: fragment.time, reverse=True)
+
+    def report(self, limit=10):
+        """Format the profile as human-readable text.
+
+        Lists the ``limit`` processes, fragments and signals that take the most time or change
+        most often.
+        """
+        lines = []
+        lines.append("Simulated {:.6g} s in {:.6g} s of wall time: {} timestamps, "
+                     "{} delta cycles, at most {} per timestamp"
+                     .format(self.stop - self.start, self.time, self.timestamps,
+                             sum(deltas * count for deltas, count in self.delta_cycles.items()),
+                             max(self.delta_cycles, default=0)))
+
+        def process_lines(title, processes):
+            lines.append("")
+            lines.append(title)
+            lines.append("{:>12} {:>10} {:>10}  {}".format("time", "calls", "updates", "name"))
+            for process in processes[:limit]:
+                name = process.name
+                if process.kind is not None:
+                    name = "{} ({})".format(name, process.kind)
+                if process.src_loc is not None:
+                    name = "{} at {}:{}".format(name, *process.src_loc)
+                lines.append("{:>12.6f} {:>10} {:>10}  {}".format(
+                             process.time, process.calls, process.updates, name))
+        process_lines("Processes:",
+                      sorted(self.processes, key=lambda process: process.time, reverse=True))
+        process_lines("Fragments:", self.fragments())
+
+        lines.append("")
+        lines.append("Signals:")
+        lines.append("{:>12}  {}".format("toggles", "name"))
+        toggles = sorted(self.toggles.items(), key=lambda item: item[1], reverse=True)
+        for name, count in toggles[:limit]:
+            lines.append("{:>12}  {}".format(count, name))
+        return "\n".join(lines)
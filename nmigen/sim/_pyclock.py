@@ -31,6 +31,5 @@ class PyClockProcess(BaseProcess):
             self.state.wait_interval(self, self.phase)
 
         else:
-            clk_state = self.state.slots[self.slot]
-            clk_state.set(not clk_state.curr)
+            self.state.set(self.slot, 1 ^ self.state.curr[self.slot])
             self.state.wait_interval(self, self.period / 2)
@@ -1,16 +1,55 @@
+import asyncio
 import inspect
 
 from ..hdl import *
-from ..hdl.ast import Statement, SignalSet
+from ..hdl.ast import Statement, Assign, ArrayProxy, SignalSet, ValueKey
 from .core import Tick, Settle, Delay, Passive, Active
 from ._base import BaseProcess
-from ._pyrtl import _ValueCompiler, _RHSValueCompiler, _StatementCompiler
+from ._codecache import _Uncacheable, _StructureHasher
+from ._pyrtl import _RHSValueCompiler, _StatementCompiler
 
 
 __all__ = ["PyCoroProcess"]
 
 
+class _ValueShapeHasher(_StructureHasher):
+    """Describe the structure of a value like :class:`_StructureHasher`, except that constants are
+    only described by their shape and their index in ``consts``, which their values are collected
+    in instead.
+
+    A constant used more than once is only collected once, since the generated code refers to it
+    by identity; its index is described, so that the code is not reused for a value with distinct
+    constants in those places.
+    """
+    def __init__(self, state):
+        super().__init__(state)
+        self.consts = []
+        self.const_indexes = {}
+
+    def on_value(self, value):
+        value_type = type(value)
+        if value_type is Const:
+            index = self.const_indexes.get(id(value))
+            if index is None:
+                index = self.const_indexes[id(value)] = len(self.consts)
+                self.consts.append(value.value)
+            self.tokens.append(("c", index, value.width, value.signed))
+        elif value_type is ArrayProxy:
+            # Tables of constant elements are embedded in the generated code.
+            raise _Uncacheable
+        else:
+            super().on_value(value)
+
+
 class PyCoroProcess(BaseProcess):
+    # Overridden by processes of simulations that represent signal values differently.
+    _rhs_compiler       = _RHSValueCompiler
+    _statement_compiler = _StatementCompiler
+
+    # Largest number of compiled commands kept by a simulation; the least recently used ones
+    # are discarded first.
+    _code_cache_size    = 1024
+
     def __init__(self, state, domains, constructor, *, default_cmd=None):
         self.state = state
         self.domains = domains
@@ -25,9 +64,11 @@ class PyCoroProcess(BaseProcess):
 
         self.coroutine = self.constructor()
         self.exec_locals = {
-            "slots": self.state.slots,
+            "curr": self.state.curr,
+            "next": self.state.next,
+            "set": self.state.set,
             "result": None,
-            **_ValueCompiler.helpers
+            **self._rhs_compiler.helpers
         }
         self.waits_on = SignalSet()
 
@@ -35,8 +76,14 @@ class PyCoroProcess(BaseProcess):
         coroutine = self.coroutine
         if coroutine is None:
             return None
-        while coroutine.gi_yieldfrom is not None and inspect.isgenerator(coroutine.gi_yieldfrom):
-            coroutine = coroutine.gi_yieldfrom
+        while True:
+            if inspect.isgenerator(coroutine):
+                inner = coroutine.gi_yieldfrom
+            else:
+                inner = coroutine.cr_await
+            if not (inspect.isgenerator(inner) or inspect.iscoroutine(inner)):
+                break
+            coroutine = inner
         if inspect.isgenerator(coroutine):
             frame = coroutine.gi_frame
         if inspect.iscoroutine(coroutine):
@@ -52,6 +99,87 @@ class PyCoroProcess(BaseProcess):
             self.state.remove_trigger(self, signal)
         self.waits_on.clear()
 
+    def _compile_cached(self, key, emit):
+        # Compiled code only depends on the structure of the command and on the slot indexes of
+        # the signals it refers to, both of which are fixed for the lifetime of the simulation,
+        # so the cache is shared between all processes of a simulation. Commands that differ in
+        # more than their constants are compiled separately, so the cache is bounded to keep
+        # the memory used by a long running testbench flat.
+        code_cache = self.state.code_cache
+        try:
+            code = code_cache[key]
+        except KeyError:
+            code = code_cache[key] = compile(emit(), "<string>", "exec")
+            if len(code_cache) > self._code_cache_size:
+                code_cache.popitem(last=False)
+        else:
+            code_cache.move_to_end(key)
+        return code
+
+    @staticmethod
+    def _value_key(value):
+        # `ValueKey` compares constants by value only, but the generated code also depends on
+        # their shape; the representation of a value includes the shapes of all its constants.
+        if isinstance(value, Signal):
+            return ValueKey(value)
+        return (ValueKey(value), repr(value))
+
+    def compile_value(self, value):
+        if isinstance(value, Signal):
+            return self._compile_cached(("value", ValueKey(value)),
+                lambda: self._rhs_compiler.compile(self.state, value, mode="curr"))
+        # Values that only differ in their constants, e.g. `x == i` in a loop, are compiled once,
+        # and receive the constants as a parameter.
+        hasher = _ValueShapeHasher(self.state)
+        try:
+            hasher.on_value(value)
+            self.exec_locals["consts"] = hasher.consts
+            return self._compile_cached(("value_consts", tuple(hasher.tokens)),
+                lambda: self._rhs_compiler.compile(self.state, value, mode="curr",
+                                                   consts=hasher.const_indexes))
+        except _Uncacheable:
+            return self._compile_cached(("value", self._value_key(value)),
+                lambda: self._rhs_compiler.compile(self.state, value, mode="curr"))
+
+    def compile_statement(self, stmt):
+        if type(stmt) is Assign and isinstance(stmt.rhs, Const):
+            # Assignments of constants are compiled once for each left-hand side, and receive
+            # the (already normalized) constant as a parameter.
+            self.exec_locals["value"] = stmt.rhs.value
+            return self._compile_cached(("assign_const", self._value_key(stmt.lhs)),
+                lambda: self._statement_compiler.compile_assign(self.state, stmt.lhs,
+                                                                rhs="value"))
+        if type(stmt) is Assign:
+            return self._compile_cached(
+                ("assign", self._value_key(stmt.lhs), self._value_key(stmt.rhs)),
+                lambda: self._statement_compiler.compile(self.state, stmt))
+        return self._statement_compiler.compile(self.state, stmt)
+
+    def normalize_value(self, value, shape):
+        return Const.normalize(value, shape)
+
+    def run_command(self, command):
+        raise TypeError("Received unsupported command {!r} from process {!r}"
+                        .format(command, self.src_loc()))
+
+    def wait_future(self, future):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            raise RuntimeError("Process {!r} awaits an asyncio future, but the simulation is not "
+                               "run by an asyncio event loop; use `await sim.run_async()` or "
+                               "a similar method to run it"
+                               .format(self.src_loc())) from None
+        if future is None:
+            # A bare `yield` in an asyncio coroutine, e.g. in `asyncio.sleep(0)`, lets every
+            # other task run once.
+            future = loop.create_future()
+            loop.call_soon(future.set_result, None)
+        else:
+            # Like an asyncio task, acknowledge that the future is awaited rather than yielded.
+            future._asyncio_future_blocking = False
+        self.state.wait_future(self, future)
+
     def run(self):
         if self.coroutine is None:
             return
@@ -62,18 +190,19 @@ class PyCoroProcess(BaseProcess):
         while True:
             try:
                 command = self.coroutine.send(response)
+                response = None
                 if command is None:
+                    if inspect.iscoroutine(self.coroutine):
+                        self.wait_future(None)
+                        return
                     command = self.default_cmd
-                response = None
 
                 if isinstance(command, Value):
-                    exec(_RHSValueCompiler.compile(self.state, command, mode="curr"),
-                        self.exec_locals)
-                    response = Const.normalize(self.exec_locals["result"], command.shape())
+                    exec(self.compile_value(command), self.exec_locals)
+                    response = self.normalize_value(self.exec_locals["result"], command.shape())
 
                 elif isinstance(command, Statement):
-                    exec(_StatementCompiler.compile(self.state, command),
-                        self.exec_locals)
+                    exec(self.compile_statement(command), self.exec_locals)
 
                 elif type(command) is Tick:
                     domain = command.domain
@@ -104,6 +233,10 @@ class PyCoroProcess(BaseProcess):
                 elif type(command) is Active:
                     self.passive = False
 
+                elif asyncio.isfuture(command):
+                    self.wait_future(command)
+                    return
+
                 elif command is None: # only possible if self.default_cmd is None
                     raise TypeError("Received default command from process {!r} that was added "
                                     "with add_process(); did you mean to add this process with "
@@ -111,8 +244,7 @@ class PyCoroProcess(BaseProcess):
                                     .format(self.src_loc()))
 
                 else:
-                    raise TypeError("Received unsupported command {!r} from process {!r}"
-                                    .format(command, self.src_loc()))
+                    response = self.run_command(command)
 
             except StopIteration:
                 self.passive = True
@@ -120,4 +252,8 @@ class PyCoroProcess(BaseProcess):
                 return
 
             except Exception as exn:
+                if inspect.iscoroutine(self.coroutine) and self.coroutine.cr_frame is None:
+                    # Unlike a generator, a coroutine that raised an exception cannot have
+                    # the exception thrown into it again.
+                    raise
                 self.coroutine.throw(exn)
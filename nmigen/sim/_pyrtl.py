@@ -1,21 +1,35 @@
 import os
+import re
+import operator
 import tempfile
 from contextlib import contextmanager
 
 from ..hdl import *
-from ..hdl.ast import SignalSet
-from ..hdl.xfrm import ValueVisitor, StatementVisitor, LHSGroupFilter
+from ..hdl.ast import SignalSet, SignalDict, Slice, Part, ArrayProxy, Assign, Switch
+from ..hdl.xfrm import ValueVisitor, StatementVisitor, LHSGroupAnalyzer, LHSGroupFilter
 from ._base import BaseProcess
+from ._codecache import _Uncacheable, _CodeCache
 
 
 __all__ = ["PyRTLProcess"]
 
 
 class PyRTLProcess(BaseProcess):
-    __slots__ = ("is_comb", "runnable", "passive", "run")
+    __slots__ = ("is_comb", "inputs", "outputs", "kind", "src_loc", "hierarchy",
+                 "rank", "loop", "runnable", "passive", "run")
 
-    def __init__(self, *, is_comb):
+    def __init__(self, *, is_comb, inputs=None, outputs=None, kind=None, src_loc=None):
         self.is_comb  = is_comb
+        self.inputs   = inputs
+        self.outputs  = outputs
+        # What the process simulates, and where it comes from; used for diagnostics.
+        self.kind     = kind
+        self.src_loc  = src_loc
+        # Assigned by `_FragmentCompiler` to the processes of every fragment.
+        self.hierarchy = None
+        # Assigned by `_levelize` to combinatorial processes.
+        self.rank     = None
+        self.loop     = None
 
         self.reset()
 
@@ -24,11 +38,198 @@ class PyRTLProcess(BaseProcess):
         self.passive  = True
 
 
+class _CombLoop:
+    def __init__(self, signals, limit):
+        # A cycle of signals through the loop, used for diagnostics.
+        self.signals = signals
+        # How many times the processes forming the loop may run while settling the design
+        # before it is considered to be oscillating.
+        self.limit   = limit
+        self.runs    = 0
+
+    def __str__(self):
+        return " -> ".join(signal.name for signal in self.signals)
+
+
+def _levelize(processes):
+    """Rank combinatorial processes in topological order of their dependencies.
+
+    A process that reads a signal driven by another process is ranked after it, so that running
+    the processes in rank order settles acyclic logic in a single pass. Processes forming a
+    combinatorial loop share a rank and a :class:`_CombLoop` describing it.
+    """
+    processes = [process for process in processes if process.is_comb]
+
+    drivers = SignalDict()
+    for process in processes:
+        for signal in process.outputs:
+            drivers[signal] = process
+    successors = {process: [] for process in processes}
+    for process in processes:
+        for signal in process.inputs:
+            if signal in drivers and process not in successors[drivers[signal]]:
+                successors[drivers[signal]].append(process)
+
+    # Tarjan's algorithm, in its iterative form to avoid recursion limits with deep logic.
+    # Strongly connected components are found in reverse topological order.
+    indexes  = {}
+    lowlinks = {}
+    stack    = []
+    on_stack = set()
+    sccs     = []
+    for root in processes:
+        if root in indexes:
+            continue
+        work = [(root, iter(successors[root]))]
+        indexes[root] = lowlinks[root] = len(indexes)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            process, process_successors = work[-1]
+            for successor in process_successors:
+                if successor not in indexes:
+                    indexes[successor] = lowlinks[successor] = len(indexes)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(successors[successor])))
+                    break
+                elif successor in on_stack:
+                    lowlinks[process] = min(lowlinks[process], indexes[successor])
+            else:
+                work.pop()
+                if work:
+                    parent, _ = work[-1]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[process])
+                if lowlinks[process] == indexes[process]:
+                    scc = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        scc.append(member)
+                        if member is process:
+                            break
+                    sccs.append(scc)
+
+    for rank, scc in enumerate(reversed(sccs)):
+        loop = None
+        if len(scc) > 1 or scc[0] in successors[scc[0]]:
+            width = sum(len(signal) for process in scc for signal in process.outputs)
+            loop  = _CombLoop(_find_cycle(scc, successors), limit=len(scc) * (width + 2))
+        for process in scc:
+            process.rank = rank
+            process.loop = loop
+
+    return processes
+
+
+def _find_cycle(scc, successors):
+    members = set(scc)
+    start   = scc[-1]
+    # Breadth-first search for the shortest path from `start` back to itself.
+    parents = {}
+    queue   = [start]
+    while queue:
+        process = queue.pop(0)
+        for successor in successors[process]:
+            if successor not in members or successor in parents:
+                continue
+            parents[successor] = process
+            if successor is start:
+                queue.clear()
+                break
+            queue.append(successor)
+
+    path = [start]
+    while True:
+        path.append(parents[path[-1]])
+        if path[-1] is start:
+            break
+    path.reverse()
+
+    signals = []
+    for source, sink in zip(path, path[1:]):
+        edge_signals = [signal for signal in source.outputs if signal in sink.inputs]
+        signals.append(min(edge_signals, key=lambda signal: signal.name))
+    signals.append(signals[0])
+    return signals
+
+
+def _is_signal_table(value):
+    # Writes through an `Array` of signals of the same shape can be compiled to a table of slot
+    # indexes, since the code updating each of the signals is the same.
+    elems = list(value._iter_as_values())
+    return (len(elems) > 0 and all(isinstance(elem, Signal) for elem in elems) and
+            all(elem.shape() == elems[0].shape() for elem in elems))
+
+
+# Switches with fewer cases than this are compiled to an `if`/`elif` chain even if they could be
+# compiled to a jump table, since calling a function is more expensive than a few comparisons.
+_SWITCH_TABLE_MIN_CASES = 8
+
+
+def _is_switch_table(stmt):
+    # Switches whose patterns are all fully specified can be compiled to a jump table.
+    return (len(stmt.test) > 0 and len(stmt.cases) >= _SWITCH_TABLE_MIN_CASES and
+            all("-" not in pattern for patterns in stmt.cases for pattern in patterns))
+
+
+def _slot_backed_signals(stmts):
+    """Find signals that are assigned through an ``Array`` compiled to a table lookup, or within
+    a ``Switch`` compiled to a jump table.
+
+    The next value of such signals is kept in their slot instead of a local variable of
+    the generated code, so that it can be selected at run time, or updated by the functions
+    implementing the cases of a jump table.
+    """
+    signals = SignalSet()
+
+    def on_lhs(value):
+        if isinstance(value, ArrayProxy):
+            if _is_signal_table(value):
+                signals.update(value._iter_as_values())
+            else:
+                for elem in value._iter_as_values():
+                    on_lhs(elem)
+        elif isinstance(value, (Slice, Part)):
+            on_lhs(value.value)
+        elif isinstance(value, Cat):
+            for part in value.parts:
+                on_lhs(part)
+
+    def on_statements(stmts):
+        for stmt in stmts:
+            if isinstance(stmt, Assign):
+                on_lhs(stmt.lhs)
+            elif isinstance(stmt, Switch):
+                if _is_switch_table(stmt):
+                    signals.update(stmt._lhs_signals())
+                for case_stmts in stmt.cases.values():
+                    on_statements(case_stmts)
+
+    on_statements(stmts)
+    return signals
+
+
+def _table_index(gen_index, index, count):
+    # Out of bounds indexes select the last element.
+    if (1 << len(index)) > count:
+        return f"min({gen_index}, {count - 1})"
+    return gen_index
+
+
 class _PythonEmitter:
-    def __init__(self):
+    def __init__(self, *, root=None):
         self._buffer = []
         self._suffix = 0
         self._level  = 0
+        # Functions and variables defined at module level are collected by the root emitter, and
+        # precede the rest of the code.
+        self._root    = self if root is None else root
+        self._globals = []
+        # Position and indentation of the start of the body of the function being emitted, and
+        # the signal values it reads, with the number of times each is read; see `load_curr`.
+        self._prologue = None
+        self._loads    = {}
 
     def append(self, code):
         self._buffer.append("    " * self._level)
@@ -41,12 +242,49 @@ class _PythonEmitter:
         yield
         self._level -= 1
 
+    def begin_function(self, name):
+        self.append(f"def {name}():")
+        self._level += 1
+        self._prologue = (len(self._buffer), self._level)
+
+    def load_curr(self, signal_index):
+        # The current values of signals do not change while a process runs, so inside of
+        # a function, every value that is read more than once is loaded into a local variable
+        # at the start of the function; see `flush`.
+        if self._prologue is None:
+            return f"curr[{signal_index}]"
+        name = f"curr_{signal_index}"
+        self._loads[name] = self._loads.get(name, 0) + 1
+        return name
+
+    def _emit_loads(self):
+        index, level = self._prologue
+        single_loads = {}
+        for name, count in self._loads.items():
+            gen_load = f"curr[{name[5:]}]"
+            if count == 1:
+                single_loads[name] = gen_load
+            else:
+                self._buffer.insert(index, f"{'    ' * level}{name} = {gen_load}\n")
+        if single_loads:
+            body = "".join(self._buffer[index:])
+            body = re.sub(r"\bcurr_\d+\b",
+                          lambda match: single_loads.get(match.group(0), match.group(0)), body)
+            self._buffer[index:] = [body]
+        self._prologue = None
+        self._loads.clear()
+
     def flush(self, indent=""):
-        code = "".join(self._buffer)
+        if self._prologue is not None:
+            self._emit_loads()
+        code = "".join(self._globals) + "".join(self._buffer)
+        self._globals.clear()
         self._buffer.clear()
         return code
 
     def gen_var(self, prefix):
+        if self._root is not self:
+            return self._root.gen_var(prefix)
         name = f"{prefix}_{self._suffix}"
         self._suffix += 1
         return name
@@ -56,6 +294,53 @@ class _PythonEmitter:
         self.append(f"{name} = {value}")
         return name
 
+    def def_global(self, prefix, value):
+        name = self.gen_var(prefix)
+        self._root._globals.append(f"{name} = {value}\n")
+        return name
+
+    def def_function(self, prefix, emit):
+        name = self.gen_var(prefix)
+        emitter = _PythonEmitter(root=self._root)
+        emitter.begin_function(name)
+        emit(emitter)
+        self._root._globals.append(emitter.flush())
+        return name
+
+
+class _Expr(str):
+    """Python expression, annotated with what is known about its value when it is generated.
+
+    ``bounds`` is a ``(min, max)`` tuple bounding the value, or ``None`` if nothing is known
+    about it; ``const`` is the value of an expression that only depends on constants, or ``None``;
+    ``is_bool`` is true if the expression may evaluate to a ``bool`` rather than an ``int``.
+    """
+    def __new__(cls, code, *, bounds=None, const=None, is_bool=False):
+        expr = super().__new__(cls, code)
+        expr.bounds  = bounds
+        expr.const   = const
+        expr.is_bool = is_bool
+        return expr
+
+
+def _shape_bounds(shape):
+    width, signed = shape
+    if signed and width > 0:
+        return (-1 << (width - 1), (1 << (width - 1)) - 1)
+    else:
+        return (0, (1 << width) - 1)
+
+
+def _bounds_of(gen):
+    return getattr(gen, "bounds", None)
+
+
+def _union_bounds(bounds):
+    bounds = list(bounds)
+    if not bounds or None in bounds:
+        return None
+    return (min(lo for lo, hi in bounds), max(hi for lo, hi in bounds))
+
 
 class _Compiler:
     def __init__(self, state, emitter):
@@ -88,133 +373,272 @@ class _ValueCompiler(ValueVisitor, _Compiler):
     def on_Initial(self, value):
         raise NotImplementedError # :nocov:
 
+    # Values are only masked and sign extended where the bounds of the expression computing them
+    # show that it is necessary, and expressions that only depend on constants are evaluated
+    # while generating code.
+
+    @staticmethod
+    def _const(value):
+        return _Expr(f"{value}", bounds=(value, value), const=value)
+
+    def _expr(self, code, bounds, *gen_args, is_bool=False):
+        if gen_args and all(getattr(gen_arg, "const", None) is not None for gen_arg in gen_args):
+            return self._const(int(eval(code, dict(self.helpers))))
+        return _Expr(code, bounds=bounds, is_bool=is_bool)
+
+    @staticmethod
+    def _fits(gen, bounds, store):
+        # Values stored in slots must be `int`s, even if they are within bounds.
+        gen_bounds = _bounds_of(gen)
+        return (gen_bounds is not None and
+                bounds[0] <= gen_bounds[0] and gen_bounds[1] <= bounds[1] and
+                not (store and gen.is_bool))
+
+    def _to_unsigned(self, gen, width, *, store=False):
+        value_mask = (1 << width) - 1
+        if getattr(gen, "const", None) is not None:
+            return self._const(value_mask & gen.const)
+        if self._fits(gen, (0, value_mask), store):
+            return gen
+        return _Expr(f"({value_mask} & {gen})", bounds=(0, value_mask))
+
+    def _to_signed(self, gen, width, *, store=False):
+        bounds = _shape_bounds((width, True))
+        if getattr(gen, "const", None) is not None:
+            return self._const(Const.normalize(gen.const, (width, True)))
+        if self._fits(gen, bounds, store):
+            return gen
+        return _Expr(self._gen_sign(gen, width), bounds=bounds)
+
+    # Overridden by compilers that generate code for integers of limited width.
+    @staticmethod
+    def _gen_sign(gen, width):
+        sign_bit   = 1 << (width - 1)
+        value_mask = (1 << width) - 1
+        return f"((({gen} + {sign_bit}) & {value_mask}) - {sign_bit})"
+
+    def _normalize(self, gen, shape, *, store=False):
+        width, signed = shape
+        if signed:
+            return self._to_signed(gen, width, store=store)
+        else:
+            return self._to_unsigned(gen, width, store=store)
+
 
 class _RHSValueCompiler(_ValueCompiler):
-    def __init__(self, state, emitter, *, mode, inputs=None):
+    def __init__(self, state, emitter, *, mode, inputs=None, slot_backed=None, consts=None):
         super().__init__(state, emitter)
         assert mode in ("curr", "next")
         self.mode = mode
         # If not None, `inputs` gets populated with RHS signals.
         self.inputs = inputs
+        # Signals whose next value is kept in their slot; see `_slot_backed_signals`.
+        self.slot_backed = SignalSet() if slot_backed is None else slot_backed
+        # If not None, `consts` maps the `id()` of every constant to its index in the `consts`
+        # variable, which the generated code reads it from instead of embedding its value; see
+        # `PyCoroProcess`.
+        self.consts = consts
 
     def on_Const(self, value):
-        return f"{value.value}"
+        if self.consts is not None:
+            return _Expr(self._gen_const_param(value), bounds=_shape_bounds(value.shape()))
+        return self._const(value.value)
+
+    def _gen_const_param(self, value):
+        try:
+            return f"consts[{self.consts[id(value)]}]"
+        except KeyError:
+            raise _Uncacheable from None
+
+    @staticmethod
+    def _signal_bounds(signal):
+        # Every value of a signal is normalized when it is assigned, but its reset value is used
+        # as is.
+        shape = signal.shape()
+        if type(signal.reset) is int and Const.normalize(signal.reset, shape) == signal.reset:
+            return _shape_bounds(shape)
+        return None
 
     def on_Signal(self, value):
         if self.inputs is not None:
             self.inputs.add(value)
 
+        signal_index = self.state.get_signal(value)
         if self.mode == "curr":
-            return f"slots[{self.state.get_signal(value)}].{self.mode}"
+            gen_value = self.emitter.load_curr(signal_index)
+        elif value in self.slot_backed:
+            gen_value = f"next[{signal_index}]"
         else:
-            return f"next_{self.state.get_signal(value)}"
+            gen_value = f"next_{signal_index}"
+        return _Expr(gen_value, bounds=self._signal_bounds(value))
 
     def on_Operator(self, value):
         def mask(value):
-            value_mask = (1 << len(value)) - 1
-            return f"({value_mask} & {self(value)})"
+            return self._to_unsigned(self(value), len(value))
 
         def sign(value):
-            if value.shape().signed:
-                return f"sign({mask(value)}, {-1 << (len(value) - 1)})"
-            else: # unsigned
-                return mask(value)
+            return self._normalize(self(value), value.shape())
+
+        def corners(op, gen_lhs, gen_rhs):
+            if _bounds_of(gen_lhs) is None or _bounds_of(gen_rhs) is None:
+                return None
+            (lhs_lo, lhs_hi), (rhs_lo, rhs_hi) = gen_lhs.bounds, gen_rhs.bounds
+            results = [op(lhs_lo, rhs_lo), op(lhs_lo, rhs_hi),
+                       op(lhs_hi, rhs_lo), op(lhs_hi, rhs_hi)]
+            return (min(results), max(results))
+
+        def compare(op, gen_lhs, gen_rhs):
+            return self._expr(f"({gen_lhs} {op} {gen_rhs})", (0, 1), gen_lhs, gen_rhs,
+                              is_bool=True)
 
         if len(value.operands) == 1:
             arg, = value.operands
             if value.operator == "~":
-                return f"(~{self(arg)})"
+                gen_arg = self(arg)
+                bounds = _bounds_of(gen_arg)
+                if bounds is not None:
+                    bounds = (~bounds[1], ~bounds[0])
+                return self._expr(f"(~{gen_arg})", bounds, gen_arg)
             if value.operator == "-":
-                return f"(-{sign(arg)})"
-            if value.operator == "b":
-                return f"bool({mask(arg)})"
-            if value.operator == "r|":
-                return f"(0 != {mask(arg)})"
+                gen_arg = sign(arg)
+                lo, hi = gen_arg.bounds
+                return self._expr(f"(-{gen_arg})", (-hi, -lo), gen_arg)
+            if value.operator in ("b", "r|", "r&", "r^") and len(arg) == 1:
+                # All of these are the identity function for 1-bit values.
+                return mask(arg)
+            if value.operator in ("b", "r|"):
+                gen_arg = mask(arg)
+                return compare("!=", self._const(0), gen_arg)
             if value.operator == "r&":
-                return f"({(1 << len(arg)) - 1} == {mask(arg)})"
+                gen_arg = mask(arg)
+                return compare("==", self._const((1 << len(arg)) - 1), gen_arg)
             if value.operator == "r^":
                 # Believe it or not, this is the fastest way to compute a sideways XOR in Python.
-                return f"(format({mask(arg)}, 'b').count('1') % 2)"
+                gen_arg = mask(arg)
+                return self._expr(f"(format({gen_arg}, 'b').count('1') % 2)", (0, 1), gen_arg)
             if value.operator in ("u", "s"):
                 # These operators don't change the bit pattern, only its interpretation.
                 return self(arg)
         elif len(value.operands) == 2:
             lhs, rhs = value.operands
-            lhs_mask = (1 << len(lhs)) - 1
-            rhs_mask = (1 << len(rhs)) - 1
+            if value.operator in ("&", "|", "^"):
+                gen_lhs, gen_rhs = self(lhs), self(rhs)
+                bounds = _union_bounds((_bounds_of(gen_lhs), _bounds_of(gen_rhs)))
+                if bounds is not None and bounds[0] >= 0:
+                    if value.operator == "&":
+                        bounds = (0, min(gen_lhs.bounds[1], gen_rhs.bounds[1]))
+                    else:
+                        bounds = (0, (1 << bounds[1].bit_length()) - 1)
+                else:
+                    bounds = None
+                return self._expr(f"({gen_lhs} {value.operator} {gen_rhs})", bounds,
+                                  gen_lhs, gen_rhs)
+            gen_lhs, gen_rhs = sign(lhs), sign(rhs)
             if value.operator == "+":
-                return f"({sign(lhs)} + {sign(rhs)})"
+                return self._expr(f"({gen_lhs} + {gen_rhs})",
+                                  corners(operator.add, gen_lhs, gen_rhs), gen_lhs, gen_rhs)
             if value.operator == "-":
-                return f"({sign(lhs)} - {sign(rhs)})"
+                return self._expr(f"({gen_lhs} - {gen_rhs})",
+                                  corners(operator.sub, gen_lhs, gen_rhs), gen_lhs, gen_rhs)
             if value.operator == "*":
-                return f"({sign(lhs)} * {sign(rhs)})"
-            if value.operator == "//":
-                return f"zdiv({sign(lhs)}, {sign(rhs)})"
-            if value.operator == "%":
-                return f"zmod({sign(lhs)}, {sign(rhs)})"
-            if value.operator == "&":
-                return f"({self(lhs)} & {self(rhs)})"
-            if value.operator == "|":
-                return f"({self(lhs)} | {self(rhs)})"
-            if value.operator == "^":
-                return f"({self(lhs)} ^ {self(rhs)})"
-            if value.operator == "<<":
-                return f"({sign(lhs)} << {sign(rhs)})"
-            if value.operator == ">>":
-                return f"({sign(lhs)} >> {sign(rhs)})"
-            if value.operator == "==":
-                return f"({sign(lhs)} == {sign(rhs)})"
-            if value.operator == "!=":
-                return f"({sign(lhs)} != {sign(rhs)})"
-            if value.operator == "<":
-                return f"({sign(lhs)} < {sign(rhs)})"
-            if value.operator == "<=":
-                return f"({sign(lhs)} <= {sign(rhs)})"
-            if value.operator == ">":
-                return f"({sign(lhs)} > {sign(rhs)})"
-            if value.operator == ">=":
-                return f"({sign(lhs)} >= {sign(rhs)})"
+                return self._expr(f"({gen_lhs} * {gen_rhs})",
+                                  corners(operator.mul, gen_lhs, gen_rhs), gen_lhs, gen_rhs)
+            if value.operator in ("//", "%"):
+                rhs_lo, rhs_hi = gen_rhs.bounds
+                if rhs_lo > 0 or rhs_hi < 0:
+                    # The divisor is never zero.
+                    return self._expr(f"({gen_lhs} {value.operator} {gen_rhs})", None,
+                                      gen_lhs, gen_rhs)
+                if value.operator == "//":
+                    return self._expr(f"zdiv({gen_lhs}, {gen_rhs})", None, gen_lhs, gen_rhs)
+                else:
+                    return self._expr(f"zmod({gen_lhs}, {gen_rhs})", None, gen_lhs, gen_rhs)
+            if value.operator in ("<<", ">>"):
+                bounds = None
+                if gen_rhs.bounds[0] >= 0 and gen_rhs.bounds[1] <= 4096:
+                    if value.operator == "<<":
+                        bounds = corners(operator.lshift, gen_lhs, gen_rhs)
+                    else:
+                        bounds = corners(operator.rshift, gen_lhs, gen_rhs)
+                return self._expr(f"({gen_lhs} {value.operator} {gen_rhs})", bounds,
+                                  gen_lhs, gen_rhs)
+            if value.operator in ("==", "!=", "<", "<=", ">", ">="):
+                return compare(value.operator, gen_lhs, gen_rhs)
         elif len(value.operands) == 3:
             if value.operator == "m":
                 sel, val1, val0 = value.operands
-                return f"({self(val1)} if {self(sel)} else {self(val0)})"
+                gen_sel = mask(sel)
+                gen_val1, gen_val0 = self(val1), self(val0)
+                if gen_sel.const is not None:
+                    return gen_val1 if gen_sel.const else gen_val0
+                return _Expr(f"({gen_val1} if {gen_sel} else {gen_val0})",
+                             bounds=_union_bounds(map(_bounds_of, (gen_val1, gen_val0))),
+                             is_bool=any(getattr(gen, "is_bool", True)
+                                         for gen in (gen_val1, gen_val0)))
         raise NotImplementedError("Operator '{}' not implemented".format(value.operator)) # :nocov:
 
     def on_Slice(self, value):
-        return f"({(1 << len(value)) - 1} & ({self(value.value)} >> {value.start}))"
+        gen_value = self(value.value)
+        if value.start:
+            bounds = _bounds_of(gen_value)
+            if bounds is not None:
+                bounds = (bounds[0] >> value.start, bounds[1] >> value.start)
+            gen_value = self._expr(f"({gen_value} >> {value.start})", bounds, gen_value)
+        return self._to_unsigned(gen_value, len(value))
 
     def on_Part(self, value):
-        offset_mask = (1 << len(value.offset)) - 1
-        offset = f"({value.stride} * ({offset_mask} & {self(value.offset)}))"
-        return f"({(1 << value.width) - 1} & " \
-               f"{self(value.value)} >> {offset})"
+        gen_offset = self._to_unsigned(self(value.offset), len(value.offset))
+        offset = f"({value.stride} * {gen_offset})"
+        return _Expr(f"({(1 << value.width) - 1} & {self(value.value)} >> {offset})",
+                     bounds=(0, (1 << value.width) - 1))
 
     def on_Cat(self, value):
         gen_parts = []
-        offset = 0
         for part in value.parts:
-            part_mask = (1 << len(part)) - 1
-            gen_parts.append(f"(({part_mask} & {self(part)}) << {offset})")
-            offset += len(part)
+            gen_parts.append(self._to_unsigned(self(part), len(part)))
+        if len(gen_parts) == 1:
+            return gen_parts[0]
         if gen_parts:
-            return f"({' | '.join(gen_parts)})"
-        return f"0"
+            gen_shifted = []
+            offset = 0
+            for part, gen_part in zip(value.parts, gen_parts):
+                gen_shifted.append(f"({gen_part} << {offset})" if offset else gen_part)
+                offset += len(part)
+            return self._expr(f"({' | '.join(gen_shifted)})", (0, (1 << len(value)) - 1),
+                              *gen_parts)
+        return self._const(0)
 
     def on_Repl(self, value):
-        part_mask = (1 << len(value.value)) - 1
-        gen_part = self.emitter.def_var("repl", f"{part_mask} & {self(value.value)}")
+        gen_part = self._to_unsigned(self(value.value), len(value.value))
+        if gen_part.const is None:
+            gen_part = self.emitter.def_var("repl", gen_part)
         gen_parts = []
         offset = 0
         for _ in range(value.count):
             gen_parts.append(f"({gen_part} << {offset})")
             offset += len(value.value)
         if gen_parts:
-            return f"({' | '.join(gen_parts)})"
-        return f"0"
+            return self._expr(f"({' | '.join(gen_parts)})", (0, (1 << len(value)) - 1),
+                              *(gen_part for _ in gen_parts))
+        return self._const(0)
 
     def on_ArrayProxy(self, value):
-        index_mask = (1 << len(value.index)) - 1
-        gen_index = self.emitter.def_var("rhs_index", f"{index_mask} & {self(value.index)}")
+        gen_index = self.emitter.def_var("rhs_index",
+            self._to_unsigned(self(value.index), len(value.index)))
+        elems = list(value._iter_as_values())
+        if elems and all(type(elem) is Const for elem in elems):
+            gen_table = ", ".join(f"{elem.value}" for elem in elems)
+            return _Expr(f"({gen_table},)[{_table_index(gen_index, value.index, len(elems))}]",
+                         bounds=(min(elem.value for elem in elems),
+                                 max(elem.value for elem in elems)))
+        if (elems and all(isinstance(elem, Signal) for elem in elems) and
+                (self.mode == "curr" or all(elem in self.slot_backed for elem in elems))):
+            if self.inputs is not None:
+                self.inputs.update(elems)
+            gen_table = ", ".join(f"{self.state.get_signal(elem)}" for elem in elems)
+            return _Expr(f"{self.mode}[({gen_table},)"
+                         f"[{_table_index(gen_index, value.index, len(elems))}]]",
+                         bounds=_union_bounds(map(self._signal_bounds, elems)))
         gen_value = self.emitter.gen_var("rhs_proxy")
         if value.elems:
             gen_elems = []
@@ -224,33 +648,41 @@ class _RHSValueCompiler(_ValueCompiler):
                 else:
                     self.emitter.append(f"elif {index} == {gen_index}:")
                 with self.emitter.indent():
-                    self.emitter.append(f"{gen_value} = {self(elem)}")
+                    gen_elem = self(elem)
+                    gen_elems.append(gen_elem)
+                    self.emitter.append(f"{gen_value} = {gen_elem}")
             self.emitter.append(f"else:")
             with self.emitter.indent():
-                self.emitter.append(f"{gen_value} = {self(value.elems[-1])}")
-            return gen_value
+                gen_elem = self(value.elems[-1])
+                gen_elems.append(gen_elem)
+                self.emitter.append(f"{gen_value} = {gen_elem}")
+            return _Expr(gen_value, bounds=_union_bounds(map(_bounds_of, gen_elems)),
+                         is_bool=any(getattr(gen, "is_bool", True) for gen in gen_elems))
         else:
-            return f"0"
+            return self._const(0)
 
     @classmethod
-    def compile(cls, state, value, *, mode):
+    def compile(cls, state, value, *, mode, consts=None):
         emitter = _PythonEmitter()
-        compiler = cls(state, emitter, mode=mode)
+        compiler = cls(state, emitter, mode=mode, consts=consts)
         emitter.append(f"result = {compiler(value)}")
         return emitter.flush()
 
 
 class _LHSValueCompiler(_ValueCompiler):
-    def __init__(self, state, emitter, *, rhs, outputs=None):
+    def __init__(self, state, emitter, *, rhs, outputs=None, slot_backed=None):
         super().__init__(state, emitter)
         # `rrhs` is used to translate rvalues that are syntactically a part of an lvalue, e.g.
         # the offset of a Part.
         self.rrhs = rhs
         # `lrhs` is used to translate the read part of a read-modify-write cycle during partial
         # update of an lvalue.
-        self.lrhs = _RHSValueCompiler(state, emitter, mode="next", inputs=None)
+        self.lrhs = _RHSValueCompiler(state, emitter, mode="next", inputs=None,
+                                      slot_backed=slot_backed)
         # If not None, `outputs` gets populated with signals on LHS.
         self.outputs = outputs
+        # Signals whose next value is kept in their slot; see `_slot_backed_signals`.
+        self.slot_backed = SignalSet() if slot_backed is None else slot_backed
 
     def on_Const(self, value):
         raise TypeError # :nocov:
@@ -260,23 +692,27 @@ class _LHSValueCompiler(_ValueCompiler):
             self.outputs.add(value)
 
         def gen(arg):
-            value_mask = (1 << len(value)) - 1
-            if value.shape().signed:
-                value_sign = f"sign({value_mask} & {arg}, {-1 << (len(value) - 1)})"
-            else: # unsigned
-                value_sign = f"{value_mask} & {arg}"
-            self.emitter.append(f"next_{self.state.get_signal(value)} = {value_sign}")
+            value_sign = self._sign(value, arg)
+            if value in self.slot_backed:
+                self.emitter.append(f"set({self.state.get_signal(value)}, {value_sign})")
+            else:
+                self.emitter.append(f"next_{self.state.get_signal(value)} = {value_sign}")
         return gen
 
+    def _sign(self, value, arg):
+        return self._normalize(arg, value.shape(), store=True)
+
     def on_Operator(self, value):
         raise TypeError # :nocov:
 
     def on_Slice(self, value):
         def gen(arg):
             width_mask = (1 << (value.stop - value.start)) - 1
+            gen_arg = self._to_unsigned(arg, value.stop - value.start)
+            if value.start:
+                gen_arg = f"({gen_arg} << {value.start})"
             self(value.value)(f"({self.lrhs(value.value)} & " \
-                f"{~(width_mask << value.start)} | " \
-                f"(({width_mask} & {arg}) << {value.start}))")
+                f"{~(width_mask << value.start)} | {gen_arg})")
         return gen
 
     def on_Part(self, value):
@@ -292,11 +728,11 @@ class _LHSValueCompiler(_ValueCompiler):
     def on_Cat(self, value):
         def gen(arg):
             gen_arg = self.emitter.def_var("cat", arg)
-            gen_parts = []
             offset = 0
             for part in value.parts:
                 part_mask = (1 << len(part)) - 1
-                self(part)(f"({part_mask} & ({gen_arg} >> {offset}))")
+                gen_part = f"({gen_arg} >> {offset})" if offset else gen_arg
+                self(part)(_Expr(f"({part_mask} & {gen_part})", bounds=(0, part_mask)))
                 offset += len(part)
         return gen
 
@@ -304,6 +740,20 @@ class _LHSValueCompiler(_ValueCompiler):
         raise TypeError # :nocov:
 
     def on_ArrayProxy(self, value):
+        elems = list(value._iter_as_values())
+        if _is_signal_table(value) and all(elem in self.slot_backed for elem in elems):
+            def gen(arg):
+                index_mask = (1 << len(value.index)) - 1
+                gen_index = self.emitter.def_var("index",
+                    f"{self.rrhs(value.index)} & {index_mask}")
+                if self.outputs is not None:
+                    self.outputs.update(elems)
+                gen_table = ", ".join(f"{self.state.get_signal(elem)}" for elem in elems)
+                self.emitter.append(f"set(({gen_table},)"
+                                    f"[{_table_index(gen_index, value.index, len(elems))}], "
+                                    f"{self._sign(elems[0], arg)})")
+            return gen
+
         def gen(arg):
             index_mask = (1 << len(value.index)) - 1
             gen_index = self.emitter.def_var("index", f"{self.rrhs(value.index)} & {index_mask}")
@@ -325,10 +775,22 @@ class _LHSValueCompiler(_ValueCompiler):
 
 
 class _StatementCompiler(StatementVisitor, _Compiler):
-    def __init__(self, state, emitter, *, inputs=None, outputs=None):
+    def __init__(self, state, emitter, *, inputs=None, outputs=None, slot_backed=None,
+                 coverage=None):
         super().__init__(state, emitter)
         self.rhs = _RHSValueCompiler(state, emitter, mode="curr", inputs=inputs)
-        self.lhs = _LHSValueCompiler(state, emitter, rhs=self.rhs, outputs=outputs)
+        self.lhs = _LHSValueCompiler(state, emitter, rhs=self.rhs, outputs=outputs,
+                                     slot_backed=slot_backed)
+        # If specified, every branch of a `Switch` counts how many times it is taken in
+        # the `branches` list of the coverage.
+        self.coverage = coverage
+
+    def _count_branch(self, emitter, stmt, patterns):
+        if self.coverage is None:
+            return
+        src_loc = stmt.case_src_locs.get(patterns, stmt.src_loc)
+        index = self.coverage.add_branch((*src_loc, patterns))
+        emitter.append(f"branches[{index}] += 1")
 
     def on_statements(self, stmts):
         for stmt in stmts:
@@ -337,14 +799,15 @@ class _StatementCompiler(StatementVisitor, _Compiler):
             self.emitter.append("pass")
 
     def on_Assign(self, stmt):
-        gen_rhs = f"({(1 << len(stmt.rhs)) - 1} & {self.rhs(stmt.rhs)})"
-        if stmt.rhs.shape().signed:
-            gen_rhs = f"sign({gen_rhs}, {-1 << (len(stmt.rhs) - 1)})"
+        gen_rhs = self.rhs._normalize(self.rhs(stmt.rhs), stmt.rhs.shape())
         return self.lhs(stmt.lhs)(gen_rhs)
 
     def on_Switch(self, stmt):
         gen_test = self.emitter.def_var("test",
-            f"{(1 << len(stmt.test)) - 1} & {self.rhs(stmt.test)}")
+            self.rhs._to_unsigned(self.rhs(stmt.test), len(stmt.test)))
+        if _is_switch_table(stmt) and stmt._lhs_signals() <= self.lhs.slot_backed:
+            self._on_Switch_table(stmt, gen_test)
+            return
         for index, (patterns, stmts) in enumerate(stmt.cases.items()):
             gen_checks = []
             if not patterns:
@@ -363,8 +826,37 @@ class _StatementCompiler(StatementVisitor, _Compiler):
             else:
                 self.emitter.append(f"elif {' or '.join(gen_checks)}:")
             with self.emitter.indent():
+                self._count_branch(self.emitter, stmt, patterns)
                 self(stmts)
 
+    def _on_Switch_table(self, stmt, gen_test):
+        # Every case is compiled to a module level function, which updates the slots of its
+        # outputs directly, and a dictionary maps the value of the test to the function to call.
+        # As with the `if`/`elif` chain, the first case with a matching pattern takes precedence.
+        gen_entries = {}
+        gen_default = None
+        for patterns, stmts in stmt.cases.items():
+            def emit_case(emitter, patterns=patterns, stmts=stmts):
+                self._count_branch(emitter, stmt, patterns)
+                _StatementCompiler(self.state, emitter,
+                    inputs=self.rhs.inputs, outputs=self.lhs.outputs,
+                    slot_backed=self.lhs.slot_backed, coverage=self.coverage)(stmts)
+            gen_case = self.emitter.def_function("case", emit_case)
+            if not patterns:
+                gen_default = gen_case
+                break
+            for pattern in patterns:
+                gen_entries.setdefault(int(pattern, 2), gen_case)
+        gen_table = self.emitter.def_global("switch", "{{{}}}".format(", ".join(
+            f"{value}: {gen_case}" for value, gen_case in gen_entries.items())))
+        if gen_default is not None:
+            self.emitter.append(f"{gen_table}.get({gen_test}, {gen_default})()")
+        else:
+            gen_case = self.emitter.def_var("case", f"{gen_table}.get({gen_test})")
+            self.emitter.append(f"if {gen_case} is not None:")
+            with self.emitter.indent():
+                self.emitter.append(f"{gen_case}()")
+
     def on_Assert(self, stmt):
         raise NotImplementedError # :nocov:
 
@@ -374,83 +866,423 @@ class _StatementCompiler(StatementVisitor, _Compiler):
     def on_Cover(self, stmt):
         raise NotImplementedError # :nocov:
 
+    # Overridden by compilers that never keep the next value of a signal in its slot.
+    _slot_backed_signals = staticmethod(_slot_backed_signals)
+
     @classmethod
-    def compile(cls, state, stmt):
-        output_indexes = [state.get_signal(signal) for signal in stmt._lhs_signals()]
+    def _compile(cls, state, stmt, emit):
+        slot_backed = cls._slot_backed_signals([stmt])
+        output_indexes = [state.get_signal(signal) for signal in stmt._lhs_signals()
+                          if signal not in slot_backed]
         emitter = _PythonEmitter()
         for signal_index in output_indexes:
-            emitter.append(f"next_{signal_index} = slots[{signal_index}].next")
-        compiler = cls(state, emitter)
-        compiler(stmt)
+            emitter.append(f"next_{signal_index} = next[{signal_index}]")
+        emit(cls(state, emitter, slot_backed=slot_backed))
         for signal_index in output_indexes:
-            emitter.append(f"slots[{signal_index}].set(next_{signal_index})")
+            emitter.append(f"set({signal_index}, next_{signal_index})")
         return emitter.flush()
 
+    @classmethod
+    def compile(cls, state, stmt):
+        return cls._compile(state, stmt, lambda compiler: compiler(stmt))
+
+    @classmethod
+    def compile_assign(cls, state, lhs, *, rhs):
+        """Compile an assignment to ``lhs`` of the normalized value of the Python variable named
+        ``rhs``, which must be defined when the code is executed."""
+        return cls._compile(state, lhs.eq(0), lambda compiler: compiler.lhs(lhs)(rhs))
+
 
 class _FragmentCompiler:
+    # Overridden by compilers that generate code for a different representation of signal values.
+    _statement_compiler = _StatementCompiler
+
     def __init__(self, state):
         self.state = state
+        # If not None, code generated for every fragment is cached on disk; see `__call__`.
+        self.code_cache = _CodeCache.from_env()
+        # Processes compiled for the current fragment together with their code, and their
+        # triggers; these are recorded in the cache.
+        self._compiled = []
+        self._triggers = []
+        self._memory_triggers = []
+
+    # Overridden by compilers that generate code referring to other variables.
+    def _exec_locals(self, process):
+        exec_locals = {"curr": self.state.curr, "next": self.state.next, "set": self.state.set,
+                       **_ValueCompiler.helpers}
+        if self.state.coverage is not None:
+            exec_locals["branches"] = self.state.coverage.branches
+        return exec_locals
+
+    def _load_process(self, process, code, exec_locals):
+        exec_locals = {**self._exec_locals(process), **exec_locals}
+        exec(code, exec_locals)
+        process.run = exec_locals["run"]
+
+    # Overridden by compilers that generate code for values that cannot be compared with `!=`.
+    def _emit_set(self, emitter, signal_index):
+        # Most processes only change a few of their outputs every time they run; the call is
+        # skipped for the rest.
+        emitter.append(f"if next_{signal_index} != next[{signal_index}]:")
+        with emitter.indent():
+            emitter.append(f"set({signal_index}, next_{signal_index})")
+
+    def _add_trigger(self, process, signal, *, trigger=None):
+        self.state.add_trigger(process, signal, trigger=trigger)
+        self._triggers.append((process, signal, trigger))
+
+    def _add_memory_trigger(self, process, memory):
+        self.state.add_memory_trigger(process, memory)
+        self._memory_triggers.append((process, memory))
+
+    def _compile_process(self, process, signals, emit, exec_locals={}, *,
+                         slot_backed=SignalSet()):
+        emitter = _PythonEmitter()
+        emitter.begin_function("run")
+
+        emit(emitter)
+
+        for signal in signals:
+            if signal in slot_backed:
+                continue
+            self._emit_set(emitter, self.state.get_signal(signal))
+
+        # There shouldn't be any exceptions raised by the generated code, but if there are
+        # (almost certainly due to a bug in the code generator), use this environment variable
+        # to make backtraces useful.
+        code = emitter.flush()
+        if os.getenv("NMIGEN_pysim_dump"):
+            file = tempfile.NamedTemporaryFile("w", prefix="nmigen_pysim_", delete=False)
+            file.write(code)
+            filename = file.name
+        else:
+            filename = "<string>"
 
-    def __call__(self, fragment):
-        processes = set()
+        code = compile(code, filename, "exec")
+        self._compiled.append((process, code))
+        self._load_process(process, code, exec_locals)
+
+    @staticmethod
+    def _src_loc(stmts):
+        for stmt in stmts:
+            return stmt.src_loc
+        return None
+
+    def _comb_groups(self, domain_signals, domain_stmts):
+        groups = list(LHSGroupAnalyzer()(domain_stmts).values())
+        # Signals that are driven but never assigned only ever have their reset value.
+        undriven = SignalSet(domain_signals)
+        for group_signals in groups:
+            undriven -= group_signals
+        if undriven:
+            groups.append(undriven)
+        return groups
+
+    def _memory_exec_locals(self, memory):
+        memory_state = self.state.memories[self.state.get_memory(memory)]
+        return {"memory": memory_state, "memory_data": memory_state.data}
+
+    def _memory_domain(self, fragment, clk):
+        for domain in fragment.domains.values():
+            if domain.clk is clk:
+                return domain
+
+    def _memory_port_structure(self, fragment):
+        # Describes everything the code generated for a memory port depends on.
+        memory = fragment.parameters["MEMID"]
+        clk, _ = fragment.named_ports["CLK"]
+        domain = self._memory_domain(fragment, clk)
+        return (fragment.type, memory,
+                bool(fragment.parameters.get("CLK_ENABLE")),
+                bool(fragment.parameters.get("TRANSPARENT")),
+                None if domain is None else domain.clk_edge,
+                tuple(value for value, _ in fragment.named_ports.values()))
+
+    def _memory_addr(self, compiler, memory, addr):
+        gen_addr = compiler._to_unsigned(compiler(addr), len(addr))
+        if (1 << len(addr)) > memory.depth:
+            # Out of bounds accesses are redirected to the last word, like for `Array`.
+            gen_addr = f"min({gen_addr}, {memory.depth - 1})"
+        return gen_addr
+
+    def _memory_read(self, compiler, memory, addr):
+        if memory.depth == 0:
+            return f"0"
+        return f"memory_data[{self._memory_addr(compiler, memory, addr)}]"
+
+    def _compile_memory_write(self, fragment):
+        memory = fragment.parameters["MEMID"]
+        clk,  _ = fragment.named_ports["CLK"]
+        en,   _ = fragment.named_ports["EN"]
+        addr, _ = fragment.named_ports["ADDR"]
+        data, _ = fragment.named_ports["DATA"]
+
+        process = PyRTLProcess(is_comb=False, kind="memory", src_loc=memory.src_loc)
+        domain = self._memory_domain(fragment, clk)
+        clk_trigger = 0 if domain is not None and domain.clk_edge == "neg" else 1
+        self._add_trigger(process, clk, trigger=clk_trigger)
+
+        def emit(emitter):
+            if memory.depth == 0:
+                emitter.append(f"pass")
+                return
+            compiler = _RHSValueCompiler(self.state, emitter, mode="curr")
+            width_mask = (1 << memory.width) - 1
+            if len(en) == 1:
+                gen_en = emitter.def_var("en", f"{width_mask} if 1 & {compiler(en)} else 0")
+            else:
+                gen_en = emitter.def_var("en", f"{width_mask} & {compiler(en)}")
+            emitter.append(f"if {gen_en}:")
+            with emitter.indent():
+                emitter.append(f"memory.write({self._memory_addr(compiler, memory, addr)}, "
+                               f"{compiler._to_unsigned(compiler(data), memory.width, store=True)}, "
+                               f"{gen_en})")
+        self._compile_process(process, (), emit, self._memory_exec_locals(memory))
+        return process
+
+    def _compile_memory_read(self, fragment):
+        memory = fragment.parameters["MEMID"]
+        clk,  _ = fragment.named_ports["CLK"]
+        en,   _ = fragment.named_ports["EN"]
+        addr, _ = fragment.named_ports["ADDR"]
+        data, _ = fragment.named_ports["DATA"]
+
+        if not fragment.parameters["CLK_ENABLE"]:
+            # Asynchronous port.
+            def emit(emitter, inputs):
+                compiler = _RHSValueCompiler(self.state, emitter, mode="curr", inputs=inputs)
+                lhs_compiler = _LHSValueCompiler(self.state, emitter, rhs=compiler)
+                lhs_compiler(data)(self._memory_read(compiler, memory, addr))
+
+        elif fragment.parameters["TRANSPARENT"]:
+            # Synchronous, write-through port; see `ReadPort.elaborate` for details of the model.
+            domain = self._memory_domain(fragment, clk)
+            latch_addr, = fragment.drivers[next(name for name in fragment.drivers if name)]
+            clk_level = 0 if domain is not None and domain.clk_edge == "neg" else 1
+            def emit(emitter, inputs):
+                compiler = _RHSValueCompiler(self.state, emitter, mode="curr", inputs=inputs)
+                lhs_compiler = _LHSValueCompiler(self.state, emitter, rhs=compiler)
+                emitter.append(f"if {clk_level} == {compiler(clk)}:")
+                with emitter.indent():
+                    lhs_compiler(data)(self._memory_read(compiler, memory, latch_addr))
+                emitter.append(f"else:")
+                with emitter.indent():
+                    # The port is not sensitive to its own output.
+                    hold_compiler = _RHSValueCompiler(self.state, emitter, mode="curr")
+                    lhs_compiler(data)(hold_compiler(data))
 
+        else:
+            # Synchronous, read-before-write port.
+            def emit(emitter, inputs):
+                compiler = _RHSValueCompiler(self.state, emitter, mode="curr")
+                lhs_compiler = _LHSValueCompiler(self.state, emitter, rhs=compiler)
+                emitter.append(f"if {(1 << len(en)) - 1} & {compiler(en)}:")
+                with emitter.indent():
+                    lhs_compiler(data)(self._memory_read(compiler, memory, addr))
+
+        return data._lhs_signals(), emit
+
+    def _fragment_structure(self, fragment):
+        # Describes everything the code generated for a fragment depends on, except for its
+        # subfragments, which are compiled separately.
+        port = None
+        if isinstance(fragment, Instance) and fragment.type in ("$memrd", "$memwr"):
+            port = self._memory_port_structure(fragment)
+        drivers = []
         for domain_name, domain_signals in fragment.drivers.items():
-            domain_stmts = LHSGroupFilter(domain_signals)(fragment.statements)
-            domain_process = PyRTLProcess(is_comb=domain_name is None)
+            domain = None
+            if domain_name is not None:
+                domain = fragment.domains[domain_name]
+                domain = (domain.clk, domain.rst, domain.clk_edge, domain.async_reset)
+            drivers.append((domain_name, domain, domain_signals))
+        coverage = self.state.coverage
+        return (type(self).__module__, type(self).__qualname__, _SWITCH_TABLE_MIN_CASES,
+                # Branches are numbered in the order they are compiled.
+                None if coverage is None else len(coverage.branches),
+                port, tuple(drivers), fragment.statements)
+
+    def _load_fragment(self, fragment, entry):
+        branch_keys, process_entries = entry
+        for branch_key in branch_keys:
+            self.state.coverage.add_branch(branch_key)
+
+        def signals(slots):
+            if slots is None:
+                return None
+            return SignalSet(self.state.slot_signals[slot] for slot in slots)
+
+        exec_locals = {}
+        if isinstance(fragment, Instance) and fragment.type in ("$memrd", "$memwr"):
+            exec_locals = self._memory_exec_locals(fragment.parameters["MEMID"])
 
-            emitter = _PythonEmitter()
-            emitter.append(f"def run():")
-            emitter._level += 1
+        processes = set()
+        for (is_comb, kind, src_loc, input_slots, output_slots, code,
+                triggers, memory_triggers) in process_entries:
+            process = PyRTLProcess(is_comb=is_comb,
+                                   inputs=signals(input_slots), outputs=signals(output_slots),
+                                   kind=kind, src_loc=src_loc)
+            for slot, trigger in triggers:
+                signal = self.state.slot_signals[slot]
+                self.state.add_trigger(process, signal, trigger=trigger)
+            for memory_index in memory_triggers:
+                memory = self.state.memories[memory_index].memory
+                self.state.add_memory_trigger(process, memory)
+            self._load_process(process, code, exec_locals)
+            processes.add(process)
+        return processes
 
-            if domain_name is None:
-                for signal in domain_signals:
-                    signal_index = self.state.get_signal(signal)
-                    emitter.append(f"next_{signal_index} = {signal.reset}")
+    def _store_fragment(self):
+        get_signal = self.state.get_signal
+        get_memory = self.state.get_memory
+
+        def slots(signals):
+            if signals is None:
+                return None
+            return [get_signal(signal) for signal in signals]
+
+        process_entries = []
+        for process, code in self._compiled:
+            process_entries.append((
+                process.is_comb, process.kind, process.src_loc,
+                slots(process.inputs), slots(process.outputs), code,
+                [(get_signal(signal), trigger)
+                 for trigger_process, signal, trigger in self._triggers
+                 if trigger_process is process],
+                [get_memory(memory)
+                 for trigger_process, memory in self._memory_triggers
+                 if trigger_process is process],
+            ))
+        return process_entries
+
+    def __call__(self, fragment, *, hierarchy=("top",)):
+        # Generated code only depends on the structure of the fragment and on the slots assigned
+        # to its signals while describing it, so it can be reused by every simulation of
+        # the same fragment, even in other processes. Besides the code, the cache records what
+        # would otherwise only be known after generating it: the triggers and inputs of every
+        # process, and the branches added to the coverage.
+        processes = None
+        cache_key = None
+        if self.code_cache is not None and not os.getenv("NMIGEN_pysim_dump"):
+            try:
+                cache_key = self.code_cache.key(self.state, self._fragment_structure(fragment))
+            except _Uncacheable:
+                pass
+            else:
+                entry = self.code_cache.load(cache_key)
+                if entry is not None:
+                    processes = self._load_fragment(fragment, entry)
+
+        if processes is None:
+            coverage = self.state.coverage
+            slot_count = len(self.state.slot_signals)
+            branch_count = 0 if coverage is None else len(coverage.branches)
+            self._compiled.clear()
+            self._triggers.clear()
+            self._memory_triggers.clear()
+            processes = self._compile_fragment(fragment)
+            # If generating the code assigned new slots, then the structure of the fragment did
+            # not describe everything the code depends on, and the code cannot be reused.
+            if cache_key is not None and len(self.state.slot_signals) == slot_count:
+                self.code_cache.store(cache_key, (
+                    [] if coverage is None else coverage.branch_keys[branch_count:],
+                    self._store_fragment(),
+                ))
+
+        for process in processes:
+            process.hierarchy = hierarchy
+
+        for subfragment_index, (subfragment, subfragment_name) in enumerate(fragment.subfragments):
+            if subfragment_name is None:
+                subfragment_name = "U${}".format(subfragment_index)
+            processes.update(self(subfragment, hierarchy=(*hierarchy, subfragment_name)))
+
+        return processes
+
+    def _compile_fragment(self, fragment):
+        processes = set()
+
+        # Memories are simulated natively: the contents of a memory are stored in a list, and
+        # memory ports are compiled to code that indexes it directly. The output of a read port
+        # is computed by the process that drives it, before any statements of the port fragment
+        # (e.g. ones added by `ResetInserter`) are evaluated.
+        memory = None
+        read_signals = SignalSet()
+        if isinstance(fragment, Instance) and fragment.type == "$memwr":
+            memory = fragment.parameters["MEMID"]
+            processes.add(self._compile_memory_write(fragment))
+        if isinstance(fragment, Instance) and fragment.type == "$memrd":
+            memory = fragment.parameters["MEMID"]
+            read_signals, read_emit = self._compile_memory_read(fragment)
+        exec_locals = {} if memory is None else self._memory_exec_locals(memory)
 
-                inputs = SignalSet()
-                _StatementCompiler(self.state, emitter, inputs=inputs)(domain_stmts)
+        for domain_name, domain_signals in fragment.drivers.items():
+            domain_stmts = LHSGroupFilter(domain_signals)(fragment.statements)
 
-                for input in inputs:
-                    self.state.add_trigger(domain_process, input)
+            if domain_name is None:
+                # Every group of combinatorial signals that are never assigned together is
+                # compiled to a separate process, which is only woken up by the signals that group
+                # depends on; this way, a change of an input does not cause re-evaluation of
+                # unrelated logic.
+                for group_signals in self._comb_groups(domain_signals, domain_stmts):
+                    group_stmts = LHSGroupFilter(group_signals)(domain_stmts)
+                    inputs = SignalSet()
+                    group_process = PyRTLProcess(is_comb=True,
+                                                 inputs=inputs, outputs=group_signals,
+                                                 kind="comb", src_loc=self._src_loc(group_stmts))
+                    is_read = any(signal in read_signals for signal in group_signals)
+                    slot_backed = self._statement_compiler._slot_backed_signals(group_stmts)
+                    def emit(emitter):
+                        for signal in group_signals:
+                            signal_index = self.state.get_signal(signal)
+                            if signal in slot_backed:
+                                emitter.append(f"set({signal_index}, {signal.reset})")
+                            else:
+                                emitter.append(f"next_{signal_index} = {signal.reset}")
+
+                        if is_read:
+                            read_emit(emitter, inputs)
+                        self._statement_compiler(self.state, emitter, inputs=inputs,
+                                                 slot_backed=slot_backed,
+                                                 coverage=self.state.coverage)(group_stmts)
+                    self._compile_process(group_process, group_signals, emit, exec_locals,
+                                          slot_backed=slot_backed)
+
+                    for input in inputs:
+                        self._add_trigger(group_process, input)
+                    if is_read:
+                        self._add_memory_trigger(group_process, memory)
+
+                    processes.add(group_process)
 
             else:
+                domain_process = PyRTLProcess(is_comb=False, kind=domain_name,
+                                              src_loc=self._src_loc(domain_stmts))
+
                 domain = fragment.domains[domain_name]
                 clk_trigger = 1 if domain.clk_edge == "pos" else 0
-                self.state.add_trigger(domain_process, domain.clk, trigger=clk_trigger)
+                self._add_trigger(domain_process, domain.clk, trigger=clk_trigger)
                 if domain.rst is not None and domain.async_reset:
                     rst_trigger = 1
-                    self.state.add_trigger(domain_process, domain.rst, trigger=rst_trigger)
-
-                for signal in domain_signals:
-                    signal_index = self.state.get_signal(signal)
-                    emitter.append(f"next_{signal_index} = slots[{signal_index}].next")
-
-                _StatementCompiler(self.state, emitter)(domain_stmts)
-
-            for signal in domain_signals:
-                signal_index = self.state.get_signal(signal)
-                emitter.append(f"slots[{signal_index}].set(next_{signal_index})")
-
-            # There shouldn't be any exceptions raised by the generated code, but if there are
-            # (almost certainly due to a bug in the code generator), use this environment variable
-            # to make backtraces useful.
-            code = emitter.flush()
-            if os.getenv("NMIGEN_pysim_dump"):
-                file = tempfile.NamedTemporaryFile("w", prefix="nmigen_pysim_", delete=False)
-                file.write(code)
-                filename = file.name
-            else:
-                filename = "<string>"
-
-            exec_locals = {"slots": self.state.slots, **_ValueCompiler.helpers}
-            exec(compile(code, filename, "exec"), exec_locals)
-            domain_process.run = exec_locals["run"]
-
-            processes.add(domain_process)
-
-        for subfragment_index, (subfragment, subfragment_name) in enumerate(fragment.subfragments):
-            if subfragment_name is None:
-                subfragment_name = "U${}".format(subfragment_index)
-            processes.update(self(subfragment))
+                    self._add_trigger(domain_process, domain.rst, trigger=rst_trigger)
+
+                is_read = any(signal in read_signals for signal in domain_signals)
+                slot_backed = self._statement_compiler._slot_backed_signals(domain_stmts)
+                def emit(emitter):
+                    for signal in domain_signals:
+                        if signal in slot_backed:
+                            continue
+                        signal_index = self.state.get_signal(signal)
+                        emitter.append(f"next_{signal_index} = next[{signal_index}]")
+
+                    if is_read:
+                        read_emit(emitter, None)
+                    self._statement_compiler(self.state, emitter,
+                                             slot_backed=slot_backed,
+                                             coverage=self.state.coverage)(domain_stmts)
+                self._compile_process(domain_process, domain_signals, emit, exec_locals,
+                                      slot_backed=slot_backed)
+
+                processes.add(domain_process)
 
         return processes
@@ -0,0 +1,46 @@
+from ._base import BaseProcess
+
+
+__all__ = ["PyStimulusProcess"]
+
+
+class PyStimulusProcess(BaseProcess):
+    def __init__(self, state, signal, values, *, domain, passive):
+        self.state   = state
+        self.slot    = self.state.get_signal(signal)
+        self.values  = values
+        self.clk     = domain.clk
+        self.trigger = 1 if domain.clk_edge == "pos" else 0
+        self.initial_passive = passive
+
+        # The process waits for every clock edge for as long as it has values to apply, instead
+        # of waiting for each edge separately.
+        self.waiting = False
+        self.reset()
+
+    def reset(self):
+        self.runnable = True
+        self.passive = self.initial_passive
+
+        if self.waiting:
+            self.state.remove_trigger(self, self.clk)
+            self.waiting = False
+        self.index = 0
+
+    def run(self):
+        self.runnable = False
+
+        if not self.waiting:
+            # Like a synchronous process, only start applying values after the first clock edge.
+            self.state.add_trigger(self, self.clk, trigger=self.trigger)
+            self.waiting = True
+
+        elif self.index < len(self.values):
+            self.state.set(self.slot, self.values[self.index])
+            self.index += 1
+
+        else:
+            # The last value is applied for a whole cycle before the process finishes.
+            self.state.remove_trigger(self, self.clk)
+            self.waiting = False
+            self.passive = True
@@ -1,16 +1,22 @@
+import asyncio
+import functools
 import inspect
 
 from .._utils import deprecated
+from ..hdl.ast import Signal, Const
 from ..hdl.cd import *
 from ..hdl.ir import *
 from ._base import BaseEngine
 
 
-__all__ = ["Settle", "Delay", "Tick", "Passive", "Active", "Simulator"]
+__all__ = ["Settle", "Delay", "Tick", "Passive", "Active", "Eval", "Simulator"]
 
 
 class Command:
-    pass
+    # Commands can be awaited by processes that are coroutine functions, in the same way as they
+    # are yielded by processes that are generator functions.
+    def __await__(self):
+        return (yield self)
 
 
 class Settle(Command):
@@ -51,20 +57,43 @@ class Active(Command):
         return "(active)"
 
 
+class Eval(Command):
+    """Evaluate a value or execute a statement.
+
+    Processes that are generator functions yield values and statements directly; processes that
+    are coroutine functions await ``Eval(value)`` to receive the current value of ``value``, and
+    ``Eval(stmt)`` to execute ``stmt``.
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def __await__(self):
+        return (yield self.value)
+
+    def __repr__(self):
+        return "(eval {!r})".format(self.value)
+
+
 class Simulator:
-    def __init__(self, fragment, *, engine="pysim"):
+    def __init__(self, fragment, *, engine="pysim", **engine_options):
         if isinstance(engine, type) and issubclass(engine, BaseEngine):
             pass
         elif engine == "pysim":
             from .pysim import PySimEngine
             engine = PySimEngine
+        elif engine == "cxxrtl":
+            from .cxxsim import CxxSimEngine
+            engine = CxxSimEngine
+        elif engine == "numpy":
+            from .npsim import NumPySimEngine
+            engine = NumPySimEngine
         else:
             raise TypeError("Value '{!r}' is not a simulation engine class or "
                             "a simulation engine name"
                             .format(engine))
 
         self._fragment = Fragment.get(fragment, platform=None).prepare()
-        self._engine   = engine(self._fragment)
+        self._engine   = engine(self._fragment, **engine_options)
         self._clocked  = set()
 
     def _check_process(self, process):
@@ -74,22 +103,103 @@ class Simulator:
         return process
 
     def add_process(self, process):
+        """Add a process.
+
+        ``process`` is either a generator function, which yields commands, or a coroutine function
+        (``async def``), which awaits them; see :class:`Eval`. A coroutine function may also await
+        asyncio futures, tasks, and coroutines, e.g. to communicate with a reference model over
+        a socket, in which case the simulation must be run with :meth:`run_async` or a similar
+        method. Simulation time does not advance while a process awaits an asyncio future, but
+        other processes keep running until they wait for time to advance, too.
+        """
         process = self._check_process(process)
-        def wrapper():
-            # Only start a bench process after comb settling, so that the reset values are correct.
-            yield Settle()
-            yield from process()
+        if inspect.iscoroutinefunction(process):
+            @functools.wraps(process)
+            async def wrapper():
+                await Settle()
+                await process()
+        else:
+            @functools.wraps(process)
+            def wrapper():
+                # Only start a bench process after comb settling, so that the reset values are
+                # correct.
+                yield Settle()
+                yield from process()
         self._engine.add_coroutine_process(wrapper, default_cmd=None)
 
     def add_sync_process(self, process, *, domain="sync"):
+        """Add a synchronous process.
+
+        Like :meth:`add_process`, but the process starts after the first clock edge of ``domain``,
+        and a generator function that yields ``None`` waits for the next clock edge. A coroutine
+        function must await :class:`Tick` explicitly.
+        """
         process = self._check_process(process)
-        def wrapper():
-            # Only start a sync process after the first clock edge (or reset edge, if the domain
-            # uses an asynchronous reset). This matches the behavior of synchronous FFs.
-            yield Tick(domain)
-            yield from process()
+        if inspect.iscoroutinefunction(process):
+            @functools.wraps(process)
+            async def wrapper():
+                await Tick(domain)
+                await process()
+        else:
+            @functools.wraps(process)
+            def wrapper():
+                # Only start a sync process after the first clock edge (or reset edge, if
+                # the domain uses an asynchronous reset). This matches the behavior of
+                # synchronous FFs.
+                yield Tick(domain)
+                yield from process()
         self._engine.add_coroutine_process(wrapper, default_cmd=Tick(domain))
 
+    def add_stimulus(self, signal, values, *, domain="sync", passive=False):
+        """Add a stimulus process.
+
+        Adds a process that drives ``signal`` with a precomputed sequence of values, applying
+        the next value at every clock edge of ``domain``. It behaves like the following
+        synchronous process, but no Python generator runs for it::
+
+            def process():
+                for value in values:
+                    yield signal.eq(value)
+                    yield
+
+        Arguments
+        ---------
+        signal : Signal
+            Driven signal.
+        values : iterable of int
+            Values of the signal. Any sequence, :class:`array.array`, or one-dimensional NumPy
+            array is accepted; the values are copied when the process is added.
+        domain : str or ClockDomain
+            Clock domain. If specified as a string, the domain with that name is looked up in
+            the root fragment of the simulation.
+        passive : bool
+            If ``False`` (the default), the process is active until every value has been applied
+            for a whole clock cycle, like a testbench process; if ``True``, the simulation does
+            not wait for it.
+        """
+        if not isinstance(signal, Signal):
+            raise TypeError("Stimulus must drive a Signal, not {!r}"
+                            .format(signal))
+        if isinstance(domain, ClockDomain):
+            pass
+        elif domain in self._fragment.domains:
+            domain = self._fragment.domains[domain]
+        else:
+            raise ValueError("Domain {!r} is not present in simulation"
+                             .format(domain))
+
+        if hasattr(values, "tolist"):
+            # Arrays are converted to Python integers all at once.
+            values = values.tolist()
+        shape = signal.shape()
+        normalized = []
+        for value in values:
+            if not isinstance(value, int):
+                raise TypeError("Stimulus value must be an integer, not {!r}"
+                                .format(value))
+            normalized.append(Const.normalize(value, shape))
+        self._engine.add_stimulus_process(signal, normalized, domain=domain, passive=passive)
+
     def add_clock(self, period, *, phase=None, domain="sync", if_exists=False):
         """Add a clock process.
 
@@ -132,6 +242,64 @@ class Simulator:
         self._engine.add_clock_process(domain.clk, phase=phase, period=period)
         self._clocked.add(domain)
 
+    def add_recorder(self, vcd_file=None, gtkw_file=None, *, size=1 << 16, duration=None,
+                     cycles=None, domain="sync", traces=(), include=None, depth=None):
+        """Add a flight recorder.
+
+        A flight recorder keeps the most recent value changes of the selected signals in memory,
+        and writes them to a Value Change Dump file only when asked to. It is cheap enough to be
+        left enabled, e.g. in continuous integration, so that a failed simulation does not need to
+        be repeated to see how it failed.
+
+        If ``vcd_file`` is specified, the waveforms are written to it when an exception escapes
+        a process, e.g. when an assertion fails in a testbench. They can also be written at any
+        time using the ``dump`` method of the returned recorder: ::
+
+            sim = Simulator(frag)
+            sim.add_clock(1e-6)
+            recorder = sim.add_recorder("failure.vcd", cycles=100)
+            sim.run_until(1e-3)
+            recorder.dump("end.vcd", "end.gtkw")
+
+        The recorder is not supported by the ``"cxxrtl"`` engine.
+
+        Arguments
+        ---------
+        vcd_file : None or str or file-like object
+            Verilog Value Change Dump file or filename written when an exception escapes
+            a process.
+        gtkw_file : None or str or file-like object
+            GTKWave save file or filename written together with ``vcd_file``.
+        size : int
+            Number of value changes kept in memory. If the older changes have been discarded,
+            the waveforms start later than requested.
+        duration : None or float
+            If specified, the waveforms include only this much of the most recent simulation time.
+        cycles : None or int
+            If specified, the waveforms include only this many of the most recent clock cycles of
+            ``domain``, as driven by :meth:`add_clock`.
+        domain : str or ClockDomain
+            Clock domain in which ``cycles`` are counted.
+        traces, include, depth
+            Select the recorded signals, as for :meth:`write_vcd`.
+        """
+        if duration is not None and cycles is not None:
+            raise ValueError("Recorded waveforms can be limited by duration or by number of "
+                             "cycles, but not both")
+        clock = None
+        if cycles is not None:
+            if isinstance(domain, ClockDomain):
+                pass
+            elif domain in self._fragment.domains:
+                domain = self._fragment.domains[domain]
+            else:
+                raise ValueError("Domain {!r} is not present in simulation"
+                                 .format(domain))
+            clock = domain.clk
+        return self._engine.add_recorder(vcd_file=vcd_file, gtkw_file=gtkw_file, size=size,
+                                         duration=duration, clock=clock, cycles=cycles,
+                                         traces=traces, include=include, depth=depth)
+
     def reset(self):
         """Reset the simulation.
 
@@ -139,6 +307,69 @@ class Simulator:
         """
         self._engine.reset()
 
+    def snapshot(self):
+        """Capture the state of the simulated design.
+
+        The snapshot includes the current and next value of every signal in the design,
+        the contents of every memory, the simulation time, and the phase of every clock process.
+        It does not include the state of user processes, which cannot be captured.
+
+        Snapshots can be pickled, e.g. to reuse the state reached after a long initialization
+        sequence in another process, and restored into any simulator of the same design that
+        uses the same engine.
+        """
+        return self._engine.snapshot()
+
+    def restore(self, snapshot):
+        """Restore the state of the simulated design.
+
+        Assigns the values captured by :meth:`snapshot` to every signal and memory in the design,
+        and sets the simulation time to the time of the snapshot. Clock processes that drive
+        the same clocks as when the snapshot was taken continue with the same phase; every
+        other process is restarted, as with :meth:`reset`. A single snapshot can be restored
+        any number of times, into this or any other simulator, to fork the simulation.
+
+        Raises :exc:`ValueError` if the snapshot was taken from a different design.
+        """
+        self._engine.restore(snapshot)
+
+    def coverage(self):
+        """Return the coverage collected by the simulation so far.
+
+        Coverage is only collected if the simulator is created with ``coverage=True``, which is
+        supported by the ``"pysim"`` engine. Every branch of every ``Switch`` statement in
+        the design then counts how many times it is taken, and every signal of the design records
+        which of its bits rose and fell. Coverage is accumulated across :meth:`reset` and
+        :meth:`restore`.
+
+        Returns a :class:`Coverage`; the coverage of many simulations, e.g. of the testbenches run
+        by :func:`run_parallel`, can be combined with :meth:`Coverage.merge`.
+        """
+        return self._engine.coverage()
+
+    def profile(self):
+        """Profile the simulation.
+
+        This method returns a context manager. While it is active, the simulation engine measures
+        how often, and for how long, every process runs. It can be used as: ::
+
+            sim = Simulator(frag)
+            sim.add_clock(1e-6)
+            with sim.profile() as profile:
+                sim.run_until(1e-3)
+            print(profile.report())
+
+        The profile is a :class:`SimulationProfile`, which is complete once the context manager
+        exits. It lists every process with its number of invocations, wall time, and number of
+        signal updates; processes compiled from HDL are named after the hierarchy of their fragment,
+        and testbench processes after their function. It also counts the delta cycles needed to
+        settle the design at every timestamp, and how often every signal changes. Clock periods
+        skipped while the design is idle are not included.
+
+        Profiling slows down the simulation, and is not supported by the ``"cxxrtl"`` engine.
+        """
+        return self._engine.profile()
+
     # TODO(nmigen-0.4): replace with _real_step
     @deprecated("instead of `sim.step()`, use `sim.advance()`")
     def step(self):
@@ -151,9 +382,41 @@ class Simulator:
         to the closest deadline (if any). If there is an unstable combinatorial loop,
         this function will never return.
 
+        If nothing but clock signals has changed for a whole clock period, and no user process
+        is waiting for a clock edge, the engine may skip many clock periods at once, up to
+        shortly before the closest deadline of a user process.
+
         Returns ``True`` if there are any active processes, ``False`` otherwise.
+
+        Raises :exc:`RuntimeError` if a process awaits an asyncio future; such simulations must
+        be advanced with :meth:`advance_async`.
+        """
+        return self._advance()
+
+    def _advance(self, deadline=None):
+        active = self._engine.advance(deadline=deadline)
+        if self._engine.pending_futures:
+            raise RuntimeError("A process awaits an asyncio future; use `await sim.advance_async()`"
+                               " or `await sim.run_async()` to run the simulation")
+        return active
+
+    async def _advance_async(self, deadline=None):
+        # The event loop only runs while a process awaits a future; time does not advance until
+        # every such future is done and the processes awaiting them have run.
+        while True:
+            active = self._engine.advance(deadline=deadline)
+            pending_futures = self._engine.pending_futures
+            if not pending_futures:
+                return active
+            await asyncio.wait(pending_futures, return_when=asyncio.FIRST_COMPLETED)
+
+    async def advance_async(self):
+        """Advance the simulation, running the asyncio event loop while processes await it.
+
+        Like :meth:`advance`, but processes that are coroutine functions may await asyncio
+        futures, tasks, and coroutines.
         """
-        return self._engine.advance()
+        return await self._advance_async()
 
     def run(self):
         """Run the simulation while any processes are active.
@@ -165,6 +428,14 @@ class Simulator:
         while self.advance():
             pass
 
+    async def run_async(self):
+        """Run the simulation while any processes are active, like :meth:`run`.
+
+        See :meth:`advance_async`.
+        """
+        while await self._advance_async():
+            pass
+
     def run_until(self, deadline, *, run_passive=False):
         """Run the simulation until it advances to ``deadline``.
 
@@ -175,10 +446,27 @@ class Simulator:
         If the simulation stops advancing, this function will never return.
         """
         assert self._engine.now <= deadline
-        while (self.advance() or run_passive) and self._engine.now < deadline:
+        while (self._advance(deadline) or run_passive) and self._engine.now < deadline:
             pass
 
-    def write_vcd(self, vcd_file, gtkw_file=None, *, traces=()):
+    async def run_until_async(self, deadline, *, run_passive=False):
+        """Run the simulation until it advances to ``deadline``, like :meth:`run_until`.
+
+        See :meth:`advance_async`.
+        """
+        assert self._engine.now <= deadline
+        while (await self._advance_async(deadline) or run_passive) and \
+                self._engine.now < deadline:
+            pass
+
+    @staticmethod
+    def _check_window(start, stop):
+        if start is not None and stop is not None and stop < start:
+            raise ValueError("Waveform window ends at {!r}, before it starts at {!r}"
+                             .format(stop, start))
+
+    def write_vcd(self, vcd_file, gtkw_file=None, *, traces=(),
+                  include=None, depth=None, start=None, stop=None):
         """Write waveforms to a Value Change Dump file, optionally populating a GTKWave save file.
 
         This method returns a context manager. It can be used as: ::
@@ -188,6 +476,18 @@ class Simulator:
             with sim.write_vcd("dump.vcd", "dump.gtkw"):
                 sim.run_until(1e-3)
 
+        Waveforms can be written for a part of the design and a part of the simulation only.
+        Signals that are filtered out are never registered in the file, and the simulation engine
+        skips their changes, so writing only the interesting signals around the interesting time
+        is much faster than writing them all.
+        The waveforms may be started after the simulation time has advanced, e.g. from within
+        a process; the values that the signals have at that time become the initial values.
+        Filtering and starting after time 0 are not supported by the ``"cxxrtl"`` engine.
+
+        The contents of every memory are written as one signal per word, named ``memory(addr)``
+        (after the memory) in the scope of each of its ports. Tracking the words of large memories
+        is costly; they can be filtered out with ``include`` or ``depth`` like other signals.
+
         Arguments
         ---------
         vcd_file : str or file-like object
@@ -195,12 +495,43 @@ class Simulator:
         gtkw_file : str or file-like object
             GTKWave save file or filename.
         traces : iterable of Signal
-            Signals to display traces for.
+            Signals to display traces for. These signals are always written.
+        include : None or str or iterable of str
+            Glob patterns matched against the hierarchical names of signals, such as
+            ``"top.cpu.*"``. If specified, only the signals with a name matching any of
+            the patterns are written.
+        depth : None or int
+            If specified, only the signals of the toplevel fragment and of subfragments up to
+            ``depth`` levels below it are written.
+        start : None or float
+            If specified, the waveforms start at this time instead of the current one.
+        stop : None or float
+            If specified, the waveforms end at this time instead of when the context manager exits.
         """
-        if self._engine.now != 0.0:
-            for file in (vcd_file, gtkw_file):
-                if hasattr(file, "close"):
-                    file.close()
-            raise ValueError("Cannot start writing waveforms after advancing simulation time")
+        self._check_window(start, stop)
+        return self._engine.write_vcd(vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces,
+                                      include=include, depth=depth, start=start, stop=stop)
 
-        return self._engine.write_vcd(vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces)
+    def write_fst(self, fst_file, gtkw_file=None, *, traces=(),
+                  include=None, depth=None, start=None, stop=None):
+        """Write waveforms to an FST file, optionally populating a GTKWave save file.
+
+        FST is the compressed, indexed waveform format of GTKWave. It is usually many times smaller
+        than a Value Change Dump of the same waveforms, and faster to write. Files can be converted
+        to Value Change Dump files with :func:`fst_to_vcd`.
+
+        This method returns a context manager, and is used the same way as :meth:`write_vcd`,
+        with the same arguments. It is not supported by the ``"cxxrtl"`` engine.
+
+        Arguments
+        ---------
+        fst_file : str or binary file-like object
+            FST file or filename. The file must be seekable.
+        gtkw_file : str or file-like object
+            GTKWave save file or filename.
+        traces : iterable of Signal
+            Signals to display traces for.
+        """
+        self._check_window(start, stop)
+        return self._engine.write_fst(fst_file=fst_file, gtkw_file=gtkw_file, traces=traces,
+                                      include=include, depth=depth, start=start, stop=stop)
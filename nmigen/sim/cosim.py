@@ -0,0 +1,285 @@
+import os
+import json
+import socket
+import struct
+
+from ..hdl import *
+from .core import Settle
+
+
+__all__ = ["CosimEndpoint", "CosimClient"]
+
+
+# Every message starts with a little-endian 32-bit unsigned integer: the length of the handshake,
+# the requested or agreed batch size, or the number of cycles in a batch.
+_u32 = struct.Struct("<I")
+
+_MAGIC   = b"NMCS"
+_VERSION = 1
+
+
+def _recv_exactly(sock, size, *, eof_ok=False):
+    data = bytearray(size)
+    view = memoryview(data)
+    offset = 0
+    while offset < size:
+        received = sock.recv_into(view[offset:])
+        if received == 0:
+            if eof_ok and offset == 0:
+                return None
+            raise ConnectionError("Co-simulation peer closed the connection in the middle of "
+                                  "a message")
+        offset += received
+    return data
+
+
+def _recv_u32(sock, *, eof_ok=False):
+    data = _recv_exactly(sock, _u32.size, eof_ok=eof_ok)
+    if data is None:
+        return None
+    value, = _u32.unpack(data)
+    return value
+
+
+class _Layout:
+    # Values of every port are transferred as `ceil(width / 8)` bytes in little-endian order,
+    # two's complement if the port is signed; the values of one cycle are transferred in
+    # the order of the ports, and cycles one after another.
+    def __init__(self, ports):
+        self.ports = [(str(name), int(width), bool(signed)) for name, width, signed in ports]
+        self.fields = [((width + 7) // 8, signed) for name, width, signed in self.ports]
+        self.size = sum(byte_count for byte_count, signed in self.fields)
+
+    def pack(self, rows):
+        data = bytearray()
+        for row in rows:
+            if len(row) != len(self.fields):
+                raise ValueError("Cycle {!r} has {} values, but there are {} ports"
+                                 .format(row, len(row), len(self.fields)))
+            for (byte_count, signed), value in zip(self.fields, row):
+                data += value.to_bytes(byte_count, "little", signed=signed)
+        return data
+
+    def unpack(self, data, count):
+        rows = []
+        offset = 0
+        for _ in range(count):
+            row = []
+            for byte_count, signed in self.fields:
+                row.append(int.from_bytes(data[offset:offset + byte_count], "little",
+                                          signed=signed))
+                offset += byte_count
+            rows.append(tuple(row))
+        return rows
+
+
+class CosimEndpoint:
+    """Co-simulation endpoint exposing top-level ports of a design to another process.
+
+    The endpoint serves a peer, e.g. a golden model written in C++ or Python, over a connected
+    stream socket. The peer sends many cycles of stimulus at once, and receives the response of
+    the design to all of them in a single message, so that the cost of communication is
+    amortized over the whole batch. :class:`CosimClient` implements the peer side in Python.
+
+    The protocol consists of the following messages, where ``u32`` is a little-endian 32-bit
+    unsigned integer:
+
+    1. The endpoint sends ``b"NMCS"``, the ``u32`` length of a handshake, and the handshake,
+       a JSON object with the keys ``"version"`` (currently 1), ``"max_batch"``, ``"inputs"``,
+       and ``"outputs"``; the ports are lists of ``[name, width, signed]`` triples.
+    2. The peer sends the ``u32`` batch size it requests, and the endpoint replies with
+       the ``u32`` batch size it agrees to, which is the smaller of the requested size and
+       ``max_batch``.
+    3. The peer sends the ``u32`` number of cycles in a batch, which is at most the agreed batch
+       size, followed by the values of every input for every cycle. The value of a port is
+       transferred as ``ceil(width / 8)`` bytes in little-endian order (two's complement if
+       the port is signed), and the values of a cycle in the order of the ports.
+       For each cycle, the endpoint drives the inputs, waits for a clock edge, and samples
+       the outputs once the design settles; it then replies with the values of every output
+       for every cycle, in the same format. This step is repeated until the peer sends
+       a batch of 0 cycles or closes the connection, after which the endpoint process returns.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        Connected stream socket, e.g. returned by :func:`socket.socketpair`. The endpoint closes
+        it once the peer is done.
+    inputs : list of Signal
+        Ports driven by the peer.
+    outputs : list of Signal
+        Ports sampled for the peer.
+    max_batch : int
+        Largest number of cycles the endpoint accepts in one message.
+    """
+    def __init__(self, sock, *, inputs, outputs, max_batch=1024):
+        for port in (*inputs, *outputs):
+            if not isinstance(port, Signal):
+                raise TypeError("Co-simulation port must be a Signal, not {!r}"
+                                .format(port))
+        if not isinstance(max_batch, int) or max_batch <= 0:
+            raise TypeError("Maximum batch size must be a positive integer, not {!r}"
+                            .format(max_batch))
+        self.sock      = sock
+        self.inputs    = list(inputs)
+        self.outputs   = list(outputs)
+        self.max_batch = max_batch
+        self.batch     = None
+
+    @classmethod
+    def listen(cls, path, **kwargs):
+        """Wait for a peer to connect to a Unix socket at ``path``, and create an endpoint for it.
+
+        The socket file is removed once the peer connects. Other arguments are passed to
+        :class:`CosimEndpoint`.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+            listener.bind(path)
+            try:
+                listener.listen(1)
+                sock, _ = listener.accept()
+            finally:
+                os.unlink(path)
+        return cls(sock, **kwargs)
+
+    @staticmethod
+    def _describe(ports):
+        return [[port.name, len(port), port.shape().signed] for port in ports]
+
+    def _handshake(self):
+        handshake = json.dumps({
+            "version":   _VERSION,
+            "max_batch": self.max_batch,
+            "inputs":    self._describe(self.inputs),
+            "outputs":   self._describe(self.outputs),
+        }).encode("utf-8")
+        self.sock.sendall(_MAGIC + _u32.pack(len(handshake)) + handshake)
+        requested = _recv_u32(self.sock)
+        if requested == 0:
+            raise ValueError("Co-simulation peer requested a batch size of 0")
+        self.batch = min(requested, self.max_batch)
+        self.sock.sendall(_u32.pack(self.batch))
+
+    def process(self):
+        """Serve the peer.
+
+        This is a generator function that must be added with :meth:`Simulator.add_sync_process`,
+        for the domain whose clock edges delimit the cycles exchanged with the peer.
+        """
+        sock = self.sock
+        input_layout  = _Layout(self._describe(self.inputs))
+        output_layout = _Layout(self._describe(self.outputs))
+        try:
+            self._handshake()
+            while True:
+                count = _recv_u32(sock, eof_ok=True)
+                if not count:
+                    break
+                if count > self.batch:
+                    raise ValueError("Co-simulation peer sent a batch of {} cycles, but the "
+                                     "agreed batch size is {}"
+                                     .format(count, self.batch))
+                rows = input_layout.unpack(_recv_exactly(sock, count * input_layout.size), count)
+
+                responses = []
+                for row in rows:
+                    for port, value in zip(self.inputs, row):
+                        yield port.eq(value)
+                    yield
+                    yield Settle()
+                    response = []
+                    for port in self.outputs:
+                        response.append((yield port))
+                    responses.append(response)
+                sock.sendall(output_layout.pack(responses))
+        finally:
+            sock.close()
+
+
+class CosimClient:
+    """Peer of a :class:`CosimEndpoint`, for golden models written in Python.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        Connected stream socket.
+    batch : int
+        Requested batch size. The agreed batch size, which may be smaller, is available as
+        :attr:`batch` once the client is created.
+
+    Attributes
+    ----------
+    inputs : list of (str, int, bool)
+        Name, width, and signedness of every input of the endpoint.
+    outputs : list of (str, int, bool)
+        Name, width, and signedness of every output of the endpoint.
+    batch : int
+        Agreed batch size.
+    """
+    def __init__(self, sock, *, batch=1024):
+        if not isinstance(batch, int) or batch <= 0:
+            raise TypeError("Batch size must be a positive integer, not {!r}"
+                            .format(batch))
+        self.sock = sock
+
+        magic = _recv_exactly(sock, len(_MAGIC))
+        if magic != _MAGIC:
+            raise ValueError("Co-simulation endpoint sent an invalid handshake")
+        handshake = json.loads(_recv_exactly(sock, _recv_u32(sock)).decode("utf-8"))
+        if handshake["version"] != _VERSION:
+            raise ValueError("Co-simulation endpoint uses protocol version {}, but only version "
+                             "{} is supported"
+                             .format(handshake["version"], _VERSION))
+        self._input_layout  = _Layout(handshake["inputs"])
+        self._output_layout = _Layout(handshake["outputs"])
+        self.inputs  = self._input_layout.ports
+        self.outputs = self._output_layout.ports
+
+        sock.sendall(_u32.pack(batch))
+        self.batch = _recv_u32(sock)
+
+    @classmethod
+    def connect(cls, path, **kwargs):
+        """Connect to an endpoint listening on a Unix socket at ``path``.
+
+        Other arguments are passed to :class:`CosimClient`.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            raise
+        return cls(sock, **kwargs)
+
+    def run(self, stimulus):
+        """Simulate a clock cycle for every element of ``stimulus``.
+
+        Every element of ``stimulus`` is a tuple with a value for every input, in the order of
+        :attr:`inputs`. The cycles are sent in batches of at most :attr:`batch` cycles.
+
+        Returns
+        -------
+        A list with a tuple of the values of every output, in the order of :attr:`outputs`,
+        for every cycle.
+        """
+        stimulus = list(stimulus)
+        responses = []
+        for start in range(0, len(stimulus), self.batch):
+            rows = stimulus[start:start + self.batch]
+            self.sock.sendall(_u32.pack(len(rows)) + self._input_layout.pack(rows))
+            data = _recv_exactly(self.sock, len(rows) * self._output_layout.size)
+            responses += self._output_layout.unpack(data, len(rows))
+        return responses
+
+    def close(self):
+        """Finish the co-simulation, and close the socket."""
+        try:
+            self.sock.sendall(_u32.pack(0))
+        finally:
+            self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,403 @@
+import os.path
+from collections import OrderedDict
+from contextlib import contextmanager
+from vcd.gtkw import GTKWSave
+
+from ..hdl import *
+from ..hdl.ast import SignalDict, SignalSet
+from .._toolchain.yosys import find_yosys
+from .._toolchain.cxx import build_cxx
+from ..back import cxxrtl
+from ._base import *
+from ._cxxrtl import cxxrtl_library, cxxrtl_get_parts, cxxrtl_vcd_read
+from ._pycoro import PyCoroProcess
+from ._pyclock import PyClockProcess
+from ._pystim import PyStimulusProcess
+from .pysim import _Timeline
+
+
+__all__ = ["CxxSimEngine"]
+
+
+class _CxxSignalState(BaseSignalState):
+    __slots__ = ("signal", "name", "parts", "waiters", "prev", "run_queue")
+
+    def __init__(self, signal, name, parts, run_queue):
+        self.signal    = signal
+        self.name      = name
+        self.parts     = parts
+        self.run_queue = run_queue
+        self.waiters   = dict()
+        self.prev      = self.curr
+
+    @property
+    def curr(self):
+        value = 0
+        for part in self.parts:
+            value |= part.curr << part.lsb_at
+        return Const.normalize(value, self.signal.shape())
+
+    @property
+    def next(self):
+        value = 0
+        for part in self.parts:
+            value |= part.next << part.lsb_at
+        return Const.normalize(value, self.signal.shape())
+
+    def set(self, value):
+        value &= (1 << len(self.signal)) - 1
+        for part in self.parts:
+            part.next = (value >> part.lsb_at) & ((1 << part.width) - 1)
+
+    def wake(self, value):
+        if value == self.prev:
+            return False
+        self.prev = value
+
+        awoken_any = False
+        for process, trigger in self.waiters.items():
+            if trigger is None or trigger == value:
+                awoken_any = True
+                if not process.runnable:
+                    process.runnable = True
+                    self.run_queue.append(process)
+        return awoken_any
+
+
+class _PySignalState(BaseSignalState):
+    # Signals that are not a part of the design are simulated in Python.
+    __slots__ = ("signal", "curr", "next", "waiters", "pending", "run_queue")
+
+    def __init__(self, signal, pending, run_queue):
+        self.signal = signal
+        self.pending = pending
+        self.run_queue = run_queue
+        self.waiters = dict()
+        self.reset()
+
+    def reset(self):
+        self.curr = self.next = self.signal.reset
+
+    def set(self, value):
+        if self.next == value:
+            return
+        self.next = value
+        self.pending.add(self)
+
+    def commit(self):
+        if self.curr == self.next:
+            return False
+        self.curr = self.next
+
+        awoken_any = False
+        for process, trigger in self.waiters.items():
+            if trigger is None or trigger == self.curr:
+                awoken_any = True
+                if not process.runnable:
+                    process.runnable = True
+                    self.run_queue.append(process)
+        return awoken_any
+
+
+class _SlotValues:
+    # Current or next values of the signal states in `slots`, indexed like the lists of values
+    # of the Python simulation engine, for use by code it generates.
+    __slots__ = ("slots", "attr")
+
+    def __init__(self, slots, attr):
+        self.slots = slots
+        self.attr  = attr
+
+    def __getitem__(self, index):
+        return getattr(self.slots[index], self.attr)
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class _CxxSimulation(BaseSimulation):
+    def __init__(self, fragment):
+        self.run_queue = []
+        self.timeline  = _Timeline(self.run_queue)
+        self.signals   = SignalDict()
+        self.slots     = []
+        self.curr      = _SlotValues(self.slots, "curr")
+        self.next      = _SlotValues(self.slots, "next")
+        self.pending   = set()
+        # Compiled testbench commands; see `PyCoroProcess`.
+        self.code_cache = OrderedDict()
+        self.futures   = dict()
+        self.watched   = set()
+
+        yosys = find_yosys(lambda ver: ver >= (0, 9, 3468))
+        # Public wires are kept even if they are only driven combinationally, so that every
+        # signal of the design has debug information and can be sampled by testbenches.
+        cxx_source, self.names = cxxrtl.convert_fragment(fragment, opt_level=3)
+        self.build_dir, so_filename = build_cxx(
+            cxx_sources={"sim.cc": cxx_source},
+            output_name="sim",
+            include_dirs=[str(yosys.data_dir() / "include")],
+            macros=["CXXRTL_INCLUDE_CAPI_IMPL", "CXXRTL_INCLUDE_VCD_CAPI_IMPL"],
+        )
+        self.library = cxxrtl_library(os.path.join(self.build_dir.name, so_filename))
+        self.handle  = None
+        self.inputs  = SignalSet(fragment.iter_ports(dir="i"))
+        self._create()
+
+    def _create(self):
+        if self.handle is not None:
+            self.library.cxxrtl_destroy(self.handle)
+        self.handle = self.library.cxxrtl_create(self.library.cxxrtl_design_create())
+
+        for signal_state in self.slots:
+            if isinstance(signal_state, _CxxSignalState):
+                signal_state.parts = \
+                    cxxrtl_get_parts(self.library, self.handle, signal_state.name)
+        # CXXRTL only applies reset values to the wires it drives; the top-level inputs are
+        # driven by the simulator, and so have to be reset explicitly.
+        for signal in self.inputs:
+            self.slots[self.get_signal(signal)].set(signal.reset)
+        self.library.cxxrtl_step(self.handle)
+
+    def reset(self):
+        self.timeline.reset()
+        self._create()
+        for signal, index in self.signals.items():
+            signal_state = self.slots[index]
+            if isinstance(signal_state, _CxxSignalState):
+                signal_state.prev = signal_state.curr
+            else:
+                signal_state.curr = signal_state.next = signal.reset
+        self.pending.clear()
+        self.futures.clear()
+        self.run_queue.clear()
+
+    def get_signal(self, signal):
+        try:
+            return self.signals[signal]
+        except KeyError:
+            index = len(self.slots)
+            if signal in self.names:
+                name = " ".join(self.names[signal][1:])
+                parts = cxxrtl_get_parts(self.library, self.handle, name)
+                if not parts:
+                    raise ValueError("Signal {!r} has no debug information in the CXXRTL "
+                                     "simulation"
+                                     .format(signal))
+                self.slots.append(_CxxSignalState(signal, name, parts, self.run_queue))
+            else:
+                # The signal is not a part of the design (e.g. it is only used by testbench
+                # processes), and so is simulated in Python.
+                self.slots.append(_PySignalState(signal, self.pending, self.run_queue))
+            self.signals[signal] = index
+            return index
+
+    def set(self, slot, value):
+        self.slots[slot].set(value)
+
+    def add_trigger(self, process, signal, *, trigger=None):
+        index = self.get_signal(signal)
+        signal_state = self.slots[index]
+        assert (process not in signal_state.waiters or
+                signal_state.waiters[process] == trigger)
+        if isinstance(signal_state, _CxxSignalState) and signal_state not in self.watched:
+            signal_state.prev = signal_state.curr
+            self.watched.add(signal_state)
+        signal_state.waiters[process] = trigger
+
+    def remove_trigger(self, process, signal):
+        index = self.get_signal(signal)
+        signal_state = self.slots[index]
+        assert process in signal_state.waiters
+        del signal_state.waiters[process]
+        if not signal_state.waiters:
+            self.watched.discard(signal_state)
+
+    def wait_interval(self, process, interval):
+        self.timeline.delay(interval, process)
+
+    def wait_future(self, process, future):
+        self.futures[process] = future
+        def wake(future):
+            # The simulation may have been reset while the future was pending.
+            if self.futures.get(process) is future:
+                del self.futures[process]
+                process.runnable = True
+                self.run_queue.append(process)
+        future.add_done_callback(wake)
+
+    def commit(self):
+        converged = True
+        for signal_state in self.pending:
+            if signal_state.commit():
+                converged = False
+        self.pending.clear()
+
+        # Processes waiting for a change of a signal driven by the simulator, e.g. for a clock
+        # edge, run before the design is stepped, so that they sample the values signals had
+        # before the change, like the processes of the Python simulation engine do.
+        for signal_state in self.watched:
+            if signal_state.wake(signal_state.next):
+                converged = False
+        if not converged:
+            return False
+
+        self.library.cxxrtl_step(self.handle)
+        for signal_state in self.watched:
+            if signal_state.wake(signal_state.curr):
+                converged = False
+        return converged
+
+
+class _CxxVCDWriter:
+    @staticmethod
+    def timestamp_to_vcd(timestamp):
+        return round(timestamp * (10 ** 10)) # 1/(100 ps)
+
+    def __init__(self, state, *, vcd_file, gtkw_file=None, traces=()):
+        if isinstance(vcd_file, str):
+            vcd_file = open(vcd_file, "wt")
+        if isinstance(gtkw_file, str):
+            gtkw_file = open(gtkw_file, "wt")
+
+        self.state   = state
+        self.library = state.library
+
+        self.vcd_file = vcd_file
+        self.vcd = self.library.cxxrtl_vcd_create()
+        self.library.cxxrtl_vcd_timescale(self.vcd, 100, b"ps")
+        self.library.cxxrtl_vcd_add_from_without_memories(self.vcd, state.handle)
+
+        self.gtkw_file = gtkw_file
+        self.gtkw_save = gtkw_file and GTKWSave(self.gtkw_file)
+
+        self.traces = list(traces)
+
+    def sample(self, timestamp):
+        self.library.cxxrtl_vcd_sample(self.vcd, self.timestamp_to_vcd(timestamp))
+        self.vcd_file.write(cxxrtl_vcd_read(self.library, self.vcd).decode("utf-8"))
+
+    def close(self, timestamp):
+        self.sample(timestamp)
+        self.library.cxxrtl_vcd_destroy(self.vcd)
+
+        if self.gtkw_save is not None:
+            self.gtkw_save.dumpfile(self.vcd_file.name)
+            self.gtkw_save.dumpfile_size(self.vcd_file.tell())
+
+            for signal in self.traces:
+                if signal not in self.state.names:
+                    continue
+                if len(signal) > 1 and not signal.decoder:
+                    suffix = "[{}:0]".format(len(signal) - 1)
+                else:
+                    suffix = ""
+                self.gtkw_save.trace(".".join(self.state.names[signal][1:]) + suffix)
+
+        self.vcd_file.close()
+        if self.gtkw_file is not None:
+            self.gtkw_file.close()
+
+
+class CxxSimEngine(BaseEngine):
+    """Simulation engine that compiles the design to C++ using CXXRTL.
+
+    The design is translated to C++ with Yosys, compiled to a shared object, and loaded with
+    :mod:`ctypes`. Testbench and clock processes are run in Python exactly like in the Python
+    simulation engine, and access the design through the CXXRTL C API.
+    """
+    def __init__(self, fragment):
+        self._state = _CxxSimulation(fragment)
+        self._timeline = self._state.timeline
+
+        self._fragment = fragment
+        self._processes = set()
+        self._active = 0
+        self._vcd_writers = []
+
+    def _add_process(self, process):
+        self._processes.add(process)
+        if process.runnable:
+            self._state.run_queue.append(process)
+        if not process.passive:
+            self._active += 1
+
+    def add_coroutine_process(self, process, *, default_cmd):
+        self._add_process(PyCoroProcess(self._state, self._fragment.domains, process,
+                                        default_cmd=default_cmd))
+
+    def add_clock_process(self, clock, *, phase, period):
+        self._add_process(PyClockProcess(self._state, clock,
+                                         phase=phase, period=period))
+
+    def add_stimulus_process(self, signal, values, *, domain, passive):
+        self._add_process(PyStimulusProcess(self._state, signal, values,
+                                            domain=domain, passive=passive))
+
+    def reset(self):
+        if self._vcd_writers:
+            raise ValueError("Cannot reset a CXXRTL simulation while writing waveforms")
+        self._state.reset()
+        self._active = 0
+        for process in self._processes:
+            process.reset()
+            if process.runnable:
+                self._state.run_queue.append(process)
+            if not process.passive:
+                self._active += 1
+
+    def _step(self):
+        # Performs the two phases of a delta cycle in a loop:
+        run_queue = self._state.run_queue
+        converged = False
+        while not converged:
+            # 1. eval: run and suspend every process that was woken up, queueing signal changes
+            processes = run_queue[:]
+            run_queue.clear()
+            for process in processes:
+                process.runnable = False
+                passive = process.passive
+                process.run()
+                if process.passive != passive:
+                    self._active += -1 if process.passive else 1
+
+            # 2. commit: let CXXRTL settle the design, waking up any waiting processes
+            converged = self._state.commit()
+
+        for vcd_writer in self._vcd_writers:
+            vcd_writer.sample(self._timeline.now)
+
+    def advance(self, *, deadline=None):
+        self._step()
+        if self._state.futures:
+            return True
+        self._timeline.advance()
+        return self._active > 0
+
+    @property
+    def now(self):
+        return self._timeline.now
+
+    @property
+    def pending_futures(self):
+        return list(self._state.futures.values())
+
+    @contextmanager
+    def write_vcd(self, *, vcd_file, gtkw_file, traces,
+                  include=None, depth=None, start=None, stop=None):
+        if self._timeline.now != 0.0:
+            for file in (vcd_file, gtkw_file):
+                if hasattr(file, "close"):
+                    file.close()
+            raise ValueError("Cannot start writing waveforms after advancing simulation time")
+        if (include, depth, start, stop) != (None, None, None, None):
+            raise ValueError("Filtering waveforms is not supported by the CXXRTL engine")
+
+        vcd_writer = _CxxVCDWriter(self._state,
+            vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces)
+        try:
+            self._vcd_writers.append(vcd_writer)
+            yield
+        finally:
+            vcd_writer.close(self._timeline.now)
+            self._vcd_writers.remove(vcd_writer)
@@ -0,0 +1,241 @@
+import operator
+import numpy as np
+
+from ..hdl import *
+from .core import Command
+from ._nprtl import (_lane_dtype, _sign, _NumPyRHSValueCompiler,
+                     _NumPyStatementCompiler, _NumPyFragmentCompiler)
+from ._pycoro import PyCoroProcess
+from .pysim import _VCDWriter, _PyMemoryState, _PySimulation, PySimEngine
+
+
+__all__ = ["Drive", "NumPySimEngine"]
+
+
+_to_int = np.frompyfunc(operator.index, 1, 1)
+
+
+class Drive(Command):
+    """Drive a different value in every lane.
+
+    Assigns ``values[n]`` to ``lhs`` in lane ``n``. This command is only supported by
+    :class:`NumPySimEngine`.
+
+    Arguments
+    ---------
+    lhs : Value
+        Assigned value. Must be valid on the left-hand side of an assignment.
+    values : array-like of int
+        Assigned values, one per lane.
+    """
+    def __init__(self, lhs, values):
+        self.lhs    = Value.cast(lhs)
+        self.values = values
+
+    def __repr__(self):
+        return "(drive {!r})".format(self.lhs)
+
+
+def _normalize(value, shape, lanes):
+    # Computes `Const.normalize(value, shape)` in every lane. NumPy infers `np.uint64` or floats
+    # for sequences of integers that do not fit in `np.int64`, so the values are converted to
+    # Python integers first.
+    value = np.asarray(_to_int(np.asarray(value, dtype=object)), dtype=object)
+    value = np.array(np.broadcast_to(value & ((1 << shape.width) - 1), (lanes,)),
+                     dtype=_lane_dtype(shape.width))
+    if shape.signed and shape.width > 0:
+        value = _sign(value, -1 << (shape.width - 1))
+    return value
+
+
+class _NumPyMemoryState(_PyMemoryState):
+    __slots__ = ("lane_index",)
+
+    def __init__(self, memory, lane_index, state):
+        self.memory = memory
+        self.lane_index = lane_index
+        self.state = state
+        self.waiters = dict()
+        self.words = dict()
+        self.writes = []
+        # Indexed by address, then by lane.
+        self.data = np.empty((memory.depth, len(lane_index)), dtype=_lane_dtype(memory.width))
+        self.reset()
+
+    def reset(self):
+        width_mask = (1 << self.memory.width) - 1
+        for addr in range(self.memory.depth):
+            self.data[addr] = width_mask & self.memory._init_at(addr)
+        self.writes.clear()
+
+    def commit(self, changed=None):
+        changed_any = False
+        awoken_any = False
+        for addr, value, mask in self.writes:
+            prev_value = self.data[addr, self.lane_index]
+            value = (prev_value & ~mask) | (value & mask)
+            if not (prev_value != value).any():
+                continue
+            self.data[addr, self.lane_index] = value
+            changed_any = True
+
+            for word_addr, slot in self.words.items():
+                if np.any(addr == word_addr):
+                    self.state.next[slot] = self.data[word_addr].copy()
+                    if self.state.commit_slots((slot,), changed):
+                        awoken_any = True
+        self.writes.clear()
+
+        if changed_any:
+            for process in self.waiters:
+                awoken_any = True
+                if not process.runnable:
+                    process.runnable = True
+                    self.state.run_queue.append(process)
+        return awoken_any
+
+
+class _NumPySimulation(_PySimulation):
+    def __init__(self, lanes):
+        super().__init__()
+        self.lane_index = np.arange(lanes)
+        # Lanes in which processes were woken up by an edge of a signal, until they run.
+        self.edges = dict()
+
+    def reset(self):
+        super().reset()
+        self.edges.clear()
+
+    def _reset_value(self, slot):
+        word = self.words.get(slot)
+        if word is not None:
+            memory_state, addr = word
+            return memory_state.data[addr].copy()
+        signal = self.slot_signals[slot]
+        return _normalize(signal.reset, signal.shape(), len(self.lane_index))
+
+    def _create_memory_state(self, memory):
+        return _NumPyMemoryState(memory, self.lane_index, self)
+
+    def set(self, slot, value):
+        self.next[slot] = value
+        word = self.words.get(slot)
+        if word is not None:
+            memory_state, addr = word
+            memory_state.write(addr, value, (1 << len(self.slot_signals[slot])) - 1)
+        else:
+            self.dirty.append(slot)
+
+    def commit_slots(self, slots, changed=None):
+        lanes = len(self.lane_index)
+        awoken_any = False
+        for slot in slots:
+            curr = self.curr[slot]
+            next = np.broadcast_to(np.asarray(self.next[slot], dtype=curr.dtype), (lanes,))
+            changed_lanes = curr != next
+            if not changed_lanes.any():
+                self.next[slot] = curr
+                continue
+            self.curr[slot] = self.next[slot] = next
+            if changed is not None:
+                changed.add(slot)
+
+            waiters = self.waiters.get(slot)
+            if waiters is None:
+                continue
+            for process, trigger in waiters.items():
+                if trigger is not None:
+                    # Remember the lanes in which the process was woken up by an edge.
+                    edge = changed_lanes & (next == trigger)
+                    if not edge.any():
+                        continue
+                    if process in self.edges:
+                        edge = edge | self.edges[process]
+                    self.edges[process] = edge
+                awoken_any = True
+                if not process.runnable:
+                    process.runnable = True
+                    self.run_queue.append(process)
+        return awoken_any
+
+
+class _NumPyCoroProcess(PyCoroProcess):
+    _rhs_compiler       = _NumPyRHSValueCompiler
+    _statement_compiler = _NumPyStatementCompiler
+
+    def reset(self):
+        super().reset()
+        self.exec_locals["lane_index"] = self.state.lane_index
+
+    def normalize_value(self, value, shape):
+        return _normalize(value, shape, len(self.state.lane_index))
+
+    def run_command(self, command):
+        if type(command) is Drive:
+            lanes = len(self.state.lane_index)
+            values = np.asarray(command.values)
+            if values.shape != (lanes,):
+                raise ValueError("Command {!r} from process {!r} drives {} values, but "
+                                 "the simulation has {} lanes"
+                                 .format(command, self.src_loc(), values.size, lanes))
+            self.exec_locals["value"] = _normalize(command.values, command.lhs.shape(), lanes)
+            exec(self._compile_cached(("assign_const", self._value_key(command.lhs)),
+                    lambda: self._statement_compiler.compile_assign(self.state, command.lhs,
+                                                                    rhs="value")),
+                 self.exec_locals)
+            return None
+        return super().run_command(command)
+
+    def run(self):
+        # Testbench processes do not distinguish between lanes.
+        self.state.edges.pop(self, None)
+        super().run()
+
+
+class _NumPyVCDWriter(_VCDWriter):
+    def __init__(self, fragment, *, lane, **kwargs):
+        super().__init__(fragment, **kwargs)
+        self.lane = lane
+
+    def sample(self, state, slot):
+        return int(state.curr[slot][self.lane])
+
+
+class NumPySimEngine(PySimEngine):
+    """Simulation engine running many instances of a design in lockstep.
+
+    Every signal holds a NumPy array with one element per instance (lane). All lanes share
+    the simulation time, clocks, and testbench processes; the code generated for the design
+    evaluates each statement in every lane at once. Signals up to 63 bits wide are stored in
+    arrays of ``np.int64``, and wider ones in arrays of Python integers.
+
+    Testbench processes receive an array with a value for every lane when they sample a value,
+    and may use :class:`Drive` to assign a different value in every lane; other commands affect
+    all lanes in the same way.
+
+    Parameters
+    ----------
+    lanes : int
+        Number of lanes.
+    vcd_lane : int
+        Lane whose waveforms are written by :meth:`Simulator.write_vcd`. Defaults to 0.
+    """
+    _fragment_compiler = _NumPyFragmentCompiler
+    _coroutine_process = _NumPyCoroProcess
+
+    def __init__(self, fragment, *, lanes, vcd_lane=0):
+        if not isinstance(lanes, int) or lanes <= 0:
+            raise TypeError("Lane count must be a positive integer, not {!r}"
+                            .format(lanes))
+        if vcd_lane not in range(lanes):
+            raise ValueError("VCD lane {!r} is out of range"
+                             .format(vcd_lane))
+        self._lanes    = lanes
+        self._vcd_lane = vcd_lane
+        super().__init__(fragment)
+
+    def _create_state(self):
+        return _NumPySimulation(self._lanes)
+
+    def _create_vcd_writer(self, **kwargs):
+        return _NumPyVCDWriter(self._fragment, lane=self._vcd_lane, **kwargs)
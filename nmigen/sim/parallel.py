@@ -0,0 +1,147 @@
+import os
+import pickle
+import traceback
+import multiprocessing
+
+from .core import Simulator
+
+
+__all__ = ["SimulationResult", "run_parallel"]
+
+
+class SimulationResult:
+    """Outcome of a testbench run by :func:`run_parallel`.
+
+    Attributes
+    ----------
+    name : str
+        Name of the testbench.
+    exception : Exception or None
+        Exception raised by the testbench, or ``None`` if it passed. If the exception could not
+        be transferred from the worker process, it is replaced with a :exc:`RuntimeError`
+        describing it.
+    traceback : str or None
+        Formatted traceback of ``exception``, or ``None`` if the testbench passed.
+    vcd_file : str or None
+        Path of the waveform file written for the testbench, if any.
+    coverage : Coverage or None
+        Coverage collected while running the testbench, if the simulator was created with
+        ``coverage=True``.
+    """
+    def __init__(self, name, *, exception=None, traceback=None, vcd_file=None, coverage=None):
+        self.name      = name
+        self.exception = exception
+        self.traceback = traceback
+        self.vcd_file  = vcd_file
+        self.coverage  = coverage
+
+    @property
+    def passed(self):
+        return self.exception is None
+
+    def __repr__(self):
+        if self.passed:
+            return "<SimulationResult {} passed>".format(self.name)
+        return "<SimulationResult {} failed: {!r}>".format(self.name, self.exception)
+
+
+def _run_testbench(simulator, name, testbench, vcd_dir, coverage):
+    vcd_file = None
+    try:
+        testbench(simulator)
+        if vcd_dir is None:
+            simulator.run()
+        else:
+            vcd_file = os.path.join(vcd_dir, "{}.vcd".format(name))
+            with simulator.write_vcd(vcd_file):
+                simulator.run()
+    except Exception as exn:
+        try:
+            pickle.dumps(exn)
+        except Exception:
+            exn = RuntimeError("Testbench raised an exception that cannot be pickled: {!r}"
+                               .format(exn))
+        return SimulationResult(name, exception=exn, traceback=traceback.format_exc(),
+                               vcd_file=vcd_file,
+                               coverage=simulator.coverage() if coverage else None)
+    return SimulationResult(name, vcd_file=vcd_file,
+                            coverage=simulator.coverage() if coverage else None)
+
+
+# The simulator and the testbenches are inherited by worker processes when they are forked,
+# so neither the design nor the testbenches have to be picklable.
+_worker_state = None
+
+
+def _run_worker(index):
+    simulator, testbenches, vcd_dir, coverage = _worker_state
+    name, testbench = testbenches[index]
+    return _run_testbench(simulator, name, testbench, vcd_dir, coverage)
+
+
+def run_parallel(design, testbenches, *, workers=None, vcd_dir=None, **simulator_options):
+    """Run many testbenches against the same design in parallel.
+
+    The design is prepared and compiled once, and every testbench is run in a separate worker
+    process that inherits the compiled design, so that testbenches cannot affect each other.
+    If worker processes cannot be forked on this platform, or if ``workers`` is 1, the
+    testbenches are run one after another in the current process instead, and the design is
+    prepared and compiled again for each of them.
+
+    A testbench is a function that receives a :class:`Simulator` for the design, and adds
+    processes and clocks to it. The simulation is then run until there are no active processes,
+    as with :meth:`Simulator.run`; the testbench fails if this raises an exception, e.g. because
+    an assertion in one of its processes failed.
+
+    Arguments
+    ---------
+    design : Elaboratable or Fragment
+        Simulated design.
+    testbenches : dict of str to function, or iterable of function
+        Testbenches to run. If not a dict, testbenches are named after their functions.
+    workers : int or None
+        Number of worker processes. Defaults to the number of processors.
+    vcd_dir : str or None
+        If specified, a waveform file named after each testbench is written to this directory.
+    simulator_options
+        Passed to :class:`Simulator`, e.g. ``engine``. If ``coverage=True`` is passed,
+        the coverage of every testbench is returned with its result.
+
+    Returns
+    -------
+    A list of :class:`SimulationResult`, in the same order as ``testbenches``.
+    """
+    global _worker_state
+
+    if isinstance(testbenches, dict):
+        testbenches = list(testbenches.items())
+    else:
+        testbenches = [(testbench.__name__, testbench) for testbench in testbenches]
+    names = [name for name, testbench in testbenches]
+    if len(set(names)) != len(names):
+        raise ValueError("Testbench names must be unique")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if not isinstance(workers, int) or workers <= 0:
+        raise TypeError("Worker count must be a positive integer, not {!r}"
+                        .format(workers))
+    if vcd_dir is not None:
+        os.makedirs(vcd_dir, exist_ok=True)
+
+    coverage = simulator_options.get("coverage", False)
+    if workers == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [_run_testbench(Simulator(design, **simulator_options), name, testbench, vcd_dir,
+                               coverage)
+                for name, testbench in testbenches]
+
+    simulator = Simulator(design, **simulator_options)
+    _worker_state = simulator, testbenches, vcd_dir, coverage
+    try:
+        context = multiprocessing.get_context("fork")
+        # Every worker process runs a single testbench, and is forked again from this process
+        # for the next one, so that it starts from a simulator without any testbench processes.
+        with context.Pool(min(workers, len(testbenches)) or 1, maxtasksperchild=1) as pool:
+            return pool.map(_run_worker, range(len(testbenches)), chunksize=1)
+    finally:
+        _worker_state = None
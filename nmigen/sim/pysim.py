@@ -1,22 +1,37 @@
+from collections import OrderedDict
 from contextlib import contextmanager
+import copy
+import fnmatch
 import itertools
+import heapq
+import inspect
+import queue
+import threading
+import time
 from vcd import VCDWriter
 from vcd.gtkw import GTKWSave
 
 from ..hdl import *
 from ..hdl.ast import SignalDict
 from ._base import *
-from ._pyrtl import _FragmentCompiler
+from ._pyrtl import PyRTLProcess, _FragmentCompiler, _levelize
 from ._pycoro import PyCoroProcess
 from ._pyclock import PyClockProcess
+from ._pystim import PyStimulusProcess
+from ._fst import FSTWriter
+from ._profile import ProcessProfile, SimulationProfile
+from ._coverage import Coverage
 
 
 __all__ = ["PySimEngine"]
 
 
 class _NameExtractor:
-    def __init__(self):
+    # Words of memories are only named if `memories` is true, since naming them creates a signal
+    # for every word, which the simulator then keeps in sync with the contents of the memory.
+    def __init__(self, *, memories=False):
         self.names = SignalDict()
+        self.memories = memories
 
     def __call__(self, fragment, *, hierarchy=("top",)):
         def add_signal_name(signal):
@@ -38,6 +53,16 @@ class _NameExtractor:
                 if not isinstance(signal, (ClockSignal, ResetSignal)):
                     add_signal_name(signal)
 
+        if isinstance(fragment, Instance) and fragment.type in ("$memrd", "$memwr"):
+            for port_value, port_dir in fragment.named_ports.values():
+                for signal in port_value._rhs_signals():
+                    if not isinstance(signal, (ClockSignal, ResetSignal)):
+                        add_signal_name(signal)
+            memory = fragment.parameters["MEMID"]
+            if self.memories and memory._simulate:
+                for addr in range(memory.depth):
+                    add_signal_name(memory[addr])
+
         for subfragment_index, (subfragment, subfragment_name) in enumerate(fragment.subfragments):
             if subfragment_name is None:
                 subfragment_name = "U${}".format(subfragment_index)
@@ -47,6 +72,12 @@ class _NameExtractor:
 
 
 class _VCDWriter:
+    # Value changes are recorded by the simulation engine into preallocated buffers of this many
+    # records, which are formatted and written to the file by a background thread. Once every
+    # buffer is waiting to be written, the simulation waits for the thread to catch up.
+    buffer_size  = 1 << 12
+    buffer_count = 4
+
     @staticmethod
     def timestamp_to_vcd(timestamp):
         return timestamp * (10 ** 10) # 1/(100 ps)
@@ -55,43 +86,91 @@ class _VCDWriter:
     def decode_to_vcd(signal, value):
         return signal.decoder(value).expandtabs().replace(" ", "_")
 
-    def __init__(self, fragment, *, vcd_file, gtkw_file=None, traces=()):
+    def __init__(self, fragment, *, vcd_file, gtkw_file=None, traces=(), format="vcd",
+                 include=None, depth=None, start=None, stop=None):
+        assert format in ("vcd", "fst")
         if isinstance(vcd_file, str):
-            vcd_file = open(vcd_file, "wt")
+            vcd_file = open(vcd_file, "wt" if format == "vcd" else "wb")
         if isinstance(gtkw_file, str):
             gtkw_file = open(gtkw_file, "wt")
 
         self.vcd_vars = SignalDict()
         self.vcd_file = vcd_file
-        self.vcd_writer = vcd_file and VCDWriter(self.vcd_file,
-            timescale="100 ps", comment="Generated by nMigen")
+        self.vcd_format = format
+        self.vcd_writer = None
 
         self.gtkw_names = SignalDict()
         self.gtkw_file = gtkw_file
         self.gtkw_save = gtkw_file and GTKWSave(self.gtkw_file)
 
+        self.start = start
+        self.stop  = stop
+        # Simulation state, and slots of the registered signals; only their changes are passed
+        # to `record`. Assigned by `begin`.
+        self.state     = None
+        self.slots     = None
+        self.slot_vars = None
+
         self.traces = []
 
-        signal_names = _NameExtractor()(fragment)
+        signal_names = _NameExtractor(memories=True)(fragment)
+
+        # Signals are filtered before they are registered, so that the signals which are not
+        # written to the file are not tracked by the simulation engine at all.
+        self.signal_names = SignalDict()
+        for signal, names in signal_names.items():
+            names = {name for name in names if self._match_name(name, include, depth)}
+            if names:
+                self.signal_names[signal] = names
 
-        trace_names = SignalDict()
         for trace in traces:
-            if trace not in signal_names:
-                trace_names[trace] = {("top", trace.name)}
+            if trace not in self.signal_names:
+                self.signal_names[trace] = signal_names.get(trace, {("top", trace.name)})
             self.traces.append(trace)
 
-        if self.vcd_writer is None:
+    @staticmethod
+    def _match_name(name, include, depth):
+        if depth is not None and len(name) - 2 > depth:
+            return False
+        if include is not None:
+            if isinstance(include, str):
+                include = (include,)
+            return any(fnmatch.fnmatchcase(".".join(name), pattern) for pattern in include)
+        return True
+
+    def sample(self, state, slot):
+        return state.curr[slot]
+
+    def begin(self, timestamp, state, values=None):
+        """Register the traced signals, with their current values (or ``values``, by slot) as
+        the initial values."""
+        self.state     = state
+        self.slots     = set()
+        self.slot_vars = dict()
+        if self.vcd_file is None:
             return
 
-        for signal, names in itertools.chain(signal_names.items(), trace_names.items()):
+        if self.vcd_format == "vcd":
+            self.vcd_writer = VCDWriter(self.vcd_file,
+                timescale="100 ps", comment="Generated by nMigen",
+                init_timestamp=self.timestamp_to_vcd(timestamp))
+        else:
+            self.vcd_writer = FSTWriter(self.vcd_file,
+                timescale=-10, init_timestamp=self.timestamp_to_vcd(timestamp))
+
+        for signal, names in self.signal_names.items():
+            if values is None:
+                value = self.sample(state, state.get_signal(signal))
+            else:
+                value = values[state.get_signal(signal)]
             if signal.decoder:
                 var_type = "string"
                 var_size = 1
-                var_init = self.decode_to_vcd(signal, signal.reset)
+                var_init = self.decode_to_vcd(signal, value)
             else:
                 var_type = "wire"
                 var_size = signal.width
-                var_init = signal.reset
+                var_init = value
 
             for (*var_scope, var_name) in names:
                 suffix = None
@@ -117,11 +196,53 @@ class _VCDWriter:
                 if signal not in self.gtkw_names:
                     self.gtkw_names[signal] = (*var_scope, var_name_suffix)
 
-    def update(self, timestamp, signal, value):
-        vcd_var = self.vcd_vars.get(signal)
-        if vcd_var is None:
+            slot = state.get_signal(signal)
+            self.slots.add(slot)
+            self.slot_vars[slot] = (self.vcd_vars[signal], signal)
+
+        self.buffer = [None] * self.buffer_size
+        self.buffer_len = 0
+        self.free_buffers = queue.Queue()
+        for _ in range(self.buffer_count - 1):
+            self.free_buffers.put([None] * self.buffer_size)
+        self.full_buffers = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._write_buffers, daemon=True)
+        self.thread.start()
+
+    def record(self, timestamp, slots):
+        """Record the current values of ``slots``, which changed at ``timestamp``."""
+        if not slots:
             return
-
+        buffer = self.buffer
+        buffer_len = self.buffer_len
+        state = self.state
+        for slot in slots:
+            buffer[buffer_len] = (timestamp, slot, self.sample(state, slot))
+            buffer_len += 1
+            if buffer_len == self.buffer_size:
+                self.full_buffers.put((buffer, buffer_len))
+                buffer = self.buffer = self.free_buffers.get()
+                buffer_len = 0
+        self.buffer_len = buffer_len
+
+    def _write_buffers(self):
+        while True:
+            buffer, buffer_len = self.full_buffers.get()
+            if buffer is None:
+                break
+            try:
+                if self.error is None:
+                    for index in range(buffer_len):
+                        self.update(*buffer[index])
+            except Exception as error:
+                # Keep draining the buffers, so that the simulation does not wait forever;
+                # the error is raised when the waveforms are closed.
+                self.error = error
+            self.free_buffers.put(buffer)
+
+    def update(self, timestamp, slot, value):
+        vcd_var, signal = self.slot_vars[slot]
         vcd_timestamp = self.timestamp_to_vcd(timestamp)
         if signal.decoder:
             var_value = self.decode_to_vcd(signal, value)
@@ -131,6 +252,15 @@ class _VCDWriter:
 
     def close(self, timestamp):
         if self.vcd_writer is not None:
+            self.full_buffers.put((self.buffer, self.buffer_len))
+            self.full_buffers.put((None, 0))
+            self.thread.join()
+            if self.error is not None:
+                if self.vcd_file is not None:
+                    self.vcd_file.close()
+                if self.gtkw_file is not None:
+                    self.gtkw_file.close()
+                raise self.error
             self.vcd_writer.close(self.timestamp_to_vcd(timestamp))
 
         if self.gtkw_save is not None:
@@ -151,18 +281,133 @@ class _VCDWriter:
             self.gtkw_file.close()
 
 
+class _FlightRecorder:
+    def __init__(self, state, create_vcd_writer, clock_processes, *, vcd_file, gtkw_file,
+                 size, duration, clock, cycles, **filters):
+        self.state = state
+        self.create_vcd_writer = create_vcd_writer
+        self.clock_processes = clock_processes
+        self.vcd_file  = vcd_file
+        self.gtkw_file = gtkw_file
+        self.size      = size
+        self.duration  = duration
+        self.clock     = clock
+        self.cycles    = cycles
+        self.filters   = filters
+
+        # The signals are filtered and their values are sampled the same way as when they are
+        # written to a file.
+        vcd_writer = self.create_vcd_writer(vcd_file=None, **self.filters)
+        self.signal_names = vcd_writer.signal_names
+        self.sample = vcd_writer.sample
+
+    def begin(self, timestamp):
+        """Start recording the traced signals, discarding everything recorded before."""
+        self.begin_time = timestamp
+        self.slots = set()
+        # Last recorded value of every traced slot.
+        self.values = dict()
+        for signal in self.signal_names:
+            slot = self.state.get_signal(signal)
+            self.slots.add(slot)
+            self.values[slot] = self.sample(self.state, slot)
+        # Ring buffer of `(timestamp, slot, old_value, new_value)` records; `index` points to
+        # the next record to overwrite.
+        self.ring = [None] * self.size
+        self.index = 0
+        self.wrapped = False
+
+    def record(self, timestamp, slots):
+        """Record the current values of ``slots``, which changed at ``timestamp``."""
+        if not slots:
+            return
+        ring = self.ring
+        index = self.index
+        values = self.values
+        state = self.state
+        for slot in slots:
+            value = self.sample(state, slot)
+            ring[index] = (timestamp, slot, values[slot], value)
+            values[slot] = value
+            index += 1
+            if index == self.size:
+                index = 0
+                self.wrapped = True
+        self.index = index
+
+    def _window(self):
+        if self.cycles is None:
+            return self.duration
+        slot = self.state.get_signal(self.clock)
+        for process in self.clock_processes:
+            if process.slot == slot:
+                return self.cycles * process.period
+        # Without a clock process, the length of a cycle is unknown; write everything.
+        return None
+
+    def dump(self, vcd_file, gtkw_file=None):
+        """Write the recorded waveforms to a Value Change Dump file.
+
+        Arguments
+        ---------
+        vcd_file : str or file-like object
+            Verilog Value Change Dump file or filename.
+        gtkw_file : str or file-like object
+            GTKWave save file or filename.
+        """
+        now = self.state.timeline.now
+        start = self.begin_time
+        if self.wrapped:
+            # Some of the changes at the time of the oldest record may have been overwritten,
+            # but every change after it is still recorded.
+            start = max(start, self.ring[self.index][0])
+        window = self._window()
+        if window is not None:
+            start = max(start, now - window)
+
+        # Undo the changes that happened after the start of the waveforms, newest first, to find
+        # the values the signals had at the start.
+        values = dict(self.values)
+        records = []
+        count = self.size if self.wrapped else self.index
+        for offset in range(1, count + 1):
+            timestamp, slot, old_value, new_value = record = self.ring[self.index - offset]
+            if timestamp <= start:
+                break
+            values[slot] = old_value
+            records.append(record)
+
+        vcd_writer = self.create_vcd_writer(vcd_file=vcd_file, gtkw_file=gtkw_file,
+                                            **self.filters)
+        vcd_writer.begin(start, self.state, values=values)
+        if vcd_writer.vcd_writer is not None:
+            for timestamp, slot, old_value, new_value in reversed(records):
+                vcd_writer.update(timestamp, slot, new_value)
+        vcd_writer.close(now)
+
+
 class _Timeline:
-    def __init__(self):
+    def __init__(self, run_queue):
         self.now = 0.0
         self.deadlines = dict()
+        # Processes whose deadline is reached are appended to the run queue of the simulation.
+        self.run_queue = run_queue
+        # Heap of `(deadline, sequence, process)` entries; the sequence number breaks ties between
+        # processes with the same deadline, since processes themselves are not comparable.
+        self.queue = []
+        self.sequence = itertools.count()
 
     def reset(self):
         self.now = 0.0
         self.deadlines.clear()
+        self.queue.clear()
 
     def at(self, run_at, process):
         assert process not in self.deadlines
+        if run_at is None:
+            run_at = self.now
         self.deadlines[process] = run_at
+        heapq.heappush(self.queue, (run_at, next(self.sequence), process))
 
     def delay(self, delay_by, process):
         if delay_by is None:
@@ -172,165 +417,721 @@ class _Timeline:
         self.at(run_at, process)
 
     def advance(self):
-        nearest_processes = set()
-        nearest_deadline = None
-        for process, deadline in self.deadlines.items():
-            if deadline is None:
-                if nearest_deadline is not None:
-                    nearest_processes.clear()
-                nearest_processes.add(process)
-                nearest_deadline = self.now
-                break
-            elif nearest_deadline is None or deadline <= nearest_deadline:
-                assert deadline >= self.now
-                if nearest_deadline is not None and deadline < nearest_deadline:
-                    nearest_processes.clear()
-                nearest_processes.add(process)
-                nearest_deadline = deadline
-
-        if not nearest_processes:
+        if not self.queue:
             return False
 
-        for process in nearest_processes:
-            process.runnable = True
+        nearest_deadline, _, _ = self.queue[0]
+        assert nearest_deadline >= self.now
+        while self.queue and self.queue[0][0] == nearest_deadline:
+            _, _, process = heapq.heappop(self.queue)
+            if not process.runnable:
+                process.runnable = True
+                self.run_queue.append(process)
             del self.deadlines[process]
         self.now = nearest_deadline
 
         return True
 
-
-class _PySignalState(BaseSignalState):
-    __slots__ = ("signal", "curr", "next", "waiters", "pending")
-
-    def __init__(self, signal, pending):
-        self.signal = signal
-        self.pending = pending
+    def fast_forward(self, step, count, processes):
+        # Advances the time by `count` intervals of `step` without running anything, delaying
+        # the deadlines of `processes` by as much. The intervals are added one by one, so that
+        # the deadlines are rounded exactly as if `processes` were scheduled again after every
+        # interval; for the same reason, they are also sequenced after every other process.
+        def delay(run_at):
+            for _ in range(count):
+                run_at += step
+            return run_at
+
+        self.now = delay(self.now)
+        delayed = sorted((sequence, process) for _, sequence, process in self.queue
+                         if process in processes)
+        self.queue[:] = [entry for entry in self.queue if entry[2] not in processes]
+        for _, process in delayed:
+            self.deadlines[process] = delay(self.deadlines[process])
+            self.queue.append((self.deadlines[process], next(self.sequence), process))
+        heapq.heapify(self.queue)
+
+
+class _PyCoverage:
+    def __init__(self):
+        # Number of times every branch was taken, and the key of every branch in the coverage
+        # report; several branches may share a key.
+        self.branches = []
+        self.branch_keys = []
+        # Masks of the bits of every slot that rose and fell, by slot index.
+        self.rose = []
+        self.fell = []
+
+    def add_branch(self, key):
+        self.branches.append(0)
+        self.branch_keys.append(key)
+        return len(self.branches) - 1
+
+    def add_slot(self, slot):
+        while len(self.rose) <= slot:
+            self.rose.append(0)
+            self.fell.append(0)
+
+
+class _PyMemoryState:
+    __slots__ = ("memory", "state", "data", "writes", "words", "waiters")
+
+    def __init__(self, memory, state):
+        self.memory = memory
+        self.state = state
         self.waiters = dict()
-        self.curr = self.next = signal.reset
+        # Slots are only assigned to words that are requested, e.g. by a testbench or for
+        # tracing, and are kept in sync with the contents of the memory.
+        self.words = dict()
+        self.writes = []
+        self.data = []
+        self.reset()
 
-    def set(self, value):
-        if self.next == value:
-            return
-        self.next = value
-        self.pending.add(self)
+    def reset(self):
+        width_mask = (1 << self.memory.width) - 1
+        self.data[:] = [width_mask & self.memory._init_at(addr)
+                        for addr in range(self.memory.depth)]
+        self.writes.clear()
 
-    def commit(self):
-        if self.curr == self.next:
-            return False
-        self.curr = self.next
+    def write(self, addr, value, mask):
+        if not self.writes:
+            self.state.dirty_memories.append(self)
+        self.writes.append((addr, value, mask))
 
+    def commit(self, changed=None):
+        changed_any = False
         awoken_any = False
-        for process, trigger in self.waiters.items():
-            if trigger is None or trigger == self.curr:
-                process.runnable = awoken_any = True
+        for addr, value, mask in self.writes:
+            value = (self.data[addr] & ~mask) | (value & mask)
+            if self.data[addr] == value:
+                continue
+            self.data[addr] = value
+            changed_any = True
+
+            slot = self.words.get(addr)
+            if slot is not None:
+                self.state.next[slot] = value
+                if self.state.commit_slots((slot,), changed):
+                    awoken_any = True
+        self.writes.clear()
+
+        if changed_any:
+            for process in self.waiters:
+                awoken_any = True
+                if not process.runnable:
+                    process.runnable = True
+                    self.state.run_queue.append(process)
         return awoken_any
 
 
+class _PySnapshot:
+    # Signal values are stored by slot, and memory contents by memory index; the layout records
+    # the signals and memories these belong to, and must match when the snapshot is restored.
+    def __init__(self, *, layout, now, signals, memories, clocks):
+        self.layout   = layout
+        self.now      = now
+        self.signals  = signals
+        self.memories = memories
+        self.clocks   = clocks
+
+
 class _PySimulation(BaseSimulation):
     def __init__(self):
-        self.timeline = _Timeline()
-        self.signals  = SignalDict()
-        self.slots    = []
-        self.pending  = set()
+        self.run_queue = []
+        self.timeline  = _Timeline(self.run_queue)
+        self.signals   = SignalDict()
+        # The state of every signal is kept in flat lists indexed by its slot, which the code
+        # generated for the design indexes directly. Only few signals have processes waiting on
+        # them, so waiters are kept in a dictionary by slot.
+        self.slot_signals = []
+        self.curr      = []
+        self.next      = []
+        self.waiters   = dict()
+        # Slots whose next value may differ from their current value, possibly more than once,
+        # and memories with pending writes.
+        self.dirty     = []
+        self.dirty_memories = []
+        # Memory state and address of every slot assigned to a word of a memory.
+        self.words     = dict()
+        self.memories  = []
+        self.memory_indexes = dict()
+        # Compiled testbench commands; see `PyCoroProcess`.
+        self.code_cache = OrderedDict()
+        # Asyncio futures awaited by processes, which run again once they are done.
+        self.futures   = dict()
+        # Assigned by simulations that collect coverage, before any signal is added.
+        self.coverage  = None
 
     def reset(self):
         self.timeline.reset()
-        for signal, index in self.signals.items():
-            self.slots[index].curr = self.slots[index].next = signal.reset
-        self.pending.clear()
+        for memory_state in self.memories:
+            memory_state.reset()
+        for slot in range(len(self.slot_signals)):
+            self.curr[slot] = self.next[slot] = self._reset_value(slot)
+        self.dirty.clear()
+        self.dirty_memories.clear()
+        self.futures.clear()
+        self.run_queue.clear()
 
     def get_signal(self, signal):
         try:
             return self.signals[signal]
         except KeyError:
-            index = len(self.slots)
-            self.slots.append(_PySignalState(signal, self.pending))
+            index = len(self.slot_signals)
+            self.slot_signals.append(signal)
+            for memory_state in self.memories:
+                addr = memory_state.memory._addrs.get(signal)
+                if addr is not None:
+                    self.words[index] = (memory_state, addr)
+                    memory_state.words[addr] = index
+                    break
+            if self.coverage is not None:
+                self.coverage.add_slot(index)
+            reset_value = self._reset_value(index)
+            self.curr.append(reset_value)
+            self.next.append(reset_value)
             self.signals[signal] = index
             return index
 
+    def get_memory(self, memory):
+        try:
+            return self.memory_indexes[memory]
+        except KeyError:
+            index = len(self.memories)
+            self.memories.append(self._create_memory_state(memory))
+            self.memory_indexes[memory] = index
+            return index
+
+    # Overridden by simulations that represent signal values and memory contents differently.
+
+    def _reset_value(self, slot):
+        word = self.words.get(slot)
+        if word is not None:
+            memory_state, addr = word
+            return memory_state.data[addr]
+        return self.slot_signals[slot].reset
+
+    def _create_memory_state(self, memory):
+        return _PyMemoryState(memory, self)
+
+    def set(self, slot, value):
+        # A slot that changes several times before it is committed is listed several times;
+        # committing it again does nothing.
+        next = self.next
+        if next[slot] != value:
+            next[slot] = value
+            self.dirty.append(slot)
+
+    def commit_slots(self, slots, changed=None):
+        curr = self.curr
+        next = self.next
+        waiters = self.waiters
+        coverage = self.coverage
+        awoken_any = False
+        for slot in slots:
+            prev_value = curr[slot]
+            value = next[slot]
+            if prev_value == value:
+                continue
+            if coverage is not None:
+                # The bits that rose and fell are accumulated as masks; the negative values of
+                # signed signals set every bit above the width of the signal, which are masked
+                # later.
+                toggled = prev_value ^ value
+                coverage.rose[slot] |= toggled & value
+                coverage.fell[slot] |= toggled & prev_value
+            curr[slot] = value
+            if changed is not None:
+                changed.add(slot)
+
+            slot_waiters = waiters.get(slot)
+            if slot_waiters is None:
+                continue
+            for process, trigger in slot_waiters.items():
+                if trigger is None or trigger == value:
+                    awoken_any = True
+                    if not process.runnable:
+                        process.runnable = True
+                        self.run_queue.append(process)
+        return awoken_any
+
+    def add_memory_trigger(self, process, memory):
+        self.memories[self.get_memory(memory)].waiters[process] = None
+
     def add_trigger(self, process, signal, *, trigger=None):
         index = self.get_signal(signal)
-        assert (process not in self.slots[index].waiters or
-                self.slots[index].waiters[process] == trigger)
-        self.slots[index].waiters[process] = trigger
+        waiters = self.waiters.setdefault(index, dict())
+        assert process not in waiters or waiters[process] == trigger
+        waiters[process] = trigger
 
     def remove_trigger(self, process, signal):
         index = self.get_signal(signal)
-        assert process in self.slots[index].waiters
-        del self.slots[index].waiters[process]
+        waiters = self.waiters[index]
+        assert process in waiters
+        del waiters[process]
+        if not waiters:
+            del self.waiters[index]
 
     def wait_interval(self, process, interval):
         self.timeline.delay(interval, process)
 
+    def wait_future(self, process, future):
+        self.futures[process] = future
+        def wake(future):
+            # The simulation may have been reset while the future was pending.
+            if self.futures.get(process) is future:
+                del self.futures[process]
+                process.runnable = True
+                self.run_queue.append(process)
+        future.add_done_callback(wake)
+
     def commit(self, changed=None):
         converged = True
-        for signal_state in self.pending:
-            if signal_state.commit():
+        if self.words:
+            # Words of memories are committed together with the memory they belong to.
+            curr = self.curr
+            next = self.next
+            for slot in self.dirty:
+                word = self.words.get(slot)
+                if word is not None and next[slot] != curr[slot]:
+                    memory_state, addr = word
+                    memory_state.write(addr, next[slot], (1 << len(self.slot_signals[slot])) - 1)
+                    next[slot] = curr[slot]
+        if self.dirty_memories:
+            for memory_state in self.dirty_memories:
+                if memory_state.commit(changed):
+                    converged = False
+            self.dirty_memories.clear()
+        if self.dirty:
+            if self.commit_slots(self.dirty, changed):
                 converged = False
-        if changed is not None:
-            changed.update(self.pending)
-        self.pending.clear()
+            self.dirty.clear()
         return converged
 
 
 class PySimEngine(BaseEngine):
-    def __init__(self, fragment):
-        self._state = _PySimulation()
+    # Overridden by engines that represent signal values differently.
+    _fragment_compiler = _FragmentCompiler
+    _coroutine_process = PyCoroProcess
+
+    def __init__(self, fragment, *, coverage=False):
+        self._state = self._create_state()
         self._timeline = self._state.timeline
+        if coverage:
+            self._state.coverage = _PyCoverage()
 
         self._fragment = fragment
-        self._processes = _FragmentCompiler(self._state)(self._fragment)
+        self._processes = set()
+        # Number of processes that are not passive; the simulation continues while it is non-zero.
+        self._active = 0
+        # Profile being collected, and the original `run` function of every profiled process.
+        self._profile = None
+        self._profiled = {}
+        processes = self._fragment_compiler(self._state)(self._fragment)
+        self._comb_processes = set(_levelize(processes))
+        # Processes that may run while the design is idle, and the signals they may change;
+        # see `_fast_forward`.
+        self._clock_processes = []
+        self._idle_processes  = set(processes)
+        self._clock_slots     = set()
+        self._idle = False
+        self._idle_since = None
+        for process in processes:
+            self._add_process(process)
+        # Signals and memories of the design are assigned slots in the same order every time
+        # the design is compiled; slots assigned later (e.g. to signals only used by testbenches)
+        # are not part of snapshots.
+        self._design_slots = len(self._state.slot_signals)
         self._vcd_writers = []
+        # Waveform writers whose time window has not started yet.
+        self._vcd_pending = []
+        self._recorders = []
+
+    def _create_state(self):
+        return _PySimulation()
+
+    def _create_vcd_writer(self, **kwargs):
+        return _VCDWriter(self._fragment, **kwargs)
+
+    def _add_process(self, process):
+        self._processes.add(process)
+        if self._profile is not None:
+            self._profile_process(process)
+        if process.runnable:
+            self._state.run_queue.append(process)
+        if not process.passive:
+            self._active += 1
 
     def add_coroutine_process(self, process, *, default_cmd):
-        self._processes.add(PyCoroProcess(self._state, self._fragment.domains, process,
-                                          default_cmd=default_cmd))
+        self._add_process(self._coroutine_process(self._state, self._fragment.domains, process,
+                                                  default_cmd=default_cmd))
 
     def add_clock_process(self, clock, *, phase, period):
-        self._processes.add(PyClockProcess(self._state, clock,
-                                           phase=phase, period=period))
+        process = PyClockProcess(self._state, clock, phase=phase, period=period)
+        self._clock_processes.append(process)
+        self._idle_processes.add(process)
+        self._clock_slots.add(process.slot)
+        self._add_process(process)
+
+    def add_stimulus_process(self, signal, values, *, domain, passive):
+        self._add_process(PyStimulusProcess(self._state, signal, values,
+                                            domain=domain, passive=passive))
+
+    def add_recorder(self, *, vcd_file, gtkw_file, size, duration, clock, cycles,
+                     traces, include, depth):
+        recorder = _FlightRecorder(self._state, self._create_vcd_writer, self._clock_processes,
+            vcd_file=vcd_file, gtkw_file=gtkw_file, size=size, duration=duration,
+            clock=clock, cycles=cycles, traces=traces, include=include, depth=depth)
+        recorder.begin(self._timeline.now)
+        self._recorders.append(recorder)
+        return recorder
 
     def reset(self):
         self._state.reset()
+        self._idle_since = None
+        self._active = 0
         for process in self._processes:
             process.reset()
+            if process.runnable:
+                self._state.run_queue.append(process)
+            if not process.passive:
+                self._active += 1
+        for recorder in self._recorders:
+            recorder.begin(self._timeline.now)
+
+    def _layout(self):
+        return (tuple((signal.name, len(signal), signal.signed)
+                      for signal in self._state.slot_signals[:self._design_slots]),
+                tuple((memory_state.memory.name, memory_state.memory.width,
+                       memory_state.memory.depth)
+                      for memory_state in self._state.memories))
+
+    def snapshot(self):
+        clocks = {}
+        for process in self._processes:
+            if isinstance(process, PyClockProcess):
+                clocks[process.slot] = (process.initial, process.runnable,
+                                        self._timeline.deadlines.get(process))
+        return _PySnapshot(
+            layout=self._layout(),
+            now=self._timeline.now,
+            signals=list(zip(self._state.curr[:self._design_slots],
+                             self._state.next[:self._design_slots])),
+            memories=[copy.copy(memory_state.data) for memory_state in self._state.memories],
+            clocks=clocks)
+
+    def restore(self, snapshot):
+        if not isinstance(snapshot, _PySnapshot):
+            raise TypeError("Object {!r} is not a snapshot taken by this simulation engine"
+                            .format(snapshot))
+        if snapshot.layout != self._layout():
+            raise ValueError("Snapshot was taken from a different design")
+
+        self.reset()
+        self._timeline.now = snapshot.now
+        for memory_state, data in zip(self._state.memories, snapshot.memories):
+            memory_state.data[:] = data
+        for slot in range(len(self._state.slot_signals)):
+            self._state.curr[slot] = self._state.next[slot] = self._state._reset_value(slot)
+        for slot, (curr, next) in enumerate(snapshot.signals):
+            self._state.curr[slot] = self._state.next[slot] = curr
+            # Values that were assigned but not committed yet are committed when the simulation
+            # continues; `set` compares them with the current values in a way that works for
+            # every representation of values.
+            self._state.set(slot, next)
+
+        # User processes are restarted, but clocks continue where they were.
+        for process in self._processes:
+            if isinstance(process, PyClockProcess) and process.slot in snapshot.clocks:
+                process.initial, runnable, deadline = snapshot.clocks[process.slot]
+                if not runnable:
+                    process.runnable = False
+                    self._state.run_queue.remove(process)
+                if deadline is not None:
+                    self._timeline.at(deadline, process)
+
+        for recorder in self._recorders:
+            recorder.begin(self._timeline.now)
+
+    def _commit(self, changed):
+        if self._idle and (self._state.dirty_memories or
+                           not self._clock_slots.issuperset(self._state.dirty)):
+            self._idle = False
+        self._state.commit(changed)
+
+    def _settle(self, changed):
+        # Runs every woken combinatorial process in rank order, committing its outputs right
+        # away, so that any process depending on them is already woken up when its turn comes.
+        run_queue  = self._state.run_queue
+        comb_queue = []
+        sequence   = itertools.count()
+        loops      = []
+        while True:
+            if run_queue:
+                other_processes = []
+                for process in run_queue:
+                    if process in self._comb_processes:
+                        heapq.heappush(comb_queue, (process.rank, next(sequence), process))
+                    else:
+                        other_processes.append(process)
+                run_queue[:] = other_processes
+            if not comb_queue:
+                break
+
+            _, _, process = heapq.heappop(comb_queue)
+            if process.loop is not None:
+                if process.loop.runs == 0:
+                    loops.append(process.loop)
+                process.loop.runs += 1
+                if process.loop.runs > process.loop.limit:
+                    for loop in loops:
+                        loop.runs = 0
+                    raise RuntimeError("Combinatorial loop {} does not converge"
+                                       .format(process.loop))
+            process.runnable = False
+            process.run()
+            self._commit(changed)
+
+        for loop in loops:
+            loop.runs = 0
+
+    def _update_waveforms(self):
+        # Start the waveform writers whose time window has started, and stop the ones whose time
+        # window has ended. Signals do not change between timestamps, so if the timeline skips past
+        # the boundary of a window, the current values are the values at the boundary.
+        now = self._timeline.now
+        for vcd_writer in list(self._vcd_pending):
+            if vcd_writer.start <= now:
+                self._vcd_pending.remove(vcd_writer)
+                vcd_writer.begin(vcd_writer.start, self._state)
+                self._vcd_writers.append(vcd_writer)
+        for vcd_writer in list(self._vcd_writers):
+            if vcd_writer.stop is not None and vcd_writer.stop < now:
+                self._vcd_writers.remove(vcd_writer)
+                vcd_writer.close(vcd_writer.stop)
 
     def _step(self):
-        changed = set() if self._vcd_writers else None
-
-        # Performs the two phases of a delta cycle in a loop:
-        converged = False
-        while not converged:
-            # 1. eval: run and suspend every non-waiting process once, queueing signal changes
-            for process in self._processes:
-                if process.runnable:
-                    process.runnable = False
-                    process.run()
+        if self._vcd_writers or self._vcd_pending:
+            self._update_waveforms()
+        changed = set() if self._vcd_writers or self._recorders or self._profile else None
+
+        # Performs the three phases of a delta cycle in a loop:
+        run_queue = self._state.run_queue
+        deltas = 1
+        self._settle(changed)
+        while run_queue:
+            deltas += 1
+            # 1. eval: run and suspend every process that was woken up, queueing signal changes
+            processes = run_queue[:]
+            run_queue.clear()
+            for process in processes:
+                if self._idle and process not in self._idle_processes:
+                    self._idle = False
+                process.runnable = False
+                passive = process.passive
+                process.run()
+                if process.passive != passive:
+                    self._active += -1 if process.passive else 1
 
             # 2. commit: apply every queued signal change, waking up any waiting processes
-            converged = self._state.commit(changed)
+            self._commit(changed)
+
+            # 3. settle: propagate the changes through combinatorial logic
+            self._settle(changed)
 
         for vcd_writer in self._vcd_writers:
-            for signal_state in changed:
-                vcd_writer.update(self._timeline.now,
-                    signal_state.signal, signal_state.curr)
+            vcd_writer.record(self._timeline.now, changed & vcd_writer.slots)
+        for recorder in self._recorders:
+            recorder.record(self._timeline.now, changed & recorder.slots)
+        if self._profile is not None:
+            self._profile.delta_cycles[deltas] += 1
+            toggles = self._toggles
+            for slot in changed:
+                toggles[slot] = toggles.get(slot, 0) + 1
+
+    def _fast_forward(self, deadline):
+        # If only clocks have changed for a whole clock period, every following period will be
+        # the same until a user process runs, so those periods can be skipped. The waveforms of
+        # the clocks would be lost, so this is never done while they are written or recorded.
+        clock_processes = self._clock_processes
+        periods = {process.period for process in clock_processes}
+        if len(periods) != 1:
+            return
+        period, = periods
+        now = self._timeline.now
+        if now - self._idle_since < period:
+            return
+        if any(process.initial for process in clock_processes):
+            return
+        if not all(process in self._idle_processes for process in self._state.run_queue):
+            return
 
-    def advance(self):
-        self._step()
+        limit = deadline
+        for process, run_at in self._timeline.deadlines.items():
+            if process not in self._idle_processes and (limit is None or run_at < limit):
+                limit = run_at
+        for vcd_writer in self._vcd_pending:
+            if limit is None or vcd_writer.start < limit:
+                limit = vcd_writer.start
+        if limit is None:
+            return
+        # Stop at least one period before the deadline, so that the deadline is reached with
+        # the same clock edges happening around it as if no periods were skipped.
+        count = int((limit - now) // period) - 1
+        if count > 0:
+            self._timeline.fast_forward(period / 2, count * 2, clock_processes)
+            self._idle_since = None
+
+    def advance(self, *, deadline=None):
+        self._idle = (bool(self._clock_processes) and
+                      not self._vcd_writers and not self._recorders)
+        try:
+            self._step()
+        except Exception:
+            # Write the waveforms leading to the failure, e.g. an assertion in a testbench.
+            for recorder in self._recorders:
+                if recorder.vcd_file is not None:
+                    recorder.dump(recorder.vcd_file, recorder.gtkw_file)
+            raise
+        if self._state.futures:
+            # Time does not advance until every process awaiting an asyncio future has run.
+            self._idle_since = None
+            return True
+        if not self._idle:
+            self._idle_since = None
+        elif self._idle_since is None:
+            self._idle_since = self._timeline.now
         self._timeline.advance()
-        return any(not process.passive for process in self._processes)
+        if self._idle_since is not None:
+            self._fast_forward(deadline)
+        return self._active > 0
 
     @property
     def now(self):
         return self._timeline.now
 
+    @property
+    def pending_futures(self):
+        return list(self._state.futures.values())
+
+    def coverage(self):
+        coverage = self._state.coverage
+        if coverage is None:
+            raise ValueError("Coverage is only collected by simulators created with "
+                             "`coverage=True`")
+
+        branches = {}
+        for key, count in zip(coverage.branch_keys, coverage.branches):
+            branches[key] = branches.get(key, 0) + count
+
+        toggles = {}
+        signal_names = _NameExtractor()(self._fragment)
+        for signal, names in signal_names.items():
+            slot = self._state.get_signal(signal)
+            if slot in self._state.words:
+                continue
+            mask = (1 << len(signal)) - 1
+            # Signals are reported by the name closest to the toplevel, like in waveforms.
+            name = base_name = ".".join(min(names, key=lambda name: (len(name), name)))
+            suffix = 0
+            while name in toggles:
+                suffix += 1
+                name = "{}${}".format(base_name, suffix)
+            toggles[name] = (len(signal), coverage.rose[slot] & mask, coverage.fell[slot] & mask)
+        return Coverage(branches=branches, toggles=toggles)
+
+    def _profile_process(self, process):
+        if isinstance(process, PyRTLProcess):
+            entry = ProcessProfile(name=".".join(process.hierarchy), kind=process.kind,
+                                   src_loc=process.src_loc)
+        elif isinstance(process, PyClockProcess):
+            entry = ProcessProfile(name=self._state.slot_signals[process.slot].name,
+                                   kind="clock", src_loc=None)
+        elif isinstance(process, PyStimulusProcess):
+            entry = ProcessProfile(name=self._state.slot_signals[process.slot].name,
+                                   kind="stimulus", src_loc=None)
+        else:
+            function = inspect.unwrap(process.constructor)
+            entry = ProcessProfile(name=function.__qualname__, kind="testbench",
+                                   src_loc=(function.__code__.co_filename,
+                                            function.__code__.co_firstlineno))
+        self._profile.processes.append(entry)
+
+        run = self._profiled[process] = process.run
+        dirty = self._state.dirty
+        perf_counter = time.perf_counter
+        def profiled_run():
+            updates = len(dirty)
+            start = perf_counter()
+            run()
+            entry.time += perf_counter() - start
+            entry.calls += 1
+            entry.updates += len(dirty) - updates
+        process.run = profiled_run
+
+    @contextmanager
+    def profile(self):
+        if self._profile is not None:
+            raise ValueError("Simulation is already being profiled")
+        profile = self._profile = SimulationProfile()
+        profile.start = self._timeline.now
+        self._toggles = {}
+        for process in self._processes:
+            self._profile_process(process)
+        start = time.perf_counter()
+        try:
+            yield profile
+        finally:
+            profile.time = time.perf_counter() - start
+            profile.stop = self._timeline.now
+            for process, run in self._profiled.items():
+                if isinstance(process, PyRTLProcess):
+                    process.run = run
+                else:
+                    del process.run
+            self._profiled.clear()
+
+            # Signals are reported by the name closest to the toplevel, like in waveforms.
+            signal_names = _NameExtractor()(self._fragment)
+            for slot, count in self._toggles.items():
+                signal = self._state.slot_signals[slot]
+                names = signal_names.get(signal, {("top", signal.name)})
+                name = min(names, key=lambda name: (len(name), name))
+                profile.toggles[".".join(name)] = count
+            self._toggles = None
+            self._profile = None
+
     @contextmanager
-    def write_vcd(self, *, vcd_file, gtkw_file, traces):
-        vcd_writer = _VCDWriter(self._fragment,
-            vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces)
+    def _write_waveforms(self, **kwargs):
+        vcd_writer = self._create_vcd_writer(**kwargs)
         try:
-            self._vcd_writers.append(vcd_writer)
+            # Words of memories are only kept in sync with the contents of the memory once they
+            # are requested; `begin` requests the words of every memory that is not filtered out.
+            if vcd_writer.start is None or vcd_writer.start <= self._timeline.now:
+                vcd_writer.begin(self._timeline.now, self._state)
+                self._vcd_writers.append(vcd_writer)
+            else:
+                self._vcd_pending.append(vcd_writer)
             yield
         finally:
-            vcd_writer.close(self._timeline.now)
-            self._vcd_writers.remove(vcd_writer)
+            now = self._timeline.now
+            if vcd_writer in self._vcd_pending:
+                self._vcd_pending.remove(vcd_writer)
+                vcd_writer.begin(min(now, vcd_writer.start), self._state)
+                vcd_writer.close(now)
+            elif vcd_writer in self._vcd_writers:
+                self._vcd_writers.remove(vcd_writer)
+                if vcd_writer.stop is not None:
+                    now = min(now, vcd_writer.stop)
+                vcd_writer.close(now)
+
+    def write_vcd(self, *, vcd_file, gtkw_file, traces,
+                  include=None, depth=None, start=None, stop=None):
+        return self._write_waveforms(vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces,
+                                     include=include, depth=depth, start=start, stop=stop)
+
+    def write_fst(self, *, fst_file, gtkw_file, traces,
+                  include=None, depth=None, start=None, stop=None):
+        return self._write_waveforms(vcd_file=fst_file, gtkw_file=gtkw_file, traces=traces,
+                                     format="fst",
+                                     include=include, depth=depth, start=start, stop=stop)
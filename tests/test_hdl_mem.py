@@ -43,6 +43,26 @@ class MemoryTestCase(FHDLTestCase):
                     r"'str' object cannot be interpreted as an integer$")):
             m = Memory(width=8, depth=4, init=[1, "0"])
 
+    def test_getitem(self):
+        m = Memory(width=8, depth=4, init=[1, 2])
+        self.assertIs(m[1], m[1])
+        self.assertIs(m[-1], m[3])
+        self.assertEqual(m[1].reset, 2)
+        self.assertEqual(m[3].reset, 0)
+        m.init = [3]
+        self.assertEqual(m[0].reset, 3)
+        self.assertEqual(m[1].reset, 0)
+
+    def test_getitem_wrong(self):
+        m = Memory(width=8, depth=4)
+        with self.assertRaisesRegex(IndexError,
+                r"^Memory address 4 is out of range$"):
+            m[4]
+        m = Memory(width=8, depth=4, simulate=False)
+        with self.assertRaisesRegex(IndexError,
+                r"^Memory 'm' is not simulated$"):
+            m[0]
+
     def test_attrs(self):
         m1 = Memory(width=8, depth=4)
         self.assertEqual(m1.attrs, {})
@@ -1,4 +1,12 @@
+import io
 import os
+import asyncio
+import pickle
+import importlib.util
+import tempfile
+import unittest
+import warnings
+from unittest import mock
 from contextlib import contextmanager
 
 from nmigen._utils import flatten, union
@@ -9,6 +17,11 @@ from nmigen.hdl.rec import *
 from nmigen.hdl.dsl import  *
 from nmigen.hdl.ir import *
 from nmigen.sim import *
+from nmigen.sim.pysim import _Timeline, _PySimulation, _VCDWriter
+from nmigen.sim._fst import FSTWriter, FSTReader
+from nmigen.sim._pyrtl import _FragmentCompiler, _levelize
+from nmigen.sim._pycoro import PyCoroProcess
+from nmigen._toolchain.yosys import find_yosys, YosysError
 
 from .utils import *
 
@@ -186,6 +199,16 @@ class SimulatorUnitTestCase(FHDLTestCase):
         self.assertStatement(stmt, [C(2, 4), C(3, 4), C(0)], C(3, 4))
         self.assertStatement(stmt, [C(2, 4), C(3, 4), C(1)], C(2, 4))
 
+    def test_mux_invert(self):
+        stmt = lambda y, a, b, c: y.eq(Mux(~c, a, b))
+        self.assertStatement(stmt, [C(2, 4), C(3, 4), C(0)], C(2, 4))
+        self.assertStatement(stmt, [C(2, 4), C(3, 4), C(1)], C(3, 4))
+
+    def test_const_fold(self):
+        stmt = lambda y, a: y.eq(a + C(3, 4) * C(-2, signed(4)) + Cat(C(1, 2), C(1, 2)))
+        self.assertStatement(stmt, [C(10, 8)], C(9, signed(10)))
+        self.assertStatement(stmt, [C(1, 8)],  C(0, signed(10)))
+
     def test_abs(self):
         stmt = lambda y, a: y.eq(abs(a))
         self.assertStatement(stmt, [C(3,  unsigned(8))], C(3,  unsigned(8)))
@@ -291,6 +314,43 @@ class SimulatorUnitTestCase(FHDLTestCase):
         self.assertStatement(stmt, [C(3), C(0b001)], C(0b001000000))
         self.assertStatement(stmt, [C(4), C(0b010)], C(0b010000000))
 
+    def test_array_lhs_partial(self):
+        l = Signal(3)
+        m = Signal(3)
+        n = Signal(3)
+        array = Array([l, m, n])
+        stmt = lambda y, a, b: [array[a].eq(0b111), array[a][1].eq(b),
+                                y.eq(Cat(*array))]
+        self.assertStatement(stmt, [C(0), C(0)], C(0b000000101))
+        self.assertStatement(stmt, [C(2), C(0)], C(0b101000000))
+
+    def test_array_signal_oob(self):
+        l = Signal(3, reset=1)
+        m = Signal(3, reset=4)
+        n = Signal(3, reset=7)
+        array = Array([l, m, n])
+        stmt = lambda y, a: y.eq(array[a])
+        self.assertStatement(stmt, [C(1)], C(4))
+        self.assertStatement(stmt, [C(3)], C(7))
+
+    def test_switch_table(self):
+        def stmt(y, a):
+            cases = {n: y.eq(n * 3) for n in range(10)}
+            cases[(3, 12)] = y.eq(100) # 3 is already handled above
+            cases[()] = y.eq(200)
+            return Switch(a, cases)
+        self.assertStatement(stmt, [C(0, 4)], C(0, 8))
+        self.assertStatement(stmt, [C(3, 4)], C(9, 8))
+        self.assertStatement(stmt, [C(9, 4)], C(27, 8))
+        self.assertStatement(stmt, [C(12, 4)], C(100, 8))
+        self.assertStatement(stmt, [C(15, 4)], C(200, 8))
+
+    def test_switch_table_no_default(self):
+        def stmt(y, a):
+            return Switch(a, {n: y[:4].eq(n) for n in range(10)})
+        self.assertStatement(stmt, [C(9, 4)], C(0b11111001, 8), reset=0xff)
+        self.assertStatement(stmt, [C(15, 4)], C(0xff, 8), reset=0xff)
+
     def test_array_index(self):
         array = Array(Array(x * y for y in range(10)) for x in range(10))
         stmt = lambda y, a, b: y.eq(array[a][b])
@@ -516,6 +576,27 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
             sim.add_sync_process(sys_process, domain="sys")
             sim.add_sync_process(pix_process, domain="pix")
 
+    def test_passive_active(self):
+        m = Module()
+        m.domains.sync = ClockDomain()
+        with self.assertSimulation(m) as sim:
+            sim.add_clock(1e-6)
+            ticks = 0
+            def counter_process():
+                nonlocal ticks
+                yield Passive()
+                while True:
+                    yield
+                    ticks += 1
+            def process():
+                yield Passive()
+                yield Active()
+                for _ in range(3):
+                    yield
+            sim.add_sync_process(counter_process)
+            sim.add_sync_process(process)
+        self.assertEqual(ticks, 3)
+
     def setUp_lhs_rhs(self):
         self.i = Signal(8)
         self.o = Signal(8)
@@ -534,6 +615,227 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
                 self.assertEqual((yield self.i), 0b10101111)
             sim.add_process(process)
 
+    def test_comb_lhs_groups(self):
+        i = Signal(4)
+        j = Signal(4)
+        a = Signal(4)
+        b = Signal(4)
+        c = Signal(4)
+        d = Signal(4)
+        m = Module()
+        m.d.comb += a.eq(i)
+        with m.If(j[0]):
+            m.d.comb += b.eq(j)
+        with m.Else():
+            m.d.comb += Cat(b, c).eq(i)
+        m.d.comb += d.eq(j + 1)
+        fragment = Fragment.get(m, platform=None)
+
+        state = _PySimulation()
+        processes = _FragmentCompiler(state)(fragment)
+        self.assertEqual(len(processes), 3)
+        triggers = set()
+        for process in processes:
+            triggers.add(frozenset(state.slot_signals[slot].name
+                                   for slot, waiters in state.waiters.items()
+                                   if process in waiters))
+        self.assertEqual(triggers, {frozenset("i"), frozenset("ij"), frozenset("j")})
+
+        with self.assertSimulation(m) as sim:
+            def process():
+                yield i.eq(0b0110)
+                yield j.eq(0b0011)
+                yield Settle()
+                self.assertEqual((yield a), 0b0110)
+                self.assertEqual((yield b), 0b0011)
+                self.assertEqual((yield c), 0)
+                self.assertEqual((yield d), 0b0100)
+                yield j.eq(0b0010)
+                yield Settle()
+                self.assertEqual((yield b), 0b0110)
+                self.assertEqual((yield c), 0)
+                self.assertEqual((yield d), 0b0011)
+            sim.add_process(process)
+
+    def test_comb_levelize(self):
+        i = Signal(8)
+        chain = [Signal(8, name="s{}".format(n)) for n in range(16)]
+        m = Module()
+        # Add statements in reverse order, so that a naive evaluation order would need a delta
+        # cycle for every link of the chain.
+        for n in reversed(range(1, len(chain))):
+            m.d.comb += chain[n].eq(chain[n - 1] + 1)
+        m.d.comb += chain[0].eq(i)
+        fragment = Fragment.get(m, platform=None)
+
+        state = _PySimulation()
+        processes = _levelize(_FragmentCompiler(state)(fragment))
+        ranks = {next(iter(process.outputs)).name: process.rank for process in processes}
+        self.assertEqual(sorted(ranks, key=ranks.get), [signal.name for signal in chain])
+        for process in processes:
+            self.assertIsNone(process.loop)
+
+        runs = 0
+        with self.assertSimulation(m) as sim:
+            for process in sim._engine._comb_processes:
+                def run(run=process.run):
+                    nonlocal runs
+                    runs += 1
+                    run()
+                process.run = run
+            def process():
+                nonlocal runs
+                yield Settle()
+                runs = 0
+                yield i.eq(10)
+                yield Settle()
+                self.assertEqual((yield chain[-1]), 10 + len(chain) - 1)
+            sim.add_process(process)
+        # Every process in the chain runs exactly once.
+        self.assertEqual(runs, len(chain))
+
+    def test_comb_loop_converges(self):
+        i = Signal()
+        a = Signal(2)
+        m = Module()
+        m.d.comb += a[0].eq(i)
+        m.d.comb += a[1].eq(a[0])
+        with self.assertSimulation(m) as sim:
+            def process():
+                yield i.eq(1)
+                yield Settle()
+                self.assertEqual((yield a), 0b11)
+            sim.add_process(process)
+
+    def test_comb_loop_wrong(self):
+        a = Signal()
+        b = Signal()
+        m = Module()
+        m.d.comb += a.eq(~b)
+        m.d.comb += b.eq(a)
+        sim = Simulator(m)
+        with self.assertRaisesRegex(RuntimeError,
+                r"^Combinatorial loop (a -> b -> a|b -> a -> b) does not converge$"):
+            sim.run()
+
+    def test_array_register_file(self):
+        regs = Array(Signal(8, name="r{}".format(n)) for n in range(16))
+        waddr = Signal(4)
+        wdata = Signal(8)
+        raddr = Signal(4)
+        rdata = Signal(8)
+        m = Module()
+        m.d.sync += regs[waddr].eq(wdata)
+        m.d.comb += rdata.eq(regs[raddr])
+        with self.assertSimulation(m) as sim:
+            def process():
+                for n in range(16):
+                    yield waddr.eq(n)
+                    yield wdata.eq(n * 3)
+                    yield
+                yield regs[5].eq(0xff)
+                yield regs[raddr].eq(0xee)
+                for n in range(16):
+                    yield raddr.eq(n)
+                    yield Settle()
+                    if n == 0:
+                        expected = 0xee
+                    elif n == 5:
+                        expected = 0xff
+                    else:
+                        expected = n * 3
+                    self.assertEqual((yield rdata), expected)
+            sim.add_clock(1e-6)
+            sim.add_sync_process(process)
+
+    def test_fsm_switch_table(self):
+        count = Signal(8)
+        state = Signal(8)
+        m = Module()
+        with m.FSM():
+            for n in range(16):
+                with m.State("S{}".format(n)):
+                    m.d.sync += count.eq(count + n)
+                    m.d.comb += state.eq(n)
+                    m.next = "S{}".format((n + 1) % 16)
+        with self.assertSimulation(m) as sim:
+            def process():
+                total = 0
+                for n in range(20):
+                    self.assertEqual((yield state), n % 16)
+                    self.assertEqual((yield count), total)
+                    total += n % 16
+                    yield Tick()
+                    yield Settle()
+            sim.add_clock(1e-6)
+            sim.add_process(process)
+
+    def test_command_cache(self):
+        self.setUp_lhs_rhs()
+        s = Signal(signed(4))
+        with self.assertSimulation(self.m) as sim:
+            def process():
+                for value in (1, 2, 3):
+                    yield self.i.eq(value)
+                    yield self.i[4:].eq(value)
+                    yield s.eq(-value)
+                    yield Settle()
+                    self.assertEqual((yield self.o), value | (value << 4))
+                    self.assertEqual((yield s), -value)
+                    self.assertEqual((yield self.i + Const(1, 1)), (value | (value << 4)) + 1)
+                    self.assertEqual((yield self.i + Const(1, 2)), (value | (value << 4)) + 1)
+                    self.assertEqual((yield Cat(Const(1, 1), s)), 1 | ((-value & 0xf) << 1))
+                    self.assertEqual((yield Cat(Const(1, 2), s)), 1 | ((-value & 0xf) << 2))
+                    yield s.eq(self.i)
+                    yield Settle()
+                    self.assertEqual((yield s), value)
+            sim.add_process(process)
+        # 3 assignments of constants, 1 assignment of a signal, and 6 values.
+        self.assertEqual(len(sim._engine._state.code_cache), 10)
+
+    def test_command_cache_consts(self):
+        self.setUp_lhs_rhs()
+        with self.assertSimulation(self.m) as sim:
+            def process():
+                for value in range(256):
+                    yield self.i.eq(value)
+                    yield Settle()
+                    self.assertEqual((yield self.o == value), 1)
+                    self.assertEqual((yield self.o + Const(value, 8) + 1), value * 2 + 1)
+            sim.add_process(process)
+        # 1 assignment of constants, 8 comparisons with constants of every width from 1 to 8,
+        # and 1 sum of constants of the same width.
+        self.assertEqual(len(sim._engine._state.code_cache), 10)
+
+    def test_command_cache_shared_consts(self):
+        x = Signal(4)
+        y = Signal(4)
+        with self.assertSimulation(Module()) as sim:
+            def process():
+                yield x.eq(3)
+                yield y.eq(5)
+                yield Settle()
+                c = Const(3, 4)
+                self.assertEqual((yield (x == c) & (y == c)), 0)
+                self.assertEqual((yield (x == Const(3, 4)) & (y == Const(5, 4))), 1)
+            sim.add_process(process)
+
+    def test_command_cache_size(self):
+        self.setUp_lhs_rhs()
+        s = Signal(16)
+        with mock.patch.object(PyCoroProcess, "_code_cache_size", 4):
+            with self.assertSimulation(self.m) as sim:
+                def process():
+                    for value in range(16):
+                        yield s.eq(self.i + value)
+                        yield Settle()
+                        self.assertEqual((yield s), value)
+                        yield s.eq(Array([self.i, value])[1])
+                        yield Settle()
+                        self.assertEqual((yield s), value)
+                sim.add_process(process)
+            self.assertEqual(len(sim._engine._state.code_cache), 4)
+
     def test_run_until(self):
         m = Module()
         s = Signal()
@@ -595,6 +897,114 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
             sim.add_process(process)
         self.assertTrue(survived)
 
+    def test_async_process(self):
+        self.setUp_counter()
+        sim = Simulator(self.m)
+        sim.add_clock(1e-6)
+        async def model(reader, writer):
+            # A reference model of the counter, replying to every value with the next one.
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await asyncio.sleep(0.001)
+                writer.write("{}\n".format((int(line) + 1) % 8).encode())
+                await writer.drain()
+            writer.close()
+        checked = 0
+        async def process():
+            nonlocal checked
+            server = await asyncio.start_server(model, "127.0.0.1", 0)
+            reader, writer = await asyncio.open_connection(
+                *server.sockets[0].getsockname()[:2])
+            for _ in range(10):
+                writer.write("{}\n".format(await Eval(self.count)).encode())
+                now = sim._engine.now
+                expected = int(await reader.readline())
+                self.assertEqual(sim._engine.now, now)
+                await Tick()
+                await Settle()
+                self.assertEqual(await Eval(self.count), expected)
+                checked += 1
+            await Eval(self.count.eq(0))
+            await Settle()
+            self.assertEqual(await Eval(self.count), 0)
+            writer.close()
+            server.close()
+            await server.wait_closed()
+        sim.add_sync_process(process)
+        asyncio.run(sim.run_async())
+        self.assertEqual(checked, 10)
+
+    def test_async_process_without_event_loop(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        sim = Simulator(Module())
+        async def process():
+            await loop.create_future()
+        sim.add_process(process)
+        with self.assertRaisesRegex(RuntimeError,
+                r"^Process .+? awaits an asyncio future, but the simulation is not run by "
+                r"an asyncio event loop; use `await sim.run_async\(\)` or a similar method to "
+                r"run it$"):
+            sim.run()
+
+    def run_stimulus(self, add_stimulus):
+        stim = Signal(signed(4))
+        acc  = Signal(8)
+        m = Module()
+        m.d.sync += acc.eq(acc + stim)
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        add_stimulus(sim, stim)
+        trace = []
+        def monitor():
+            yield Passive()
+            while True:
+                yield
+                trace.append(((yield stim), (yield acc)))
+        sim.add_sync_process(monitor)
+        sim.run()
+        return trace, sim._engine.now
+
+    def test_add_stimulus(self):
+        import array
+        values = [1, 2, -3, 4, 15]
+        def add_process(sim, stim):
+            def process():
+                for value in values:
+                    yield stim.eq(value)
+                    yield
+            sim.add_sync_process(process)
+        expected = self.run_stimulus(add_process)
+        self.assertEqual(expected[0][-1], (-1, 4))
+        stimuli = [values, array.array("b", values)]
+        if _has_numpy():
+            import numpy
+            stimuli.append(numpy.array(values))
+        for stimulus in stimuli:
+            with self.subTest(stimulus=stimulus):
+                self.assertEqual(
+                    self.run_stimulus(lambda sim, stim: sim.add_stimulus(stim, stimulus)),
+                    expected)
+
+    def test_add_stimulus_passive(self):
+        self.assertEqual(
+            self.run_stimulus(lambda sim, stim: sim.add_stimulus(stim, [1, 2, 3], passive=True)),
+            self.run_stimulus(lambda sim, stim: None))
+
+    def test_add_stimulus_wrong(self):
+        sim = Simulator(Module())
+        with self.assertRaisesRegex(TypeError,
+                r"^Stimulus must drive a Signal, not \(const 1'd1\)$"):
+            sim.add_stimulus(Const(1), [])
+        with self.assertRaisesRegex(ValueError,
+                r"^Domain 'sync' is not present in simulation$"):
+            sim.add_stimulus(Signal(), [])
+        with self.assertRaisesRegex(TypeError,
+                r"^Stimulus value must be an integer, not 0.5$"):
+            sim.add_stimulus(Signal(), [0.5], domain=ClockDomain("sync"))
+
     def setUp_memory(self, rd_synchronous=True, rd_transparent=True, wr_granularity=None):
         self.m = Module()
         self.memory = Memory(width=8, depth=4, init=[0xaa, 0x55])
@@ -726,6 +1136,92 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
             sim.add_clock(1e-6)
             sim.add_sync_process(process)
 
+    def test_memory_words(self):
+        self.setUp_memory()
+        with self.assertSimulation(self.m) as sim:
+            def process():
+                self.assertEqual((yield self.memory[0]), 0xaa)
+                self.assertEqual((yield self.memory[-3]), 0x55)
+                yield self.memory[2].eq(0x12)
+                yield self.rdport.addr.eq(2)
+                yield
+                yield
+                self.assertEqual((yield self.rdport.data), 0x12)
+                yield self.wrport.addr.eq(0)
+                yield self.wrport.data.eq(0x34)
+                yield self.wrport.en.eq(1)
+                yield
+                yield Settle()
+                self.assertEqual((yield self.memory[0]), 0x34)
+            sim.add_clock(1e-6)
+            sim.add_sync_process(process)
+
+    def test_memory_large(self):
+        self.m = Module()
+        self.memory = Memory(width=16, depth=65536)
+        self.m.submodules.rdport = self.rdport = self.memory.read_port(domain="comb")
+        self.m.submodules.wrport = self.wrport = self.memory.write_port()
+        sim = Simulator(self.m)
+        def process():
+            yield self.wrport.addr.eq(0xabcd)
+            yield self.wrport.data.eq(0x1234)
+            yield self.wrport.en.eq(1)
+            yield
+            yield self.rdport.addr.eq(0xabcd)
+            yield Settle()
+            self.assertEqual((yield self.rdport.data), 0x1234)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        sim.run()
+        # Words of the memory are not assigned slots unless they are written to waveforms.
+        self.assertLess(len(sim._engine._state.slot_signals), 16)
+
+    def test_memory_trace(self):
+        self.setUp_memory()
+        sim = Simulator(self.m)
+        def process():
+            yield self.wrport.addr.eq(1)
+            yield self.wrport.data.eq(0x33)
+            yield self.wrport.en.eq(1)
+            yield
+        sim.add_clock(1e-6)
+        sim.add_sync_process(process)
+        def write_vcd(**kwargs):
+            vcd_file = io.StringIO()
+            vcd_file.close = lambda: None
+            with sim.write_vcd(vcd_file, **kwargs):
+                sim.run()
+            sim.reset()
+            return vcd_file.getvalue()
+
+        # Every word is written by default, in the scope of every port of the memory.
+        vcd = write_vcd()
+        for addr in range(4):
+            self.assertIn(" memory({}) $end".format(addr), vcd)
+        self.assertIn("$scope module rdport $end", vcd)
+        self.assertIn("$scope module wrport $end", vcd)
+        self.assertIn("b110011 ", vcd)
+
+        vcd = write_vcd(include="top.rdport.data", traces=[self.memory[1]])
+        self.assertIn("memory(1)", vcd)
+        self.assertNotIn("memory(0)", vcd)
+        self.assertIn("b110011 ", vcd)
+
+    def test_memory_reset(self):
+        self.setUp_memory()
+        sim = Simulator(self.m)
+        def process():
+            yield self.memory[0].eq(0x33)
+            yield Settle()
+            self.assertEqual((yield self.memory[0]), 0x33)
+        sim.add_process(process)
+        sim.run()
+        sim.reset()
+        def process():
+            self.assertEqual((yield self.memory[0]), 0xaa)
+        sim.add_process(process)
+        sim.run()
+
     def test_sample_helpers(self):
         m = Module()
         s = Signal(2)
@@ -772,17 +1268,405 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
             sim.add_sync_process(process_gen)
             sim.add_sync_process(process_check)
 
-    def test_vcd_wrong_nonzero_time(self):
-        s = Signal()
-        m = Module()
-        m.d.sync += s.eq(s)
-        sim = Simulator(m)
+    def test_vcd_nonzero_time(self):
+        self.setUp_counter()
+        sim = Simulator(self.m)
+        sim.add_clock(1e-6)
+        sim.run_until(1e-5, run_passive=True)
+        vcd_file = io.StringIO()
+        vcd_file.close = lambda: None
+        with sim.write_vcd(vcd_file):
+            sim.run_until(2e-5, run_passive=True)
+        self.assertIn("#100000\n", vcd_file.getvalue())
+        self.assertEqual(self.vcd_changes(vcd_file.getvalue())["count"][:2], ["110", "111"])
+
+    @staticmethod
+    def vcd_vars(vcd):
+        return {line.split()[4] for line in vcd.splitlines() if line.startswith("$var")}
+
+    def test_vcd_filter(self):
+        self.setUp_counter()
+        inner = Signal()
+        self.m.submodules.sub = sub = Module()
+        sub.d.comb += inner.eq(self.count[0])
+        def write(**filters):
+            sim = Simulator(self.m)
+            sim.add_clock(1e-6)
+            vcd_file = io.StringIO()
+            vcd_file.close = lambda: None
+            with sim.write_vcd(vcd_file, **filters):
+                sim.run_until(1e-5, run_passive=True)
+            return vcd_file.getvalue()
+        self.assertEqual(self.vcd_vars(write()), {"clk", "rst", "count", "inner"})
+        self.assertEqual(self.vcd_vars(write(include="top.sub.*")), {"count", "inner"})
+        self.assertEqual(self.vcd_vars(write(include=["top.clk", "*.inner"])), {"clk", "inner"})
+        self.assertEqual(self.vcd_vars(write(depth=0)), {"clk", "rst", "count"})
+        vcd = write(include="top.sub.inner")
+        self.assertEqual(self.vcd_changes(vcd)["inner"][:3], ["0", "1", "0"])
+
+    def test_vcd_window(self):
+        self.setUp_counter()
+        sim = Simulator(self.m)
+        sim.add_clock(1e-6)
+        vcd_file = io.StringIO()
+        vcd_file.close = lambda: None
+        with sim.write_vcd(vcd_file, start=2e-6, stop=4e-6):
+            sim.run_until(1e-5, run_passive=True)
+        timestamps = [line for line in vcd_file.getvalue().splitlines() if line.startswith("#")]
+        self.assertEqual(timestamps[0], "#20000")
+        self.assertEqual(timestamps[-1], "#40000")
+        self.assertEqual(self.vcd_changes(vcd_file.getvalue())["count"], ["110", "111", "0"])
+
+    def test_vcd_buffers(self):
+        self.setUp_counter()
+        def write():
+            sim = Simulator(self.m)
+            sim.add_clock(1e-6)
+            vcd_file = io.StringIO()
+            vcd_file.close = lambda: None
+            with sim.write_vcd(vcd_file):
+                sim.run_until(1e-4, run_passive=True)
+            vcd = vcd_file.getvalue()
+            timestamps = [line for line in vcd.splitlines() if line.startswith("#")]
+            return timestamps, self.vcd_changes(vcd)
+        vcd = write()
+        buffer_size, buffer_count = _VCDWriter.buffer_size, _VCDWriter.buffer_count
+        try:
+            _VCDWriter.buffer_size, _VCDWriter.buffer_count = 3, 2
+            self.assertEqual(write(), vcd)
+        finally:
+            _VCDWriter.buffer_size, _VCDWriter.buffer_count = buffer_size, buffer_count
+
+    def test_vcd_writer_error(self):
+        self.setUp_counter()
+        state = Signal(decoder=lambda value: ["OFF"][value])
+        self.m.d.comb += state.eq(self.count[0])
+        sim = Simulator(self.m)
+        sim.add_clock(1e-6)
+        with self.assertRaises(IndexError):
+            with sim.write_vcd(io.StringIO()):
+                sim.run_until(1e-5, run_passive=True)
+
+    def test_recorder(self):
+        self.setUp_counter()
+        sim = Simulator(self.m)
+        sim.add_clock(1e-6)
+        recorder = sim.add_recorder(cycles=3, include="top.count")
+        sim.run_until(1e-5, run_passive=True)
+        vcd_file = io.StringIO()
+        vcd_file.close = lambda: None
+        recorder.dump(vcd_file)
+        vcd = vcd_file.getvalue()
+        self.assertEqual(self.vcd_vars(vcd), {"count"})
+        timestamps = [line for line in vcd.splitlines() if line.startswith("#")]
+        self.assertEqual(timestamps, ["#70000", "#75000", "#85000", "#95000", "#100000"])
+        self.assertEqual(self.vcd_changes(vcd)["count"], ["11", "100", "101", "110"])
+
+    def test_recorder_wrapped(self):
+        self.setUp_counter()
+        sim = Simulator(self.m)
+        sim.add_clock(1e-6)
+        recorder = sim.add_recorder(size=4)
+        sim.run_until(1e-5, run_passive=True)
+        vcd_file = io.StringIO()
+        vcd_file.close = lambda: None
+        recorder.dump(vcd_file)
+        vcd = vcd_file.getvalue()
+        # The clock and the counter change at the same time on the rising edge.
+        timestamps = [line for line in vcd.splitlines() if line.startswith("#")]
+        self.assertEqual(timestamps, ["#85000", "#90000", "#95000", "#100000"])
+        self.assertEqual(self.vcd_changes(vcd)["count"], ["101", "110"])
+        self.assertEqual(self.vcd_changes(vcd)["clk"], ["1", "0", "1"])
+
+    def test_recorder_exception(self):
+        self.setUp_counter()
+        sim = Simulator(self.m)
         sim.add_clock(1e-6)
-        sim.run_until(1e-5)
+        vcd_file = io.StringIO()
+        vcd_file.close = lambda: None
+        sim.add_recorder(vcd_file, duration=2e-6)
+        def process():
+            while (yield self.count) != 2:
+                yield
+            self.fail("count is 2")
+        sim.add_sync_process(process)
+        with self.assertRaises(AssertionError):
+            sim.run()
+        vcd = vcd_file.getvalue()
+        # The assertion fails at 6.5 us, after the counter has become 2 at 5.5 us.
+        self.assertIn("#45000\n", vcd)
+        self.assertEqual(self.vcd_changes(vcd)["count"], ["1", "10"])
+
+    def test_recorder_wrong(self):
+        sim = Simulator(Module())
+        with self.assertRaisesRegex(ValueError,
+                r"^Recorded waveforms can be limited by duration or by number of cycles, "
+                r"but not both$"):
+            sim.add_recorder(duration=1e-6, cycles=1)
         with self.assertRaisesRegex(ValueError,
-                r"^Cannot start writing waveforms after advancing simulation time$"):
-            with sim.write_vcd(open(os.path.devnull, "wt")):
-                pass
+                r"^Domain 'sync' is not present in simulation$"):
+            sim.add_recorder(cycles=1)
+
+    def test_profile(self):
+        self.setUp_counter()
+        inner = Signal(3)
+        self.m.submodules.sub = sub = Module()
+        sub.d.comb += inner.eq(self.count + 1)
+        sim = Simulator(self.m)
+        sim.add_clock(1e-6)
+        def process():
+            for _ in range(10):
+                yield
+        sim.add_sync_process(process)
+        with sim.profile() as profile:
+            sim.run()
+        sim.run_until(2e-5, run_passive=True)
+
+        processes = {(process.name, process.kind): process for process in profile.processes}
+        self.assertEqual(set(processes), {
+            ("top", "sync"),
+            ("top.sub", "comb"),
+            ("clk", "clock"),
+            ("SimulatorIntegrationTestCase.test_profile.<locals>.process", "testbench"),
+        })
+        self.assertEqual(processes["top", "sync"].calls, 11)
+        self.assertEqual(processes["top", "sync"].updates, 11)
+        self.assertEqual(processes["top.sub", "comb"].src_loc[0], __file__)
+        testbench = processes["SimulatorIntegrationTestCase.test_profile.<locals>.process",
+                              "testbench"]
+        self.assertEqual(testbench.calls, 12)
+        self.assertEqual(testbench.updates, 0)
+        self.assertEqual(testbench.src_loc[0], __file__)
+        self.assertEqual(profile.toggles, {"top.clk": 21, "top.count": 11, "top.sub.inner": 12})
+        self.assertEqual(profile.delta_cycles, {2: 11, 3: 11})
+        self.assertEqual(profile.timestamps, 22)
+        self.assertEqual(profile.start, 0)
+        self.assertAlmostEqual(profile.stop, 1.1e-5)
+        self.assertEqual(sorted(fragment.name for fragment in profile.fragments()),
+                         ["top", "top.sub"])
+        self.assertIn("top.sub (comb) at {}".format(__file__), profile.report())
+
+    def test_coverage(self):
+        self.setUp_counter()
+        flag = Signal()
+        sel  = Signal(range(8))
+        out  = Signal(4)
+        with self.m.If(self.count == 3):
+            self.m.d.comb += flag.eq(1)
+        with self.m.Else():
+            self.m.d.comb += flag.eq(0)
+        self.m.d.comb += sel.eq(self.count)
+        with self.m.Switch(sel):
+            for value in range(8):
+                with self.m.Case(value):
+                    self.m.d.comb += out.eq(value)
+        sim = Simulator(self.m, coverage=True)
+        sim.add_clock(1e-6)
+        def process():
+            for _ in range(5):
+                yield
+        sim.add_sync_process(process)
+        sim.run()
+
+        coverage = sim.coverage()
+        branches = {patterns: count
+                    for (filename, lineno, patterns), count in coverage.branches.items()
+                    if filename == __file__}
+        self.assertEqual(len(branches), 10)
+        self.assertEqual(branches[("1",)], 0)
+        self.assertGreater(branches[()], 0)
+        for value in (0, 1, 2, 4, 5, 6, 7):
+            self.assertGreater(branches["{:03b}".format(value),], 0)
+        self.assertEqual(branches[("011",)], 0)
+        self.assertEqual(coverage.toggles["top.count"], (3, 0b011, 0b111))
+        self.assertEqual(coverage.toggles["top.flag"], (1, 0, 0))
+        self.assertIn("case 011 never taken", coverage.report())
+        self.assertIn("top.count: bits 2 never toggled", coverage.report())
+
+        merged = Coverage.merge([coverage, pickle.loads(pickle.dumps(coverage))])
+        self.assertEqual(merged.branch_coverage(), coverage.branch_coverage())
+        self.assertEqual(sum(merged.branches.values()), 2 * sum(coverage.branches.values()))
+        self.assertEqual(merged.toggles["top.count"], (3, 0b011, 0b111))
+        with self.assertRaisesRegex(ValueError,
+                r"^Signal top\.count has width 3 in one coverage and 4 in another; was "
+                r"the coverage collected from different designs\?$"):
+            Coverage.merge([coverage, Coverage(toggles={"top.count": (4, 0, 0)})])
+
+    def test_code_cache(self):
+        def simulate(**kwargs):
+            self.setUp_memory(**kwargs)
+            sim = Simulator(self.m, coverage=True)
+            sim.add_clock(1e-6)
+            data = []
+            def process():
+                yield self.wrport.en.eq(1)
+                for addr in range(4):
+                    yield self.wrport.addr.eq(addr)
+                    yield self.wrport.data.eq(addr * 0x11)
+                    yield self.rdport.addr.eq(addr)
+                    yield
+                    data.append((yield self.rdport.data))
+            sim.add_sync_process(process)
+            sim.run()
+            return data, sim.coverage().branches
+
+        expected = simulate()
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                mock.patch.dict(os.environ, {"NMIGEN_pysim_cache": cache_dir}):
+            self.assertEqual(simulate(), expected)
+            self.assertNotEqual(os.listdir(cache_dir), [])
+            # Every fragment is loaded from the cache, and works the same.
+            with mock.patch.object(_FragmentCompiler, "_compile_fragment") as compile_fragment:
+                self.assertEqual(simulate(), expected)
+                compile_fragment.assert_not_called()
+            # Fragments with a different structure are not.
+            with mock.patch.object(_FragmentCompiler, "_compile_fragment",
+                                   wraps=_FragmentCompiler._compile_fragment,
+                                   autospec=True) as compile_fragment:
+                self.assertNotEqual(simulate(rd_transparent=False), expected)
+                compile_fragment.assert_called()
+
+    def test_coverage_wrong(self):
+        sim = Simulator(Module())
+        with self.assertRaisesRegex(ValueError,
+                r"^Coverage is only collected by simulators created with `coverage=True`$"):
+            sim.coverage()
+
+    def test_vcd_wrong_window(self):
+        sim = Simulator(Module())
+        with self.assertRaisesRegex(ValueError,
+                r"^Waveform window ends at 1e-06, before it starts at 2e-06$"):
+            sim.write_vcd(io.StringIO(), start=2e-6, stop=1e-6)
+
+    @staticmethod
+    def vcd_changes(vcd):
+        # Returns the sequence of values of every variable, by name.
+        names, changes = {}, {}
+        for line in vcd.splitlines():
+            tokens = line.split()
+            if tokens[:1] == ["$var"]:
+                names[tokens[3]] = tokens[4]
+            elif len(tokens) == 2 and tokens[0][0] in "bs":
+                changes.setdefault(names[tokens[1]], []).append(tokens[0][1:])
+            elif len(tokens) == 1 and tokens[0][0] in "01":
+                changes.setdefault(names[tokens[0][1:]], []).append(tokens[0][0])
+        return changes
+
+    def test_fst(self):
+        self.setUp_counter()
+        state = Signal(decoder=lambda value: ["OFF", "ON"][value])
+        self.m.d.comb += state.eq(self.count[0])
+        sim = Simulator(self.m)
+        sim.add_clock(1e-6)
+        vcd_file = io.StringIO()
+        vcd_file.close = lambda: None
+        fst_file = io.BytesIO()
+        fst_file.close = lambda: None
+        with sim.write_vcd(vcd_file), sim.write_fst(fst_file):
+            sim.run_until(1e-4, run_passive=True)
+        self.assertLess(len(fst_file.getvalue()), len(vcd_file.getvalue()) // 4)
+
+        fst_file.seek(0)
+        converted_file = io.StringIO()
+        fst_to_vcd(fst_file, converted_file)
+        changes = self.vcd_changes(converted_file.getvalue())
+        self.assertEqual(changes, self.vcd_changes(vcd_file.getvalue()))
+        self.assertEqual(changes["count"][:3], ["100", "101", "110"])
+        self.assertEqual(changes["state"][:3], ["OFF", "ON", "OFF"])
+
+    def test_fst_blocks(self):
+        fst_file = io.BytesIO()
+        fst_writer = FSTWriter(fst_file, block_size=3)
+        a = fst_writer.register_var(("top",), "a", "wire", size=1, init=0)
+        b = fst_writer.register_var(("top", "sub"), "b", "wire", size=12, init=-1)
+        fst_writer.register_alias(("top",), "c", b)
+        for timestamp in range(1, 20):
+            fst_writer.change(a, timestamp, timestamp & 1)
+            if timestamp % 3 == 0:
+                fst_writer.change(b, timestamp, timestamp)
+        fst_writer.close(25)
+
+        fst_file.seek(0)
+        fst_reader = FSTReader(fst_file)
+        self.assertEqual((fst_reader.start_time, fst_reader.end_time), (0, 25))
+        self.assertEqual(fst_reader.hierarchy, [
+            ("scope", "top"),
+            ("var", "wire", "a", 1, 1, False),
+            ("var", "wire", "c", 12, 2, False),
+            ("scope", "sub"),
+            ("var", "wire", "b", 12, 2, True),
+            ("upscope",),
+            ("upscope",),
+        ])
+        changes = list(fst_reader)
+        self.assertEqual(changes[:4], [
+            (0, 1, "0"),
+            (0, 2, "111111111111"),
+            (1, 1, "1"),
+            (2, 1, "0"),
+        ])
+        self.assertEqual([change for change in changes if change[1] == 2][1:3], [
+            (3, 2, "000000000011"),
+            (6, 2, "000000000110"),
+        ])
+        self.assertEqual(len(changes), 2 + 19 + 6)
+
+    def assertFastForward(self, make_design, skipped):
+        # Runs the design once with waveforms written, which prevents skipping clock periods,
+        # and once without, and checks that both runs observe the same values at the same time.
+        def run(trace, vcd_file=None):
+            m, signals = make_design()
+            sim = Simulator(m)
+            sim.add_clock(1e-6)
+            def process():
+                yield Delay(1e-3)
+                for _ in range(4):
+                    values = [round(sim._engine.now * 1e9)]
+                    for signal in signals:
+                        values.append((yield signal))
+                    trace.append(values)
+                    yield Tick()
+            sim.add_process(process)
+            steps = 0
+            if vcd_file is None:
+                while sim.advance():
+                    steps += 1
+            else:
+                with sim.write_vcd(vcd_file):
+                    while sim.advance():
+                        steps += 1
+            return steps
+
+        reference, trace = [], []
+        with open(os.devnull, "wt") as vcd_file:
+            reference_steps = run(reference, vcd_file)
+        steps = run(trace)
+        self.assertEqual(trace, reference)
+        if skipped:
+            self.assertLess(steps, reference_steps // 10)
+        else:
+            self.assertEqual(steps, reference_steps)
+
+    def test_fast_forward_timer(self):
+        def make_design():
+            timer = Signal(8, reset=10)
+            done  = Signal()
+            m = Module()
+            m.domains.sync = sync = ClockDomain()
+            m.d.comb += done.eq(timer == 0)
+            with m.If(~done):
+                m.d.sync += timer.eq(timer - 1)
+            return m, [timer, done, sync.clk]
+        self.assertFastForward(make_design, skipped=True)
+
+    def test_fast_forward_free_running(self):
+        def make_design():
+            count = Signal(8)
+            m = Module()
+            m.domains.sync = sync = ClockDomain()
+            m.d.sync += count.eq(count + 1)
+            return m, [count, sync.clk]
+        self.assertFastForward(make_design, skipped=False)
 
 
 class SimulatorRegressionTestCase(FHDLTestCase):
@@ -802,3 +1686,656 @@ class SimulatorRegressionTestCase(FHDLTestCase):
             self.assertEqual((yield -(Const(0b11, 2).as_signed())), 1)
         sim.add_process(process)
         sim.run()
+
+    def test_unnormalized_reset(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", SyntaxWarning)
+            a = Signal(4, reset=17)
+        b = Signal(5)
+        dut = Module()
+        dut.d.comb += b.eq(a + 2)
+        sim = Simulator(dut)
+        def process():
+            yield Settle()
+            self.assertEqual((yield b), 3)
+        sim.add_process(process)
+        sim.run()
+
+
+def _has_cxxrtl():
+    try:
+        find_yosys(lambda ver: ver >= (0, 9, 3468))
+        return True
+    except YosysError:
+        return False
+
+
+@unittest.skipUnless(_has_cxxrtl(), "CXXRTL requires Yosys 0.9+3468 or newer")
+class CxxSimulatorIntegrationTestCase(FHDLTestCase):
+    @contextmanager
+    def assertSimulation(self, module, deadline=None):
+        sim = Simulator(module, engine="cxxrtl")
+        yield sim
+        with sim.write_vcd("test.vcd", "test.gtkw"):
+            if deadline is None:
+                sim.run()
+            else:
+                sim.run_until(deadline)
+
+    def test_counter_clock_and_sync_process(self):
+        count = Signal(3, reset=4)
+        m = Module()
+        m.d.sync += count.eq(count + 1)
+        with self.assertSimulation(m) as sim:
+            sim.add_clock(1e-6, domain="sync")
+            def process():
+                self.assertEqual((yield count), 4)
+                yield
+                self.assertEqual((yield count), 5)
+                for _ in range(3):
+                    yield
+                self.assertEqual((yield count), 0)
+            sim.add_sync_process(process)
+
+    def test_comb_process(self):
+        a = Signal(8)
+        b = Signal(8)
+        o = Signal(8)
+        m = Module()
+        m.d.comb += o.eq(a ^ b)
+        with self.assertSimulation(m) as sim:
+            def process():
+                yield a.eq(0b1100)
+                yield b.eq(0b1010)
+                yield Settle()
+                self.assertEqual((yield o), 0b0110)
+                yield a[:4].eq(0)
+                yield Settle()
+                self.assertEqual((yield o), 0b1010)
+            sim.add_process(process)
+
+    def test_reset(self):
+        count = Signal(3, reset=4)
+        m = Module()
+        m.d.sync += count.eq(count + 1)
+        sim = Simulator(m, engine="cxxrtl")
+        sim.add_clock(1e-6)
+        times = 0
+        def process():
+            nonlocal times
+            self.assertEqual((yield count), 4)
+            yield
+            self.assertEqual((yield count), 5)
+            times += 1
+        sim.add_sync_process(process)
+        sim.run()
+        sim.reset()
+        sim.run()
+        self.assertEqual(times, 2)
+
+
+def _has_numpy():
+    return importlib.util.find_spec("numpy") is not None
+
+
+@unittest.skipUnless(_has_numpy(), "NumPy is not installed")
+class NumPySimulatorUnitTestCase(SimulatorUnitTestCase):
+    LANES = 4
+
+    @staticmethod
+    def _fragment(stmt, isigs, osig):
+        stmt = stmt(osig, *isigs)
+        frag = Fragment()
+        frag.add_statements(stmt)
+        for signal in flatten(s._lhs_signals() for s in Statement.cast(stmt)):
+            frag.add_driver(signal)
+        return frag
+
+    def assertStatement(self, stmt, inputs, output, reset=0):
+        from nmigen.sim.npsim import Drive
+
+        inputs = [Value.cast(i) for i in inputs]
+        output = Value.cast(output)
+
+        # Every lane but the first one receives different inputs, and its output is compared
+        # with the output computed by the default engine.
+        lane_inputs = [[Const(i.value + lane, i.shape()) for i in inputs]
+                       for lane in range(self.LANES)]
+        outputs = [output.value]
+        for inputs_ in lane_inputs[1:]:
+            isigs = [Signal(i.shape()) for i in inputs_]
+            osig  = Signal(output.shape(), reset=reset)
+            sim = Simulator(self._fragment(stmt, isigs, osig))
+            def process():
+                for isig, input in zip(isigs, inputs_):
+                    yield isig.eq(input)
+                yield Settle()
+                outputs.append((yield osig))
+            sim.add_process(process)
+            sim.run()
+
+        isigs = [Signal(i.shape(), name=n) for i, n in zip(inputs, "abcd")]
+        osig  = Signal(output.shape(), name="y", reset=reset)
+        sim = Simulator(self._fragment(stmt, isigs, osig), engine="numpy", lanes=self.LANES)
+        def process():
+            for index, isig in enumerate(isigs):
+                yield Drive(isig, [inputs_[index].value for inputs_ in lane_inputs])
+            yield Settle()
+            self.assertEqual(list((yield osig)), outputs)
+        sim.add_process(process)
+        with sim.write_vcd("test.vcd", "test.gtkw", traces=[*isigs, osig]):
+            sim.run()
+
+
+@unittest.skipUnless(_has_numpy(), "NumPy is not installed")
+class NumPySimulatorIntegrationTestCase(FHDLTestCase):
+    def test_counter(self):
+        from nmigen.sim.npsim import Drive
+
+        en    = Signal()
+        count = Signal(4, reset=2)
+        m = Module()
+        with m.If(en):
+            m.d.sync += count.eq(count + 1)
+        sim = Simulator(m, engine="numpy", lanes=3)
+        sim.add_clock(1e-6)
+        def process():
+            self.assertEqual(list((yield count)), [2, 2, 2])
+            yield Drive(en, [0, 1, 1])
+            yield
+            yield
+            self.assertEqual(list((yield count)), [2, 3, 3])
+            yield Drive(en, [1, 0, 1])
+            yield
+            yield
+            self.assertEqual(list((yield count)), [3, 4, 5])
+            yield en.eq(1)
+            for _ in range(12):
+                yield
+            self.assertEqual(list((yield count)), [15, 15, 1])
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_command_cache_consts(self):
+        s = Signal(signed(8))
+        t = Signal(72)
+        sim = Simulator(Module(), engine="numpy", lanes=2)
+        def process():
+            for value in range(-8, 8):
+                yield s.eq(value)
+                yield t.eq(value & 0xff)
+                yield Settle()
+                self.assertEqual(list((yield s == Const(value, signed(8)))), [1, 1])
+                self.assertEqual(list((yield t + Const((value & 0xff) << 64, 72))),
+                                 [((value & 0xff) << 64) + (value & 0xff)] * 2)
+        sim.add_process(process)
+        sim.run()
+        # 2 assignments of constants, and 2 values that only differ in their constants.
+        self.assertEqual(len(sim._engine._state.code_cache), 4)
+
+    def test_signed_lane_width(self):
+        # The unsigned values of negative signals as wide as a lane do not fit in a lane.
+        for width in (63, 64, 65):
+            with self.subTest(width=width):
+                s = Signal(signed(width))
+                t = Signal(signed(width))
+                u = Signal(signed(width))
+                m = Module()
+                m.d.comb += [
+                    s.eq(-5),
+                    u.eq(t - 1),
+                ]
+                sim = Simulator(m, engine="numpy", lanes=2)
+                def process():
+                    self.assertEqual(list((yield s)), [-5, -5])
+                    yield t.eq(-5)
+                    yield Settle()
+                    self.assertEqual(list((yield t)), [-5, -5])
+                    self.assertEqual(list((yield u)), [-6, -6])
+                    yield t.eq(1)
+                    yield Settle()
+                    self.assertEqual(list((yield u)), [0, 0])
+                sim.add_process(process)
+                sim.run()
+
+    def test_wide_values(self):
+        from nmigen.sim.npsim import Drive
+
+        a = Signal(64)
+        s = Signal(signed(65))
+        o = Signal(signed(73))
+        p = Signal(signed(72))
+        q = Signal(signed(64))
+        m = Module()
+        m.d.comb += [
+            o.eq(a * Const(-1, signed(8))),
+            p.eq(Const(2**64 - 1, 64) * Const(-1, signed(8))),
+            q.eq(Const(-3, signed(64)) // Const(2**64 - 1, 65)),
+        ]
+        sim = Simulator(m, engine="numpy", lanes=2)
+        def process():
+            yield Drive(a, [2**64 - 1, 1])
+            yield Settle()
+            self.assertEqual(list((yield a)), [2**64 - 1, 1])
+            self.assertEqual(list((yield o)), [-(2**64 - 1), -1])
+            self.assertEqual(list((yield p)), [-(2**64 - 1), -(2**64 - 1)])
+            self.assertEqual(list((yield q)), [-1, -1])
+            yield s.eq(1)
+            yield Settle()
+            self.assertEqual(list((yield s)), [1, 1])
+            yield Drive(s, [-2**64, 2**64 - 1])
+            yield Settle()
+            self.assertEqual(list((yield s)), [-2**64, 2**64 - 1])
+        sim.add_process(process)
+        sim.run()
+
+    def test_fsm(self):
+        from nmigen.sim.npsim import Drive
+
+        i = Signal(2)
+        o = Signal(8)
+        m = Module()
+        with m.FSM():
+            with m.State("A"):
+                with m.If(i == 1):
+                    m.next = "B"
+                with m.Elif(i == 2):
+                    m.next = "C"
+            with m.State("B"):
+                m.d.comb += o.eq(0xb)
+                with m.If(i == 2):
+                    m.next = "C"
+            with m.State("C"):
+                m.d.comb += o.eq(0xc)
+        sim = Simulator(m, engine="numpy", lanes=3)
+        sim.add_clock(1e-6)
+        def process():
+            yield Drive(i, [0, 1, 2])
+            yield
+            yield i.eq(0)
+            yield
+            yield Settle()
+            self.assertEqual(list((yield o)), [0, 0xb, 0xc])
+            yield i.eq(2)
+            yield
+            yield
+            yield Settle()
+            self.assertEqual(list((yield o)), [0xc, 0xc, 0xc])
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_memory(self):
+        from nmigen.sim.npsim import Drive
+
+        memory = Memory(width=8, depth=4, init=[1, 2, 3, 4])
+        m = Module()
+        m.submodules.rdport = rdport = memory.read_port(transparent=False)
+        m.submodules.wrport = wrport = memory.write_port()
+        sim = Simulator(m, engine="numpy", lanes=2)
+        sim.add_clock(1e-6)
+        def process():
+            yield Drive(wrport.addr, [1, 2])
+            yield Drive(wrport.data, [0x11, 0x22])
+            yield wrport.en.eq(1)
+            yield
+            yield wrport.en.eq(0)
+            yield Drive(rdport.addr, [2, 2])
+            yield
+            yield Settle()
+            self.assertEqual(list((yield rdport.data)), [3, 0x22])
+            self.assertEqual(list((yield memory[1])), [0x11, 2])
+            yield memory[3].eq(0x33)
+            yield rdport.addr.eq(3)
+            yield
+            yield Settle()
+            self.assertEqual(list((yield rdport.data)), [0x33, 0x33])
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_wide(self):
+        from nmigen.sim.npsim import Drive
+
+        i   = Signal(8)
+        acc = Signal(100)
+        m = Module()
+        m.d.sync += acc.eq((acc << 8) | i)
+        sim = Simulator(m, engine="numpy", lanes=2)
+        sim.add_clock(1e-6)
+        def process():
+            yield Drive(i, [0xff, 0x01])
+            for _ in range(13):
+                yield
+            self.assertEqual(list((yield acc)), [(1 << 96) - 1, int("01" * 12, 16)])
+            self.assertEqual(list((yield acc[88:])), [0xff, 0x01])
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_clock_lanes(self):
+        from nmigen.sim.npsim import Drive
+
+        count = Signal(4)
+        m = Module()
+        m.domains.sync = sync = ClockDomain()
+        m.d.sync += count.eq(count + 1)
+        sim = Simulator(m, engine="numpy", lanes=3)
+        def process():
+            yield Drive(sync.clk, [1, 0, 1])
+            yield Settle()
+            self.assertEqual(list((yield count)), [1, 0, 1])
+            yield Drive(sync.clk, [0, 1, 1])
+            yield Settle()
+            self.assertEqual(list((yield count)), [1, 1, 1])
+        sim.add_process(process)
+        sim.run()
+
+    def test_drive_wrong(self):
+        from nmigen.sim.npsim import Drive
+
+        a = Signal(4)
+        sim = Simulator(Module(), engine="numpy", lanes=3)
+        survived = False
+        def process():
+            nonlocal survived
+            with self.assertRaisesRegex(ValueError,
+                    r"^Command \(drive \(sig a\)\) from process .+ drives 2 values, "
+                    r"but the simulation has 3 lanes$"):
+                yield Drive(a, [1, 2])
+            yield Settle()
+            survived = True
+        sim.add_process(process)
+        sim.run()
+        self.assertTrue(survived)
+
+    def test_lanes_wrong(self):
+        with self.assertRaisesRegex(TypeError,
+                r"^Lane count must be a positive integer, not 0$"):
+            Simulator(Module(), engine="numpy", lanes=0)
+        with self.assertRaisesRegex(ValueError,
+                r"^VCD lane 3 is out of range$"):
+            Simulator(Module(), engine="numpy", lanes=3, vcd_lane=3)
+
+
+class RunParallelTestCase(FHDLTestCase):
+    def setUp_counter(self):
+        self.count = Signal(4)
+        self.m = Module()
+        self.m.d.sync += self.count.eq(self.count + 1)
+
+    def make_testbench(self, cycles, expected):
+        def testbench(sim):
+            sim.add_clock(1e-6)
+            def process():
+                for _ in range(cycles):
+                    yield
+                self.assertEqual((yield self.count), expected)
+            sim.add_sync_process(process)
+        return testbench
+
+    def assertResults(self, results):
+        self.assertEqual([result.name for result in results], ["good", "bad", "also_good"])
+        self.assertEqual([result.passed for result in results], [True, False, True])
+        self.assertIsInstance(results[1].exception, AssertionError)
+        self.assertIn("AssertionError", results[1].traceback)
+        self.assertIsNone(results[0].exception)
+        self.assertIsNone(results[0].traceback)
+
+    def test_parallel(self):
+        self.setUp_counter()
+        results = run_parallel(self.m, {
+            "good":      self.make_testbench(3, 3),
+            "bad":       self.make_testbench(3, 4),
+            "also_good": self.make_testbench(5, 5),
+        }, workers=2)
+        self.assertResults(results)
+
+    def test_serial(self):
+        self.setUp_counter()
+        results = run_parallel(self.m, {
+            "good":      self.make_testbench(3, 3),
+            "bad":       self.make_testbench(3, 4),
+            "also_good": self.make_testbench(5, 5),
+        }, workers=1)
+        self.assertResults(results)
+
+    def test_vcd(self):
+        self.setUp_counter()
+        def tb(sim):
+            sim.add_clock(1e-6)
+            def process():
+                yield
+            sim.add_sync_process(process)
+        with tempfile.TemporaryDirectory() as vcd_dir:
+            result, = run_parallel(self.m, [tb], workers=2, vcd_dir=vcd_dir)
+            self.assertTrue(result.passed)
+            self.assertEqual(result.vcd_file, os.path.join(vcd_dir, "tb.vcd"))
+            with open(result.vcd_file) as f:
+                self.assertIn("count", f.read())
+
+    def test_coverage(self):
+        self.setUp_counter()
+        results = run_parallel(self.m, {
+            "short": self.make_testbench(3, 3),
+            "long":  self.make_testbench(9, 9),
+        }, workers=2, coverage=True)
+        self.assertEqual(results[0].coverage.toggles["top.count"], (4, 0b0111, 0b0011))
+        self.assertEqual(results[1].coverage.toggles["top.count"], (4, 0b1111, 0b0111))
+        merged = Coverage.merge(result.coverage for result in results)
+        self.assertEqual(merged.toggles["top.count"], (4, 0b1111, 0b0111))
+
+    def test_wrong(self):
+        with self.assertRaisesRegex(TypeError,
+                r"^Worker count must be a positive integer, not 0$"):
+            run_parallel(Fragment(), [], workers=0)
+        def tb(sim):
+            pass
+        with self.assertRaisesRegex(ValueError,
+                r"^Testbench names must be unique$"):
+            run_parallel(Fragment(), [tb, tb])
+
+
+class CosimTestCase(FHDLTestCase):
+    def setUp_design(self):
+        self.a = Signal(8)
+        self.b = Signal(signed(8))
+        self.sum  = Signal(8)
+        self.diff = Signal(signed(9))
+        self.m = Module()
+        self.m.d.sync += [
+            self.sum.eq(self.a + self.b),
+            self.diff.eq(self.a - self.b),
+        ]
+
+    def run_model(self, connect, *, batch, cycles):
+        # Stand-in for a golden model running in another process: drives random stimulus, and
+        # checks the response against a model of the design.
+        import random
+        random.seed(0)
+        stimulus = [(random.randrange(256), random.randrange(-128, 128)) for _ in range(cycles)]
+        with connect() as client:
+            self.assertEqual(client.inputs,  [("a", 8, False), ("b", 8, True)])
+            self.assertEqual(client.outputs, [("sum", 8, False), ("diff", 9, True)])
+            self.assertEqual(client.batch, min(batch, 16))
+            responses = client.run(stimulus)
+        self.assertEqual(responses, [((a + b) & 0xff, ((a - b + 0x100) & 0x1ff) - 0x100)
+                                     for a, b in stimulus])
+
+    def run_cosim(self, endpoint, model):
+        import threading
+        errors = []
+        def run():
+            try:
+                model()
+            except Exception as exn:
+                errors.append(exn)
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            sim = Simulator(self.m)
+            sim.add_clock(1e-6)
+            sim.add_sync_process(endpoint().process)
+            sim.run()
+        finally:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def test_socketpair(self):
+        import socket
+        self.setUp_design()
+        endpoint_sock, client_sock = socket.socketpair()
+        endpoint = CosimEndpoint(endpoint_sock, inputs=[self.a, self.b],
+                                 outputs=[self.sum, self.diff], max_batch=16)
+        self.run_cosim(lambda: endpoint,
+            lambda: self.run_model(lambda: CosimClient(client_sock, batch=1000),
+                                   batch=1000, cycles=100))
+        self.assertEqual(endpoint.batch, 16)
+
+    @unittest.skipIf(not hasattr(__import__("socket"), "AF_UNIX"), "Unix sockets are unsupported")
+    def test_unix_socket(self):
+        import time
+        self.setUp_design()
+        path = os.path.join(tempfile.mkdtemp(), "cosim.sock")
+        def connect():
+            while True:
+                try:
+                    return CosimClient.connect(path, batch=4)
+                except (FileNotFoundError, ConnectionRefusedError):
+                    time.sleep(0.01)
+        self.run_cosim(lambda: CosimEndpoint.listen(path, inputs=[self.a, self.b],
+                                                    outputs=[self.sum, self.diff], max_batch=16),
+            lambda: self.run_model(connect, batch=4, cycles=10))
+        self.assertFalse(os.path.exists(path))
+
+    def test_wrong(self):
+        with self.assertRaisesRegex(TypeError,
+                r"^Co-simulation port must be a Signal, not \(const 1'd1\)$"):
+            CosimEndpoint(None, inputs=[Const(1)], outputs=[])
+        with self.assertRaisesRegex(TypeError,
+                r"^Maximum batch size must be a positive integer, not 0$"):
+            CosimEndpoint(None, inputs=[], outputs=[], max_batch=0)
+
+
+class SnapshotTestCase(FHDLTestCase):
+    def setUp_design(self):
+        self.count = Signal(8)
+        self.mem   = Memory(width=8, depth=4)
+        self.m = Module()
+        self.m.submodules.wrport = wrport = self.mem.write_port()
+        self.m.d.sync += self.count.eq(self.count + 1)
+        self.m.d.comb += [
+            wrport.addr.eq(self.count[:2]),
+            wrport.data.eq(self.count),
+            wrport.en.eq(1),
+        ]
+
+    def make_simulator(self, cycles=None, **kwargs):
+        sim = Simulator(self.m, **kwargs)
+        sim.add_clock(1e-6)
+        if cycles is not None:
+            def boot():
+                for _ in range(cycles):
+                    yield
+            sim.add_sync_process(boot)
+        return sim
+
+    def record(self, sim, trace):
+        def process():
+            for _ in range(6):
+                values = [(yield self.count)]
+                for addr in range(4):
+                    values.append((yield self.mem[addr]))
+                trace.append(values)
+                yield
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_restore(self):
+        self.setUp_design()
+        sim = self.make_simulator(cycles=10)
+        sim.run()
+        snapshot = pickle.loads(pickle.dumps(sim.snapshot()))
+        now = sim._engine.now
+        trace1 = []
+        self.record(sim, trace1)
+        self.assertEqual(trace1[0], [11, 8, 9, 10, 7])
+
+        # Restore into a simulator of an identical design, as if in another process.
+        self.setUp_design()
+        sim = self.make_simulator()
+        sim.restore(snapshot)
+        self.assertEqual(sim._engine.now, now)
+        trace2 = []
+        self.record(sim, trace2)
+        self.assertEqual(trace1, trace2)
+
+        # Restore into the same simulator again.
+        sim.restore(snapshot)
+        trace3 = []
+        self.record(sim, trace3)
+        self.assertEqual(trace1, trace3)
+
+    def test_wrong(self):
+        self.setUp_design()
+        snapshot = self.make_simulator().snapshot()
+        sim = Simulator(Module())
+        with self.assertRaisesRegex(ValueError,
+                r"^Snapshot was taken from a different design$"):
+            sim.restore(snapshot)
+        with self.assertRaisesRegex(TypeError,
+                r"^Object None is not a snapshot taken by this simulation engine$"):
+            sim.restore(None)
+
+
+class TimelineTestCase(FHDLTestCase):
+    class MockProcess:
+        def __init__(self):
+            self.runnable = False
+
+    def test_order(self):
+        timeline = _Timeline([])
+        p1, p2, p3 = self.MockProcess(), self.MockProcess(), self.MockProcess()
+        timeline.delay(3e-6, p1)
+        timeline.delay(1e-6, p2)
+        timeline.delay(2e-6, p3)
+        self.assertTrue(timeline.advance())
+        self.assertEqual(timeline.now, 1e-6)
+        self.assertEqual((p1.runnable, p2.runnable, p3.runnable), (False, True, False))
+        self.assertTrue(timeline.advance())
+        self.assertEqual(timeline.now, 2e-6)
+        self.assertTrue(p3.runnable)
+        self.assertTrue(timeline.advance())
+        self.assertEqual(timeline.now, 3e-6)
+        self.assertTrue(p1.runnable)
+        self.assertFalse(timeline.advance())
+
+    def test_same_time(self):
+        timeline = _Timeline([])
+        p1, p2, p3 = self.MockProcess(), self.MockProcess(), self.MockProcess()
+        timeline.delay(1e-6, p1)
+        timeline.delay(2e-6, p2)
+        timeline.delay(1e-6, p3)
+        self.assertTrue(timeline.advance())
+        self.assertEqual(timeline.now, 1e-6)
+        self.assertEqual((p1.runnable, p2.runnable, p3.runnable), (True, False, True))
+
+    def test_settle(self):
+        timeline = _Timeline([])
+        p1, p2 = self.MockProcess(), self.MockProcess()
+        timeline.delay(1e-6, p1)
+        self.assertTrue(timeline.advance())
+        timeline.delay(1e-6, p1)
+        timeline.delay(None, p2)
+        self.assertTrue(timeline.advance())
+        self.assertEqual(timeline.now, 1e-6)
+        self.assertTrue(p2.runnable)
+        self.assertTrue(timeline.advance())
+        self.assertEqual(timeline.now, 2e-6)
+
+    def test_reset(self):
+        timeline = _Timeline([])
+        timeline.delay(1e-6, self.MockProcess())
+        timeline.advance()
+        timeline.delay(1e-6, self.MockProcess())
+        timeline.reset()
+        self.assertEqual(timeline.now, 0.0)
+        self.assertFalse(timeline.advance())